@@ -1,9 +1,6 @@
 import streamlit as st
-import pandas as pd
-import plotly.graph_objects as go
-from fpdf import FPDF
-import base64
-from datetime import datetime
+import os
+import sys
 
 # ------------------------------
 # Конфигурация страницы — САМАЯ ПЕРВАЯ
@@ -18,13 +15,20 @@ st.set_page_config(
 # ------------------------------
 # Импорт модулей
 # ------------------------------
-from modules.auth import check_authentication
-from modules.interview_manager import (
-    init_interview_state, add_respondent, update_respondent, delete_respondent,
-    get_aggregated_scores, get_consensus_score, get_disagreement_areas
-)
-from modules.database import init_db, save_audit, get_audit_history, get_audit_by_id, delete_audit, get_company_list
-from modules.playbook_generator import generate_playbook, format_playbook_for_display, export_playbook_to_markdown
+from modules import metrics
+from modules.auth import check_authentication, is_admin
+from modules.write_behind import enqueue_save_audit, enqueue_delete_audit, get_write_stats
+from modules.database import init_db, get_audit_history_page, get_audit_by_id, get_audit_chart, list_drafts, search_companies, search_audits, get_company_trends, get_pool_stats
+
+if "--profile-startup" in sys.argv[1:]:
+    # streamlit run app.py -- --profile-startup : отчёт о времени импортов в консоль сервера
+    from modules.startup_profile import print_report_once
+    print_report_once()
+
+# Счётчики времени текущего перезапуска; прошлый перезапуск остаётся для админ-панели
+metrics.begin_rerun(st.session_state)
+if os.environ.get("AVCS_METRICS_PORT"):
+    metrics.start_http_server(int(os.environ["AVCS_METRICS_PORT"]))
 
 # ------------------------------
 # Инициализация БД
@@ -44,10 +48,27 @@ if authentication_status == None:
     st.warning("Please enter your credentials")
     st.stop()
 
+# ------------------------------
+# Модули рабочих страниц импортируются после входа: экран логина их не грузит.
+# Тяжёлые зависимости (Plotly, FPDF, pandas) подгружаются ещё позже —
+# внутри функций, которые их используют.
+# ------------------------------
+from modules.interview_manager import (
+    init_interview_state, add_respondent, add_respondents, update_respondent, delete_respondent,
+    get_aggregated_scores, get_consensus_score, get_disagreement_areas, resume_draft, finish_draft
+)
+from modules.aggregation import PILLARS, ROLES
+from modules.scoring import PILLAR_DEFINITIONS, QUESTION_KEYS, QUESTION_OPTIONS, CLASSIFICATIONS, cls_from_score, score_pillar
+from modules.report_generator import get_pdf, get_pdf_cache_stats, pdf_cache_key
+from modules.charts import RADAR_CATEGORIES, create_radar_chart, create_trend_chart, radar_cache_info
+from modules.batch_export import discard_export, export_audits_zip, export_audits_merged_pdf, new_export_file
+from modules.bulk_import import import_respondents
+from modules.playbook_generator import get_or_generate_playbook, get_saved_audit_playbook
+
 # ------------------------------
 # Инициализация состояния
 # ------------------------------
-init_interview_state()
+init_interview_state(owner=username)
 
 if 'step' not in st.session_state:
     st.session_state.step = 1
@@ -71,6 +92,10 @@ if 'last_aggregated' not in st.session_state:
     st.session_state.last_aggregated = None
 if 'last_disagreements' not in st.session_state:
     st.session_state.last_disagreements = None
+if 'history_cursors' not in st.session_state:
+    st.session_state.history_cursors = [None]  # курсор начала каждой открытой страницы
+if 'history_filters' not in st.session_state:
+    st.session_state.history_filters = None
 
 # ------------------------------
 # Стили CSS
@@ -108,6 +133,399 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# ------------------------------
+# Фрагменты: перезапускаются отдельно от остального скрипта.
+# Действия внутри фрагмента меняют состояние через on_click-колбэки;
+# полный st.rerun() нужен только при смене страницы.
+# ------------------------------
+def _delete_respondent(index):
+    delete_respondent(index)
+    # список респондентов виден и на основной странице (шаги 1 и 7) — её тоже надо обновить
+    if st.session_state.step in (1, 7):
+        st.session_state.respondents_page_stale = True
+
+
+@st.experimental_fragment
+def respondent_sidebar():
+    """Список респондентов в боковой панели; удаление перерисовывает только его"""
+    if st.session_state.pop('respondents_page_stale', False):
+        st.rerun()
+
+    st.markdown(f"**Respondents:** {len(st.session_state.respondents)}")
+
+    if st.session_state.respondents:
+        st.markdown("### Respondent List")
+        for i, resp in enumerate(st.session_state.respondents):
+            with st.expander(f"{resp['role']}: {resp['name']}"):
+                st.write(f"Trigger: {resp['scores']['trigger_clarity']}/5")
+                st.write(f"Ownership: {resp['scores']['decision_ownership']}/5")
+                st.write(f"Intervention: {resp['scores']['protected_intervention']}/5")
+                st.write(f"Override: {resp['scores']['override_transparency']}/5")
+                st.write(f"Drift: {resp['scores']['drift_detection']}/5")
+                st.button("Delete", key=f"del_{i}", on_click=_delete_respondent, args=(i,))
+
+
+def _resume_draft(draft_id):
+    if resume_draft(draft_id.strip()):
+        st.session_state.step = 1
+    else:
+        st.session_state.draft_error = f"Draft {draft_id} not found"
+
+
+def drafts_panel(username):
+    """Черновики на сервере: ID текущего и продолжение незавершённых"""
+    with st.expander("💾 Drafts"):
+        if st.session_state.get('draft_id'):
+            st.caption(f"Autosaved as draft `{st.session_state.draft_id}`")
+        if st.session_state.get('draft_error'):
+            st.warning(st.session_state.pop('draft_error'))
+        for draft in list_drafts(username):
+            if draft['id'] == st.session_state.get('draft_id'):
+                continue
+            st.button(f"Resume {draft['id'][:8]} ({draft['updated_at']})", key=f"resume_{draft['id']}",
+                      on_click=_resume_draft, args=(draft['id'],))
+        draft_id = st.text_input("Draft ID", key="resume_draft_id")
+        if draft_id:
+            st.button("Resume by ID", on_click=_resume_draft, args=(draft_id,))
+
+
+def _write_error(future):
+    error = future.exception()
+    return str(error) or type(error).__name__
+
+
+def resolve_pending_deletes():
+    """
+    Разбирает завершённые фоновые удаления. Пока удаление в очереди, аудит
+    скрыт из списка; ошибка возвращает его и показывается один раз.
+    """
+    pending = st.session_state.setdefault('pending_deletes', {})
+    for audit_id, future in list(pending.items()):
+        if future.done():
+            del pending[audit_id]
+            if future.exception() is not None:
+                st.error(f"Error deleting audit #{audit_id}: {_write_error(future)}")
+
+
+def request_delete(audit_id):
+    """Ставит удаление в очередь (повторный клик не ставит второе)"""
+    pending = st.session_state.setdefault('pending_deletes', {})
+    if audit_id not in pending:
+        pending[audit_id] = enqueue_delete_audit(audit_id)
+
+
+def _save_request_key(company_name, location):
+    """Что именно сохраняется: тот же набор респондентов и реквизиты — та же запись"""
+    return st.session_state.get('respondents_version', 0), company_name, location
+
+
+def request_save(company_name, location, **audit):
+    """
+    Ставит сохранение аудита в очередь и сразу возвращается. Пока запись для
+    тех же данных в очереди или уже прошла, повторный клик второй аудит не создаёт.
+    """
+    key = _save_request_key(company_name, location)
+    pending = st.session_state.get('pending_save')
+    if pending is not None and pending['key'] == key:
+        return
+    draft_id = st.session_state.get('draft_id')
+    audit_id, future = enqueue_save_audit(company_name=company_name, location=location, draft_id=draft_id, **audit)
+    st.session_state.pending_save = {'key': key, 'audit_id': audit_id, 'future': future, 'draft_id': draft_id}
+
+
+def _show_save_result(pending):
+    future = pending['future']
+    if future.exception() is not None:
+        # запись не прошла — аудита нет, черновик открыт; повторный клик поставит запись заново
+        st.session_state.pending_save = None
+        st.error(f"Error saving audit: {_write_error(future)}")
+        return
+    if pending['draft_id'] is not None and st.session_state.get('draft_id') == pending['draft_id']:
+        finish_draft()
+    st.success(f"Audit saved! ID: {pending['audit_id']}")
+
+
+@st.experimental_fragment(run_every=1)
+def _pending_save_status():
+    """Опрашивает запись в очереди; по завершении перезапускает страницу с итогом"""
+    pending = st.session_state.get('pending_save')
+    if pending is not None and not pending['future'].done():
+        st.info(f"Saving audit #{pending['audit_id']}…")
+    else:
+        st.rerun()
+
+
+def save_status():
+    """Статус последнего сохранения: в очереди (опрос без блокировки страницы) или итог"""
+    pending = st.session_state.get('pending_save')
+    if pending is None:
+        return
+    if pending['future'].done():
+        _show_save_result(pending)
+    else:
+        _pending_save_status()
+
+
+def _submit_pillar_step(pillar_def):
+    st.session_state.answers.update({k: st.session_state[k] for k in QUESTION_KEYS if k in st.session_state})
+    st.session_state.scores[pillar_def['id']] = score_pillar(pillar_def['id'], st.session_state.answers)
+    st.session_state.step = 8 if st.session_state.step == 6 else st.session_state.step + 1
+
+
+@st.experimental_fragment
+def pillar_step():
+    """Шаги 2–6 мастера; переход между ними перерисовывает только этот фрагмент"""
+    step = st.session_state.step
+    if not 2 <= step <= 6:
+        # последний шаг пройден — дальше другая страница
+        st.rerun()
+
+    st.progress((step - 1) / 6, text=f"Step {step} of 6")
+
+    # Формы шагов 2–6 строятся из декларативного описания анкеты
+    pillar_def = PILLAR_DEFINITIONS[step - 2]
+    st.markdown(f"""
+    <div class="pillar-card">
+        <h2>{pillar_def['title']}</h2>
+        <p>{pillar_def['subtitle']}</p>
+    </div>
+    """, unsafe_allow_html=True)
+    with st.form(pillar_def['form']):
+        for question in pillar_def['questions']:
+            st.radio(question['text'], QUESTION_OPTIONS[question['key']], key=question['key'])
+        st.form_submit_button(pillar_def['submit_label'], on_click=_submit_pillar_step, args=(pillar_def,))
+
+
+def _prepare_download(key, token):
+    st.session_state.prepared_downloads[key] = token
+
+
+@st.experimental_fragment
+def on_demand_download(label, key, file_name, mime, build, token=True):
+    """
+    Кнопка скачивания, которая строит файл только по нажатию.
+    Байты отдаются медиа-эндпоинтом Streamlit по HTTP (с поддержкой Range),
+    а в страницу попадает лишь ссылка — размер файла не влияет на рендер.
+    build — функция без аргументов, возвращающая bytes; token — версия
+    содержимого: при её смене файл нужно подготовить заново.
+    """
+    prepared = st.session_state.setdefault('prepared_downloads', {})
+    if prepared.get(key) != token:
+        st.button(label, key=f"prepare_{key}", on_click=_prepare_download, args=(key, token))
+        return
+
+    try:
+        with st.spinner("Preparing file..."):
+            data = build()
+        st.download_button(f"📥 {label}", data, file_name=file_name, mime=mime, key=f"download_{key}")
+    except Exception as e:
+        st.error(f"Error preparing {file_name}: {e}")
+
+
+def _history_newer():
+    st.session_state.history_cursors.pop()
+
+
+def _history_older(cursor):
+    st.session_state.history_cursors.append(cursor)
+
+
+def _discard_batch_export():
+    """Удаляет файл прошлой пакетной выгрузки сессии"""
+    export = st.session_state.pop('batch_export', None)
+    if export:
+        discard_export(export[0])
+
+
+def company_trend(company):
+    """Динамика оценок компании: последние изменения по pillars и график по аудитам"""
+    trend = get_company_trends(company)
+    audits = trend['audits']
+    if len(audits) < 2:
+        st.info("At least two audits of this company are needed to show a trend.")
+        return
+
+    latest = audits[-1]
+    st.caption(f"{len(audits)} audits, latest on {latest['audit_date']}; changes are against the previous audit")
+    cols = st.columns(len(PILLARS) + 1)
+    cols[0].metric("Total", f"{latest['total_score']:.1f}",
+                   f"{latest['total_delta']:+.1f}" if latest['total_delta'] is not None else None)
+    for col, label, pillar in zip(cols[1:], RADAR_CATEGORIES, PILLARS):
+        series = trend['pillars'][pillar]
+        score, delta = series['score'][-1], series['delta'][-1]
+        col.metric(label, f"{score:.1f}" if score is not None else "—",
+                   f"{delta:+.1f}" if delta is not None else None)
+
+    rolling = st.checkbox("Show rolling average", key="trend_rolling")
+    st.plotly_chart(create_trend_chart(trend, rolling=rolling), use_container_width=True)
+
+
+def audit_rows(rows, key_prefix="view"):
+    """Строки списка аудитов с кнопкой просмотра; у результатов поиска — фрагмент совпадения"""
+    deleting = st.session_state.get('pending_deletes', {})
+    for row in rows:
+        if row['id'] in deleting:
+            continue
+        with st.container():
+            cols = st.columns([3,1,1,1])
+            cols[0].markdown(f"**{row['audit_date']}** — {row['company_name'] or 'N/A'}")
+            if row.get('snippet'):
+                cols[0].caption(row['snippet'])
+            cols[1].markdown(f"Score: {row['total_score']:.1f}/25")
+            cols[2].markdown(f"{row['classification']}")
+            if cols[3].button("View", key=f"{key_prefix}_{row['id']}"):
+                st.session_state.selected_audit = row['id']
+                st.rerun()
+
+
+@st.experimental_fragment
+def history_list(practitioner, username):
+    """Список аудитов с фильтрами и постраничной навигацией; листание не перезапускает страницу"""
+    search_text = st.text_input("🔎 Search audits", key="history_search",
+                                placeholder="Company, location, respondent name or role, playbook text")
+    if search_text.strip():
+        results = search_audits(search_text, practitioner)
+        st.markdown(f"### Search results ({len(results)})")
+        if not results:
+            st.info("Nothing matches your search.")
+        else:
+            audit_rows(results, key_prefix="search_view")
+        return
+
+    col1, col2, col3 = st.columns([2,1,1])
+    with col1:
+        st.markdown("### Past Audits")
+    with col2:
+        company_prefix = st.text_input("Search company", placeholder="Type the first letters")
+    with col3:
+        # в списке — совпадения по префиксу (или недавние компании); текущий выбор сохраняется
+        options = ["All"] + search_companies(company_prefix.strip())
+        current = st.session_state.get('history_company', "All")
+        if current not in options:
+            options.insert(1, current)
+        company_filter = st.selectbox("Filter by company", options, index=options.index(current))
+        st.session_state.history_company = company_filter
+
+    colF1, colF2, colF3 = st.columns(3)
+    with colF1:
+        date_from = st.date_input("From", value=None)
+    with colF2:
+        date_to = st.date_input("To", value=None)
+    with colF3:
+        classification_filter = st.selectbox("Classification", ["All"] + CLASSIFICATIONS)
+
+    # При смене фильтров начинаем с первой страницы
+    filters = (company_filter, date_from, date_to, classification_filter)
+    if st.session_state.history_filters != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_cursors = [None]
+
+    if company_filter != "All":
+        with st.expander(f"📈 Trend for {company_filter}"):
+            company_trend(company_filter)
+
+    rows, next_cursor = get_audit_history_page(
+        practitioner,
+        company=None if company_filter == "All" else company_filter,
+        date_from=date_from,
+        date_to=date_to,
+        classification=None if classification_filter == "All" else classification_filter,
+        after_cursor=st.session_state.history_cursors[-1]
+    )
+
+    if not rows:
+        st.info("No audits found. Start by creating a new audit.")
+    else:
+        audit_rows(rows)
+
+    with st.expander("📦 Batch export (uses the filters above)"):
+        export_format = st.radio("Format", ["ZIP of PDFs", "Single merged PDF"], horizontal=True)
+        if st.button("Export matching audits"):
+            progress_bar = st.progress(0.0)
+            # прошлая выгрузка сессии больше не нужна; новая — в собственном временном файле
+            _discard_batch_export()
+            export_path = new_export_file(".zip" if export_format == "ZIP of PDFs" else ".pdf")
+            export_args = dict(
+                practitioner=practitioner,
+                company=None if company_filter == "All" else company_filter,
+                date_from=date_from,
+                date_to=date_to,
+                classification=None if classification_filter == "All" else classification_filter,
+                progress_callback=lambda done, total: progress_bar.progress(done / total, text=f"{done}/{total} audits")
+            )
+            try:
+                if export_format == "ZIP of PDFs":
+                    count = export_audits_zip(export_path, **export_args)
+                else:
+                    count = export_audits_merged_pdf(export_path, **export_args)
+                if count:
+                    st.session_state.batch_export = (export_path, count)
+                else:
+                    discard_export(export_path)
+                    st.info("No audits match the current filters.")
+            except Exception as e:
+                discard_export(export_path)
+                st.error(f"Error exporting audits: {e}")
+
+        if st.session_state.get('batch_export'):
+            export_path, count = st.session_state.batch_export
+            if os.path.exists(export_path):
+                with open(export_path, "rb") as f:
+                    st.download_button(f"📥 Download {count} reports", f,
+                                       file_name=f"avcs_export_{username}{os.path.splitext(export_path)[1]}")
+
+    page = len(st.session_state.history_cursors)
+    colP1, colP2, colP3 = st.columns([1,2,1])
+    with colP1:
+        if page > 1:
+            st.button("← Newer", on_click=_history_newer)
+    with colP2:
+        st.markdown(f"Page {page}")
+    with colP3:
+        if next_cursor:
+            st.button("Older →", on_click=_history_older, args=(next_cursor,))
+
+def _toggle_metrics():
+    if st.session_state.metrics_enabled:
+        metrics.enable()
+    else:
+        metrics.disable()
+
+
+def performance_panel():
+    """Админ-панель: время прошлого перезапуска, гистограммы вызовов и состояние кэшей"""
+    with st.expander("⏱️ Performance"):
+        st.checkbox("Collect timings", value=metrics.is_enabled(), key="metrics_enabled", on_change=_toggle_metrics)
+
+        total, rows = metrics.last_rerun(st.session_state)
+        if total is not None:
+            st.markdown(f"**Last rerun:** {total * 1000:.1f} ms")
+        if rows:
+            st.dataframe(
+                [{'call': n, 'calls': c, 'ms': round(sec * 1000, 2)} for n, c, sec in rows],
+                use_container_width=True, hide_index=True
+            )
+
+        histograms = metrics.snapshot()
+        if histograms:
+            st.markdown("**Since start**")
+            st.dataframe(
+                [{'call': n, 'calls': h['count'], 'avg ms': round(h['sum'] * 1000 / h['count'], 2)}
+                 for n, h in histograms.items()],
+                use_container_width=True, hide_index=True
+            )
+        st.download_button("Prometheus export", metrics.render_prometheus(), file_name="avcs_metrics.prom",
+                           mime="text/plain")
+
+        pool, pdf, radar, writes = get_pool_stats(), get_pdf_cache_stats(), radar_cache_info(), get_write_stats()
+        st.caption(
+            f"DB pool: {pool['hits']} hits / {pool['misses']} misses, {pool['idle']} idle  \n"
+            f"PDF cache: {pdf['hits']} hits / {pdf['misses']} misses, avg render {pdf['avg_render_ms']:.0f} ms  \n"
+            f"Radar cache: {radar.hits} hits / {radar.misses} misses  \n"
+            f"Write queue: {writes['queue_depth']} pending, {writes['batches']} batches, "
+            f"avg flush {writes['avg_flush_ms']:.1f} ms, {writes['retries']} retries, {writes['dropped']} dropped"
+        )
+
 # ------------------------------
 # Боковая панель
 # ------------------------------
@@ -133,33 +551,14 @@ with st.sidebar:
         st.rerun()
     
     st.markdown("---")
+
+    if is_admin(username):
+        performance_panel()
+        st.markdown("---")
     
     if st.session_state.view_mode == 'new':
-        st.markdown(f"**Respondents:** {len(st.session_state.respondents)}")
-        
-        if st.session_state.respondents:
-            st.markdown("### Respondent List")
-            for i, resp in enumerate(st.session_state.respondents):
-                with st.expander(f"{resp['role']}: {resp['name']}"):
-                    st.write(f"Trigger: {resp['scores']['trigger_clarity']}/5")
-                    st.write(f"Ownership: {resp['scores']['decision_ownership']}/5")
-                    st.write(f"Intervention: {resp['scores']['protected_intervention']}/5")
-                    st.write(f"Override: {resp['scores']['override_transparency']}/5")
-                    st.write(f"Drift: {resp['scores']['drift_detection']}/5")
-                    if st.button(f"Delete", key=f"del_{i}"):
-                        delete_respondent(i)
-                        st.rerun()
-        
-        st.markdown("---")
-        st.markdown("## Progress")
-        step = st.session_state.step
-        progress = (step - 1) / 6
-        if progress < 0:
-            progress = 0.0
-        elif progress > 1:
-            progress = 1.0
-        st.progress(progress)
-        st.markdown(f"**Step {step} of 6**")
+        respondent_sidebar()
+        drafts_panel(username)
 
 # ------------------------------
 # Заголовок
@@ -179,173 +578,15 @@ else:
     </div>
     """, unsafe_allow_html=True)
 
-# ------------------------------
-# Функции расчёта
-# ------------------------------
-def calculate_trigger_score(answers):
-    score = 0
-    if answers.get('q1_1') == "Yes, mandatory and enforced": score += 2
-    elif answers.get('q1_1') == "Yes, but discretionary": score += 1
-    if answers.get('q1_2') == "No, all deviations tracked": score += 2
-    elif answers.get('q1_2') == "Sometimes noticed": score += 1
-    if answers.get('q1_3') == "Automatic": score += 1
-    return min(score, 5)
-
-def calculate_ownership_score(answers):
-    score = 0
-    if answers.get('q2_1') == "Yes, singular owner defined": score += 2
-    elif answers.get('q2_1') == "Shared but clear": score += 1
-    if answers.get('q2_2') == "Yes, always present": score += 2
-    elif answers.get('q2_2') == "Usually present": score += 1
-    if answers.get('q2_3') == "No, never": score += 1
-    return min(score, 5)
-
-def calculate_intervention_score(answers):
-    score = 0
-    if answers.get('q3_1') == "Yes, formally codified and protected": score += 2
-    elif answers.get('q3_1') == "Yes, but informally": score += 1
-    if answers.get('q3_2') == "Always supported": score += 2
-    elif answers.get('q3_2') == "Usually supported": score += 1
-    if answers.get('q3_3') == "No, never": score += 1
-    return min(score, 5)
-
-def calculate_override_score(answers):
-    score = 0
-    if answers.get('q4_1') == "No, always documented": score += 2
-    elif answers.get('q4_1') == "Sometimes documented": score += 1
-    if answers.get('q4_2') == "Yes, always": score += 2
-    elif answers.get('q4_2') == "Sometimes": score += 1
-    if answers.get('q4_3') == "Yes, regularly": score += 1
-    return min(score, 5)
-
-def calculate_drift_score(answers):
-    score = 0
-    if answers.get('q5_1') == "Yes, systematically": score += 2
-    elif answers.get('q5_1') == "Sometimes": score += 1
-    if answers.get('q5_2') == "Yes, regularly": score += 2
-    elif answers.get('q5_2') == "Occasionally": score += 1
-    if answers.get('q5_3') == "Yes, actively": score += 1
-    return min(score, 5)
-
-# ------------------------------
-# Функция для радара
-# ------------------------------
-def create_radar_chart(scores_dict):
-    categories = ['Trigger Clarity', 'Decision Ownership', 'Protected Intervention',
-                  'Override Transparency', 'Drift Detection']
-    values = [scores_dict[p] for p in ['trigger_clarity','decision_ownership',
-                                        'protected_intervention','override_transparency',
-                                        'drift_detection']]
-    fig = go.Figure(data=go.Scatterpolar(
-        r=values + [values[0]],
-        theta=categories + [categories[0]],
-        fill='toself', line_color='#1e3a8a',
-        fillcolor='rgba(30,58,138,0.3)'
-    ))
-    fig.update_layout(
-        polar=dict(radialaxis=dict(visible=True, range=[0,5])),
-        showlegend=False, height=400,
-        margin=dict(l=80, r=80, t=20, b=20)
-    )
-    return fig
-
-# ------------------------------
-# Функция для PDF
-# ------------------------------
-def create_pdf(scores, total_score, company="", location=""):
-    pdf = FPDF()
-    pdf.add_page()
-    
-    try:
-        pdf.image("logo.png", x=10, y=8, w=30)
-        pdf.ln(15)
-    except:
-        pdf.ln(10)
-    
-    pdf.set_font('Arial','B',16)
-    pdf.cell(0,10,'AVCS Structural Integrity Module Report',0,1,'C')
-    pdf.ln(10)
-    
-    pdf.set_font('Arial','',10)
-    pdf.cell(0,10,f'Generated: {datetime.now().strftime("%Y-%m-%d %H:%M")}',0,1,'R')
-    pdf.ln(5)
-    
-    pdf.set_font('Arial','I',10)
-    pdf.cell(0,10,f'Certified AVCS Practitioner: {name} (ID: #001)',0,1,'L')
-    if company:
-        pdf.cell(0,10,f'Company: {company}',0,1,'L')
-    if location:
-        pdf.cell(0,10,f'Location: {location}',0,1,'L')
-    pdf.ln(5)
-    
-    pdf.set_font('Arial','B',12)
-    pdf.cell(0,10,f'Total Structural Integrity Score: {total_score:.1f} / 25',0,1)
-    
-    if total_score <= 10: cls = "HIGH STRUCTURAL VULNERABILITY"
-    elif total_score <= 17: cls = "CONDITIONAL STABILITY"
-    elif total_score <= 22: cls = "STRUCTURALLY CONTROLLED"
-    else: cls = "ARCHITECTURALLY RESILIENT"
-    
-    pdf.set_font('Arial','B',12)
-    pdf.cell(0,10,f'Classification: {cls}',0,1)
-    pdf.ln(10)
-    
-    pdf.set_font('Arial','B',12)
-    pdf.cell(0,10,'Pillar Scores:',0,1)
-    pdf.set_font('Arial','',12)
-    
-    pillars = [
-        ('Trigger Clarity', scores['trigger_clarity']),
-        ('Decision Ownership', scores['decision_ownership']),
-        ('Protected Intervention', scores['protected_intervention']),
-        ('Override Transparency', scores['override_transparency']),
-        ('Drift Detection', scores['drift_detection'])
-    ]
-    
-    for p,s in pillars:
-        pdf.cell(0,10,f'{p}: {s:.1f}/5',0,1)
-    
-    pdf.ln(10)
-    
-    pdf.set_y(-30)
-    pdf.set_font('Arial','I',8)
-    pdf.cell(0,10,'AVCS Structural Integrity Module',0,1,'C')
-    pdf.cell(0,10,'© 2026 Yeruslan Chihachyov, Operational Excellence Delivered Consulting',0,1,'C')
-    
-    pdf_bytes = pdf.output()
-    return base64.b64encode(pdf_bytes).decode('utf-8')
-
-def cls_from_score(score):
-    if score <= 10: return "HIGH STRUCTURAL VULNERABILITY"
-    elif score <= 17: return "CONDITIONAL STABILITY"
-    elif score <= 22: return "STRUCTURALLY CONTROLLED"
-    else: return "ARCHITECTURALLY RESILIENT"
-
 # ------------------------------
 # Страница истории аудитов
 # ------------------------------
 if st.session_state.view_mode == 'history':
+    resolve_pending_deletes()
+    if st.session_state.selected_audit in st.session_state.pending_deletes:
+        st.session_state.selected_audit = None
     if st.session_state.selected_audit is None:
-        col1, col2 = st.columns([2,1])
-        with col1:
-            st.markdown("### Past Audits")
-        with col2:
-            company_filter = st.selectbox("Filter by company", ["All"] + get_company_list())
-        
-        df = get_audit_history(practitioner_name=name, limit=100)
-        
-        if len(df) == 0:
-            st.info("No audits found. Start by creating a new audit.")
-        else:
-            for _, row in df.iterrows():
-                with st.container():
-                    cols = st.columns([3,1,1,1])
-                    cols[0].markdown(f"**{row['audit_date']}** — {row['company_name'] or 'N/A'}")
-                    cols[1].markdown(f"Score: {row['total_score']:.1f}/25")
-                    cols[2].markdown(f"{row['classification']}")
-                    if cols[3].button("View", key=f"view_{row['id']}"):
-                        st.session_state.selected_audit = row['id']
-                        st.rerun()
+        history_list(name, username)
     else:
         audit = get_audit_by_id(st.session_state.selected_audit)
         if audit:
@@ -372,6 +613,16 @@ if st.session_state.view_mode == 'history':
             st.markdown("### Respondents")
             for r in audit['respondents']:
                 st.markdown(f"- **{r['role']}:** {r['name']}")
+
+            stored_playbook = get_saved_audit_playbook(audit['id'], audit['audit_date'])
+            if stored_playbook:
+                _, playbook_markdown = stored_playbook
+                with st.expander("📋 Action Playbook"):
+                    st.markdown(playbook_markdown)
+                    on_demand_download(
+                        "Download Playbook (Markdown)", f"audit_playbook_{audit['id']}",
+                        f"AVCS_Playbook_{audit['id']}.md", "text/markdown", lambda: playbook_markdown.encode("utf-8")
+                    )
             
             colX, colY, colZ = st.columns(3)
             with colX:
@@ -379,12 +630,15 @@ if st.session_state.view_mode == 'history':
                     st.session_state.selected_audit = None
                     st.rerun()
             with colY:
-                pdf_data = create_pdf(audit['scores'], audit['total_score'], audit['company_name'], audit['location'])
-                href = f'<a href="data:application/octet-stream;base64,{pdf_data}" download="AVCS_Audit_{audit["id"]}.pdf"><button style="background-color:#1e3a8a; color:white; padding:8px 16px;">📥 Download PDF</button></a>'
-                st.markdown(href, unsafe_allow_html=True)
+                on_demand_download(
+                    "Download PDF", f"audit_pdf_{audit['id']}", f"AVCS_Audit_{audit['id']}.pdf", "application/pdf",
+                    lambda: get_pdf(audit['scores'], audit['total_score'], audit['company_name'],
+                                    audit['location'], audit['practitioner_name'], get_audit_chart(audit['id']))
+                )
             with colZ:
                 if st.button("🗑️ Delete", type="primary"):
-                    delete_audit(audit['id'])
+                    # удаление пишется в фоне; до коммита аудит скрыт из списка
+                    request_delete(audit['id'])
                     st.session_state.selected_audit = None
                     st.rerun()
         else:
@@ -428,141 +682,43 @@ elif st.session_state.view_mode == 'new':
                     st.session_state.step = 7
                     st.rerun()
 
-    elif st.session_state.step == 2:
-        st.markdown("""
-        <div class="pillar-card">
-            <h2>1. Trigger Clarity</h2>
-            <p>Are escalation conditions mandatory or interpretive?</p>
-        </div>
-        """, unsafe_allow_html=True)
-        with st.form("trigger_form"):
-            q1 = st.radio(
-                "Are critical deviation thresholds mandatory and enforced, or discretionary?",
-                ["Yes, mandatory and enforced","Yes, but discretionary","No clear thresholds"], key='q1_1'
-            )
-            q2 = st.radio(
-                "Can deviations exist without crossing formal limits?",
-                ["No, all deviations tracked","Sometimes noticed","Yes, often unnoticed"], key='q1_2'
-            )
-            q3 = st.radio(
-                "Is escalation automatic or requires human decision?",
-                ["Automatic","Requires decision","Often doesn't happen"], key='q1_3'
-            )
-            if st.form_submit_button("Next →"):
-                st.session_state.answers.update(st.session_state)
-                st.session_state.scores['trigger_clarity'] = calculate_trigger_score(st.session_state.answers)
-                st.session_state.step = 3
-                st.rerun()
-
-    elif st.session_state.step == 3:
-        st.markdown("""
-        <div class="pillar-card">
-            <h2>2. Decision Ownership</h2>
-            <p>Is accountability singular and real-time?</p>
-        </div>
-        """, unsafe_allow_html=True)
-        with st.form("ownership_form"):
-            q1 = st.radio(
-                "Is a single accountable owner defined for critical decisions?",
-                ["Yes, singular owner defined","Shared but clear","Collective/unclear"], key='q2_1'
-            )
-            q2 = st.radio(
-                "Is the owner operationally present during risk exposure?",
-                ["Yes, always present","Usually present","Rarely present"], key='q2_2'
-            )
-            q3 = st.radio(
-                "Can ownership be overridden collectively without traceability?",
-                ["No, never","Sometimes","Yes, commonly"], key='q2_3'
-            )
-            if st.form_submit_button("Next →"):
-                st.session_state.answers.update(st.session_state)
-                st.session_state.scores['decision_ownership'] = calculate_ownership_score(st.session_state.answers)
-                st.session_state.step = 4
-                st.rerun()
-
-    elif st.session_state.step == 4:
-        st.markdown("""
-        <div class="pillar-card">
-            <h2>3. Protected Intervention</h2>
-            <p>Is stopping operations structurally safe?</p>
-        </div>
-        """, unsafe_allow_html=True)
-        with st.form("intervention_form"):
-            q1 = st.radio(
-                "Is stop-work authority formally codified and protected?",
-                ["Yes, formally codified and protected","Yes, but informally","No"], key='q3_1'
-            )
-            q2 = st.radio(
-                "How are stop-work decisions reviewed?",
-                ["Always supported","Usually supported","Questioned/criticized"], key='q3_2'
-            )
-            q3 = st.radio(
-                "Does stopping operations negatively affect performance metrics?",
-                ["No, never","Sometimes","Yes, often"], key='q3_3'
-            )
-            if st.form_submit_button("Next →"):
-                st.session_state.answers.update(st.session_state)
-                st.session_state.scores['protected_intervention'] = calculate_intervention_score(st.session_state.answers)
-                st.session_state.step = 5
-                st.rerun()
+            with st.expander("📥 Bulk import respondents"):
+                st.caption("CSV, XLSX or JSON with columns: name, role, " + ", ".join(QUESTION_KEYS))
+                upload = st.file_uploader("Survey export", type=["csv", "xlsx", "json", "jsonl"])
+                if upload is not None and st.button("Import", use_container_width=True):
+                    progress_bar = st.progress(0.0)
+                    imported, rejected = 0, []
+                    try:
+                        for chunk in import_respondents(upload, upload.name):
+                            add_respondents(chunk['records'])
+                            imported += len(chunk['records'])
+                            rejected.extend(chunk['rejected'])
+                            if chunk['progress'] is not None:
+                                progress_bar.progress(chunk['progress'], text=f"{chunk['rows_read']} rows read")
+                        progress_bar.progress(1.0, text="Done")
+                        st.session_state.import_result = (imported, rejected)
+                        st.rerun()
+                    except ValueError as e:
+                        st.error(f"Import failed: {e}")
 
-    elif st.session_state.step == 5:
-        st.markdown("""
-        <div class="pillar-card">
-            <h2>4. Override Transparency</h2>
-            <p>Are deviations visible and traceable?</p>
-        </div>
-        """, unsafe_allow_html=True)
-        with st.form("override_form"):
-            q1 = st.radio(
-                "Can procedures be bypassed informally without documentation?",
-                ["No, always documented","Sometimes documented","Yes, commonly"], key='q4_1'
-            )
-            q2 = st.radio(
-                "Are overrides traceable to a named decision-maker?",
-                ["Yes, always","Sometimes","Rarely"], key='q4_2'
-            )
-            q3 = st.radio(
-                "Are overrides reviewed periodically?",
-                ["Yes, regularly","Occasionally","Never"], key='q4_3'
-            )
-            if st.form_submit_button("Next →"):
-                st.session_state.answers.update(st.session_state)
-                st.session_state.scores['override_transparency'] = calculate_override_score(st.session_state.answers)
-                st.session_state.step = 6
-                st.rerun()
+                if st.session_state.get('import_result'):
+                    imported, rejected = st.session_state.import_result
+                    st.success(f"Imported {imported} respondents")
+                    if rejected:
+                        st.warning(f"{len(rejected)} rows rejected")
+                        st.dataframe(
+                            [{'row': n, 'reason': reason} for n, reason in rejected[:500]],
+                            use_container_width=True, hide_index=True
+                        )
 
-    elif st.session_state.step == 6:
-        st.markdown("""
-        <div class="pillar-card">
-            <h2>5. Drift Detection</h2>
-            <p>Is boundary movement tracked or ignored?</p>
-        </div>
-        """, unsafe_allow_html=True)
-        with st.form("drift_form"):
-            q1 = st.radio(
-                "Are minor deviations recorded systematically?",
-                ["Yes, systematically","Sometimes","Rarely"], key='q5_1'
-            )
-            q2 = st.radio(
-                "Is deviation trend analyzed longitudinally?",
-                ["Yes, regularly","Occasionally","Never"], key='q5_2'
-            )
-            q3 = st.radio(
-                "Is normalization of deviation actively monitored?",
-                ["Yes, actively","Sometimes","No"], key='q5_3'
-            )
-            if st.form_submit_button("Calculate Results →"):
-                st.session_state.answers.update(st.session_state)
-                st.session_state.scores['drift_detection'] = calculate_drift_score(st.session_state.answers)
-                st.session_state.step = 8
-                st.rerun()
+    elif 2 <= st.session_state.step <= 6:
+        pillar_step()
 
     elif st.session_state.step == 8:
         st.markdown("### Save Respondent")
         with st.form("save_respondent_form"):
             name_input = st.text_input("Name", value="", placeholder="e.g. John Smith")
-            role_input = st.selectbox("Role", ["Operator","Supervisor","HSE","Manager","Other"])
+            role_input = st.selectbox("Role", ROLES)
             col1, col2 = st.columns(2)
             with col1:
                 if st.form_submit_button("Save and Add Another"):
@@ -583,6 +739,17 @@ elif st.session_state.view_mode == 'new':
                         st.rerun()
 
     elif st.session_state.step == 7:
+        with st.expander("⚖️ Role weighting"):
+            use_weights = st.checkbox("Weight averages by respondent role", value=bool(st.session_state.role_weights))
+            if use_weights:
+                weights = {}
+                for col, role in zip(st.columns(len(ROLES)), ROLES):
+                    current = (st.session_state.role_weights or {}).get(role, 1.0)
+                    weights[role] = col.number_input(role, min_value=0.0, max_value=5.0, value=float(current), step=0.5, key=f"weight_{role}")
+                st.session_state.role_weights = weights
+            else:
+                st.session_state.role_weights = None
+
         agg = get_aggregated_scores()
         if not agg:
             st.warning("No respondents yet. Add at least one respondent to see results.")
@@ -596,6 +763,7 @@ elif st.session_state.view_mode == 'new':
             st.markdown("## Aggregated Results")
             
             total = get_consensus_score()
+            avg_scores = {k: v['avg'] for k,v in agg.items()}
             col1, col2, col3 = st.columns([1,2,1])
             with col2:
                 st.markdown(f'<div class="score-box">{total:.1f} / 25</div>', unsafe_allow_html=True)
@@ -604,11 +772,10 @@ elif st.session_state.view_mode == 'new':
             with colA:
                 st.markdown("### Average Scores")
                 for pillar, vals in agg.items():
-                    st.markdown(f"**{pillar.replace('_',' ').title()}:** {vals['avg']:.1f}/5  (min {vals['min']}–max {vals['max']})")
+                    st.markdown(f"**{pillar.replace('_',' ').title()}:** {vals['avg']:.1f}/5  (min {vals['min']}–max {vals['max']}, median {vals['median']:.1f}, σ {vals['std']:.2f})")
             
             with colB:
                 st.markdown("### Radar (Average)")
-                avg_scores = {k: v['avg'] for k,v in agg.items()}
                 fig = create_radar_chart(avg_scores)
                 st.plotly_chart(fig, use_container_width=True)
             
@@ -629,13 +796,16 @@ elif st.session_state.view_mode == 'new':
                 
                 if st.button("🚀 Generate Playbook"):
                     try:
-                        playbook = generate_playbook(
+                        key, playbook, markdown = get_or_generate_playbook(
                             aggregated_scores=agg,
                             disagreements=disagreements,
                             company_name=playbook_company,
                             location=playbook_location
                         )
                         st.session_state.generated_playbook = playbook
+                        st.session_state.playbook_key = key
+                        st.session_state.playbook_markdown = markdown
+                        st.session_state.playbook_version = st.session_state.get('playbook_version', 0) + 1
                         st.session_state.show_playbook = True
                         st.rerun()
                     except Exception as e:
@@ -644,11 +814,13 @@ elif st.session_state.view_mode == 'new':
             if st.session_state.get('show_playbook') and st.session_state.get('generated_playbook'):
                 with st.container():
                     st.markdown('<div class="playbook-section">', unsafe_allow_html=True)
-                    st.markdown(format_playbook_for_display(st.session_state.generated_playbook))
-                    playbook_md = export_playbook_to_markdown(st.session_state.generated_playbook)
-                    b64 = base64.b64encode(playbook_md.encode()).decode()
-                    href = f'<a href="data:text/markdown;base64,{b64}" download="AVCS_Playbook_{playbook_company or "audit"}.md"><button style="background-color:#1e3a8a; color:white; padding:8px 16px; margin-top:10px;">📥 Download Playbook (Markdown)</button></a>'
-                    st.markdown(href, unsafe_allow_html=True)
+                    markdown = st.session_state.playbook_markdown
+                    st.markdown(markdown)
+                    on_demand_download(
+                        "Download Playbook (Markdown)", "playbook_md", f"AVCS_Playbook_{playbook_company or 'audit'}.md",
+                        "text/markdown", lambda: markdown.encode("utf-8"),
+                        token=st.session_state.get('playbook_version', 0)
+                    )
                     st.markdown('</div>', unsafe_allow_html=True)
             
             st.markdown("---")
@@ -662,31 +834,32 @@ elif st.session_state.view_mode == 'new':
                     if st.button("Save Audit to History"):
                         if company_name or location:
                             try:
-                                audit_id = save_audit(
+                                # запись идёт в фоне: страница не ждёт коммита, итог — в статусе ниже
+                                request_save(
+                                    company_name, location,
                                     practitioner_name=name,
-                                    company_name=company_name,
-                                    location=location,
                                     total_score=total,
                                     classification=cls_from_score(total),
                                     scores_dict=avg_scores,
-                                    respondents_list=st.session_state.respondents
+                                    respondents_list=st.session_state.respondents,
+                                    playbook=st.session_state.get('generated_playbook') if st.session_state.get('show_playbook') else None,
+                                    playbook_key=st.session_state.get('playbook_key') if st.session_state.get('show_playbook') else None
                                 )
-                                st.success(f"Audit saved! ID: {audit_id}")
                             except Exception as e:
                                 st.error(f"Error saving audit: {e}")
                         else:
                             st.warning("Please enter at least company name or location")
+                    save_status()
             
             with col_s2:
                 st.markdown("### Download PDF")
-                try:
-                    pdf_data = create_pdf(avg_scores, total, 
-                                         company_name if 'company_name' in locals() else "", 
-                                         location if 'location' in locals() else "")
-                    href = f'<a href="data:application/octet-stream;base64,{pdf_data}" download="AVCS_Aggregated_Report.pdf"><button style="background-color:#1e3a8a; color:white; padding:8px 16px;">📥 Download PDF Report</button></a>'
-                    st.markdown(href, unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"Error generating PDF: {e}")
+                report_args = (avg_scores, total, st.session_state.get('save_company', ""),
+                               st.session_state.get('save_location', ""), name)
+                # отчёт зависит от оценок и реквизитов — при их изменении готовится заново
+                on_demand_download(
+                    "Download PDF Report", "aggregated_pdf", "AVCS_Aggregated_Report.pdf", "application/pdf",
+                    lambda: get_pdf(*report_args), token=pdf_cache_key(*report_args)
+                )
             
             with col_s3:
                 if st.button("➕ Add Another Respondent"):
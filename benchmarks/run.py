@@ -0,0 +1,438 @@
+"""
+Бенчмарки горячих путей: оценка анкет, агрегация, playbook, радар, PDF и база.
+
+    python -m benchmarks.run                        # профиль default
+    python -m benchmarks.run --profile quick -k db  # только кейсы, содержащие 'db'
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --tolerance 0.25
+
+--compare завершает процесс с кодом 1, если время кейса выросло больше,
+чем на tolerance, относительно сохранённой базовой линии. Сравнивается минимум
+по выборкам — он меньше всего зависит от фоновой нагрузки на машине.
+Размеры (память записей сессии, байты в базе, pickle) не замеряются, а считаются,
+и сравниваются с базовой линией так же — по tolerance.
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+PROFILES = {
+    'quick': {'respondents': (10, 1_000), 'audits': (1_000,), 'repeat': 3},
+    'default': {'respondents': (10, 1_000, 100_000), 'audits': (1_000, 100_000), 'repeat': 5},
+    'full': {'respondents': (10, 1_000, 100_000), 'audits': (1_000, 100_000, 1_000_000), 'repeat': 7},
+}
+
+MIN_SAMPLE_SECONDS = 0.05  # вызовы короче повторяются в цикле, чтобы таймер был точнее
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "avcs_bench")
+
+_BENCHMARKS = []
+_SIZES = []
+
+
+def benchmark(group):
+    """Регистрирует генератор кейсов: он получает профиль и отдаёт (имя, функция)"""
+    def register(func):
+        _BENCHMARKS.append((group, func))
+        return func
+    return register
+
+
+def size(group):
+    """Регистрирует генератор размеров: он получает профиль и отдаёт (имя, размер в байтах)"""
+    def register(func):
+        _SIZES.append((group, func))
+        return func
+    return register
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Память объекта со всем, на что он ссылается (dict, list, tuple, __slots__).
+    Объект, общий для нескольких записей (интернированные ключи, одна роль), считается один раз.
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    total = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        total += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        total += sum(deep_sizeof(item, seen) for item in obj)
+    else:
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                total += deep_sizeof(getattr(obj, slot), seen)
+    return total
+
+
+def measure(func, repeat):
+    """
+    Время одного вызова func в секундах: min/median по repeat выборкам.
+    Первый вызов — прогрев (ленивые импорты, кэши соединений) и в замер не входит;
+    число вызовов на выборку подбирается так, чтобы выборка длилась не меньше MIN_SAMPLE_SECONDS.
+    """
+    func()
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SAMPLE_SECONDS or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < MIN_SAMPLE_SECONDS / 10 else 2
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {'min': min(samples), 'median': statistics.median(samples), 'loops': number, 'repeat': repeat}
+
+
+# ------------------------------
+# Кейсы
+# ------------------------------
+@benchmark("scoring")
+def bench_scoring(profile, data_dir):
+    from benchmarks.synthetic import make_answers
+    from modules.scoring import score_answers, score_batch, score_pillar
+
+    answers = make_answers(1, seed=1)[0]
+    yield "scoring.score_answers", lambda: score_answers(answers)
+    yield "scoring.score_pillar", lambda: score_pillar('drift_detection', answers)
+    batch = make_answers(1_000, seed=2)
+    yield "scoring.score_batch[1000]", lambda: score_batch(batch)
+
+
+@benchmark("aggregation")
+def bench_aggregation(profile, data_dir):
+    import streamlit as st
+    from benchmarks.synthetic import make_respondents
+    from modules.interview_manager import (
+        add_respondent, get_aggregated_scores, get_disagreement_areas, init_interview_state
+    )
+
+    weights = {'Operator': 1.0, 'Supervisor': 1.5, 'HSE': 2.0, 'Manager': 1.0, 'Other': 0.5}
+
+    def cold(func, *args):
+        # новая версия списка — кэш агрегатов не срабатывает, как после правки респондента
+        def run():
+            st.session_state.respondents_version += 1
+            return func(*args)
+        return run
+
+    for n in profile['respondents']:
+        st.session_state.clear()
+        st.session_state.respondents = make_respondents(n, seed=n)
+        init_interview_state()
+        yield f"aggregation.get_aggregated_scores[{n}]", cold(get_aggregated_scores)
+        yield f"aggregation.get_aggregated_scores_weighted[{n}]", cold(get_aggregated_scores, weights)
+        yield f"aggregation.get_disagreement_areas[{n}]", cold(get_disagreement_areas)
+        yield f"aggregation.get_aggregated_scores_cached[{n}]", get_aggregated_scores
+        # сериализация списка респондентов сессии — её цена растёт с размером записи
+        yield f"aggregation.pickle_respondents[{n}]", lambda: pickle.dumps(st.session_state.respondents)
+
+        extra = make_respondents(1, seed=-n)[0]
+
+        def add_and_aggregate():
+            add_respondent(extra['name'], extra['role'], extra['answers'], extra['scores'])
+            get_aggregated_scores()
+            st.session_state.respondents.pop()
+            st.session_state.running_stats.remove(extra['scores'])
+        yield f"aggregation.add_respondent_then_aggregate[{n}]", add_and_aggregate
+
+
+@benchmark("playbook")
+def bench_playbook(profile, data_dir):
+    from benchmarks.synthetic import make_aggregated
+    from modules.aggregation import disagreements_from_aggregated
+    from modules.playbook_generator import export_playbook_to_markdown, generate_playbook
+
+    aggregated = make_aggregated(seed=3)
+    disagreements = disagreements_from_aggregated(aggregated)
+    yield "playbook.generate_playbook", lambda: generate_playbook(aggregated, disagreements, "Acme", "Plant 1")
+    playbook = generate_playbook(aggregated, disagreements, "Acme", "Plant 1")
+    yield "playbook.export_markdown", lambda: export_playbook_to_markdown(playbook)
+
+
+@benchmark("charts")
+def bench_charts(profile, data_dir):
+    from modules.charts import _radar_figure, _radar_svg, create_radar_chart, render_radar_svg
+
+    scores = {'trigger_clarity': 3.2, 'decision_ownership': 2.4, 'protected_intervention': 4.1,
+              'override_transparency': 1.7, 'drift_detection': 3.9}
+
+    def radar_cold():
+        _radar_figure.cache_clear()
+        return create_radar_chart(scores)
+
+    def svg_cold():
+        _radar_svg.cache_clear()
+        return render_radar_svg(scores, labels=False)
+
+    yield "charts.create_radar_chart_cold", radar_cold
+    yield "charts.create_radar_chart_cached", lambda: create_radar_chart(scores)
+    yield "charts.render_radar_svg_cold", svg_cold
+
+
+@benchmark("reports")
+def bench_reports(profile, data_dir):
+    from modules.report_generator import get_pdf, render_pdf
+
+    scores = {'trigger_clarity': 3.2, 'decision_ownership': 2.4, 'protected_intervention': 4.1,
+              'override_transparency': 1.7, 'drift_detection': 3.9}
+    total = sum(scores.values())
+    yield "reports.render_pdf", lambda: render_pdf(scores, total, "Acme", "Plant 1", "Practitioner 000")
+    get_pdf(scores, total, "Acme", "Plant 1", "Practitioner 000")
+    yield "reports.get_pdf_cached", lambda: get_pdf(scores, total, "Acme", "Plant 1", "Practitioner 000")
+
+
+@benchmark("serialization")
+def bench_serialization(profile, data_dir):
+    from benchmarks.synthetic import make_respondents, seeded_database
+    from modules import database
+    from modules.respondents import decode_payload, encode_payload
+
+    # строка респондента в базе: старый формат (JSON ответов + время текстом) против бинарного payload
+    for n in profile['respondents'][:2]:
+        records = make_respondents(n, seed=n, with_answers=True)
+        legacy_rows = [(json.dumps(r['answers']), str(r['timestamp'])) for r in records]
+        payloads = [encode_payload(r) for r in records]
+        yield (f"serialization.encode_json[{n}]",
+               lambda: [(json.dumps(r['answers']), str(r['timestamp'])) for r in records])
+        yield f"serialization.encode_payload[{n}]", lambda: [encode_payload(r) for r in records]
+        yield f"serialization.decode_json[{n}]", lambda: [(json.loads(a), t) for a, t in legacy_rows]
+        yield f"serialization.decode_payload[{n}]", lambda: [decode_payload(p) for p in payloads]
+
+    # загрузка аудита целиком из базы, засеянной в старом и в новом формате
+    n = profile['audits'][0]
+    for legacy in (True, False):
+        db_path = seeded_database(data_dir, n, legacy=legacy)
+        database.close_pool()
+        database.DB_PATH = db_path
+        database.init_db()
+        rng = random.Random(n)
+        name = "legacy_json" if legacy else "payload"
+        yield f"serialization.get_audit_by_id_{name}[{n}]", lambda: database.get_audit_by_id(rng.randint(1, n))
+
+
+@size("serialization")
+def size_serialization(profile, data_dir):
+    from benchmarks.synthetic import make_respondents
+    from modules.respondents import encode_payload
+
+    # байты респондентов в audit_respondents: JSON ответов + время строкой против payload
+    for n in profile['respondents'][:2]:
+        records = make_respondents(n, seed=n, with_answers=True)
+        yield (f"serialization.stored_bytes_json[{n}]",
+               sum(len(json.dumps(r['answers']).encode()) + len(str(r['timestamp']).encode()) for r in records))
+        yield f"serialization.stored_bytes_payload[{n}]", sum(len(encode_payload(r)) for r in records)
+
+
+@size("memory")
+def size_memory(profile, data_dir):
+    from benchmarks.synthetic import make_respondents
+    from modules.respondents import Respondent
+
+    # список респондентов в st.session_state: словари записей импорта против Respondent
+    for n in profile['respondents'][:2]:
+        records = make_respondents(n, seed=n, with_answers=True)
+        compact = [Respondent.from_record(r) for r in records]
+        yield f"memory.session_respondents_dict[{n}]", deep_sizeof(records)
+        yield f"memory.session_respondents_slots[{n}]", deep_sizeof(compact)
+        yield f"memory.pickle_respondents_dict[{n}]", len(pickle.dumps(records))
+        yield f"memory.pickle_respondents_slots[{n}]", len(pickle.dumps(compact))
+
+
+@benchmark("db")
+def bench_database(profile, data_dir):
+    from benchmarks.synthetic import make_aggregated, make_respondents, seeded_database
+    from modules import database, drafts, write_behind
+    from modules.aggregation import disagreements_from_aggregated
+    from modules.playbook_generator import get_or_generate_playbook
+    from modules.respondents import Respondent
+
+    respondents = make_respondents(5, seed=4, with_answers=True)
+    scores = {'trigger_clarity': 3.2, 'decision_ownership': 2.4, 'protected_intervention': 4.1,
+              'override_transparency': 1.7, 'drift_detection': 3.9}
+
+    for n in profile['audits']:
+        db_path = seeded_database(data_dir, n)
+        database.close_pool()
+        database.DB_PATH = db_path
+        database.init_db()  # миграции для баз, засеянных прошлыми версиями схемы
+        rng = random.Random(n)
+        saved = []
+
+        def save():
+            saved.append(database.save_audit("Practitioner 000", "Company 0001", "Site 1", 15.3,
+                                             "CONDITIONAL STABILITY", scores, respondents))
+
+        yield f"db.save_audit[{n}]", save
+
+        def enqueue_save():
+            saved.append(write_behind.enqueue_save_audit("Practitioner 000", "Company 0001", "Site 1", 15.3,
+                                                         "CONDITIONAL STABILITY", scores, respondents)[0])
+
+        # время на потоке UI — только постановка в очередь; запись пачками идёт в фоне
+        yield f"db.enqueue_save_audit[{n}]", enqueue_save
+        write_behind.flush(timeout=600)
+        # сохранённые бенчмарком аудиты удаляются, чтобы база не росла от прогона к прогону
+        for audit_id in saved:
+            database.delete_audit(audit_id)
+
+        yield f"db.get_audit_history[{n}]", lambda: database.get_audit_history("Practitioner 000")
+        yield f"db.get_audit_history_page[{n}]", lambda: database.get_audit_history_page("Practitioner 000")
+        yield (f"db.get_audit_history_page_filtered[{n}]",
+               lambda: database.get_audit_history_page("Practitioner 000", company="Company 0001"))
+        yield f"db.get_audit_by_id[{n}]", lambda: database.get_audit_by_id(rng.randint(1, n))
+        yield f"db.get_pillar_averages_by_company[{n}]", lambda: database.get_pillar_averages_by_company("Company 0001")
+        yield f"db.search_companies[{n}]", lambda: database.search_companies("Company 01")
+        yield f"db.search_audits[{n}]", lambda: database.search_audits("Company 0001 HSE")
+        yield f"db.search_audits_practitioner[{n}]", lambda: database.search_audits("Site 1", "Practitioner 000")
+
+        def trends_cold():
+            database.invalidate_trend_cache("Company 0001")
+            return database.get_company_trends("Company 0001")
+        yield f"db.get_company_trends_cold[{n}]", trends_cold
+        yield f"db.get_company_trends_cached[{n}]", lambda: database.get_company_trends("Company 0001")
+
+        # повторная генерация тех же входных данных — чтение сохранённого playbook по хэшу
+        aggregated = make_aggregated(seed=3)
+        disagreements = disagreements_from_aggregated(aggregated)
+        yield (f"db.get_or_generate_playbook_cached[{n}]",
+               lambda: get_or_generate_playbook(aggregated, disagreements, "Acme", "Plant 1"))
+
+        # автосохранение черновика: постановка события в очередь и его запись фоновым потоком
+        draft_id = drafts.new_draft_id()
+        drafts.open_draft(draft_id, "practitioner000")
+        draft_respondents = [Respondent.from_record(r) for r in respondents]
+        yield f"db.draft_record_add[{n}]", lambda: drafts.record_add(draft_id, draft_respondents[:1])
+        yield f"db.draft_record_add_flush[{n}]", lambda: (drafts.record_add(draft_id, draft_respondents[:1]), drafts.flush())
+        yield f"db.load_draft[{n}]", lambda: drafts.load_draft(draft_id, "practitioner000")
+        drafts.close_draft(draft_id, None)
+        drafts.flush()
+
+
+# ------------------------------
+# Прогон и сравнение с базовой линией
+# ------------------------------
+def run(profile_name, pattern=None, data_dir=DEFAULT_DATA_DIR, stream=sys.stdout):
+    """Прогоняет все кейсы профиля и считает размеры; возвращает {имя: результат}"""
+    profile = PROFILES[profile_name]
+    results = {}
+    for group, factory in _SIZES:
+        for name, nbytes in factory(profile, data_dir):
+            if pattern and pattern not in name:
+                continue
+            results[name] = {'bytes': nbytes}
+            print(f"{name:<58} {_format_bytes(nbytes):>10}", file=stream, flush=True)
+    for group, factory in _BENCHMARKS:
+        for name, func in factory(profile, data_dir):
+            if pattern and pattern not in name:
+                continue
+            result = measure(func, profile['repeat'])
+            results[name] = result
+            print(f"{name:<58} {_format_seconds(result['median']):>10}  (min {_format_seconds(result['min'])}, "
+                  f"{result['loops']} loops x {result['repeat']})", file=stream, flush=True)
+    return results
+
+
+def _format_seconds(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def _format_bytes(nbytes):
+    if nbytes >= 1 << 20:
+        return f"{nbytes / (1 << 20):.2f} MiB"
+    if nbytes >= 1 << 10:
+        return f"{nbytes / (1 << 10):.1f} KiB"
+    return f"{nbytes} B"
+
+
+def save_baseline(path, profile_name, results):
+    payload = {
+        'meta': {
+            'profile': profile_name,
+            'created': datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count()
+        },
+        'results': results
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline_path, tolerance, stream=sys.stdout):
+    """Сравнивает минимальные времена и размеры с базовой линией; возвращает список регрессий"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    print(f"\n{'case':<58} {'baseline':>10} {'current':>10} {'change':>8}", file=stream)
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        key, format_value = ('bytes', _format_bytes) if 'bytes' in result else ('min', _format_seconds)
+        if key not in baseline[name]:
+            continue
+        before, after = baseline[name][key], result[key]
+        change = after / before - 1 if before else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<58} {format_value(before):>10} {format_value(after):>10} {change:>+7.0%}{flag}",
+              file=stream)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AVCS performance benchmarks")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="default")
+    parser.add_argument("-k", dest="pattern", default=None, help="run only cases whose name contains this text")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where seeded databases are kept between runs")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as a new baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = +25%%)")
+    args = parser.parse_args(argv)
+
+    # session_state вне `streamlit run` работает, но Streamlit об этом предупреждает;
+    # FPDF предупреждает о замене Arial на встроенный Helvetica
+    import streamlit  # noqa: F401  — логгеры Streamlit настраиваются при импорте
+    logging.getLogger("streamlit.runtime.state.session_state_proxy").setLevel(logging.ERROR)
+    warnings.filterwarnings("ignore", category=UserWarning, module="fpdf")
+
+    results = run(args.profile, args.pattern, args.data_dir)
+    if args.save_baseline:
+        save_baseline(args.save_baseline, args.profile, results)
+        print(f"\nBaseline written to {args.save_baseline}")
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} case(s) slower or larger than baseline by more than {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
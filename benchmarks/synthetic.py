@@ -0,0 +1,139 @@
+"""
+Генератор синтетических данных для бенчмарков: анкеты, респонденты и база аудитов.
+Все генераторы детерминированы (seed), чтобы прогоны были сравнимы между собой.
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from modules import database
+from modules.aggregation import PILLARS, ROLES
+from modules.respondents import encode_payload
+from modules.scoring import QUESTION_KEYS, QUESTION_OPTIONS, cls_from_score
+
+SEED_BATCH = 10_000
+SEED_FORMAT = 2  # формат строк засеянной базы; при его смене закэшированные базы засеваются заново
+SEED_START = datetime(2023, 1, 1)
+SEED_SPAN_DAYS = 3 * 365
+
+
+def random_answers(rng):
+    """Одна заполненная анкета"""
+    return {key: rng.choice(QUESTION_OPTIONS[key]) for key in QUESTION_KEYS}
+
+
+def random_scores(rng):
+    """Оценки по pillars (целые 0–5, как у score_answers)"""
+    return {p: rng.randint(0, 5) for p in PILLARS}
+
+
+def make_answers(n, seed=0):
+    rng = random.Random(seed)
+    return [random_answers(rng) for _ in range(n)]
+
+
+def make_respondents(n, seed=0, with_answers=False):
+    """Респонденты-словари, как записи импорта; init_interview_state переводит их в Respondent"""
+    rng = random.Random(seed)
+    timestamp = datetime(2026, 1, 1)
+    return [
+        {
+            'name': f"Respondent {i}",
+            'role': rng.choice(ROLES),
+            'answers': random_answers(rng) if with_answers else {},
+            'scores': random_scores(rng),
+            'timestamp': timestamp
+        }
+        for i in range(n)
+    ]
+
+
+def make_aggregated(seed=0):
+    """Агрегаты в формате get_aggregated_scores — для playbook и отчётов"""
+    rng = random.Random(seed)
+    aggregated = {}
+    for p in PILLARS:
+        lo, hi = sorted((rng.randint(0, 5), rng.randint(0, 5)))
+        avg = rng.uniform(lo, hi)
+        aggregated[p] = {'avg': avg, 'mean': avg, 'min': lo, 'max': hi, 'std': (hi - lo) / 4,
+                         'median': avg, 'p25': lo, 'p75': hi}
+    return aggregated
+
+
+def seed_database(db_path, n_audits, respondents_per_audit=3, practitioners=20, companies=200, seed=0,
+                  legacy=False):
+    """
+    Создаёт базу с n_audits аудитами (и их нормализованными строками) в db_path.
+    Пишет пакетами через executemany — save_audit для миллиона строк слишком медленный.
+    legacy=True — респонденты в старом формате (answers_json и timestamp) вместо payload.
+    Возвращает список имён практиков.
+    """
+    rng = random.Random(seed)
+    practitioner_names = [f"Practitioner {i:03d}" for i in range(practitioners)]
+    company_names = [f"Company {i:04d}" for i in range(companies)]
+
+    database.close_pool()
+    database.DB_PATH = db_path
+    database.init_db()
+
+    with database.get_connection() as conn:
+        start_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM audits").fetchone()[0] + 1
+        for batch_start in range(0, n_audits, SEED_BATCH):
+            audits, pillar_rows, respondent_rows = [], [], []
+            for audit_id in range(start_id + batch_start, start_id + min(batch_start + SEED_BATCH, n_audits)):
+                created = SEED_START + timedelta(seconds=rng.randrange(SEED_SPAN_DAYS * 86400))
+                company = rng.choice(company_names)
+                scores = {p: round(rng.uniform(0, 5), 2) for p in PILLARS}
+                total = round(sum(scores.values()), 2)
+                audits.append((audit_id, created.strftime("%Y-%m-%d"), rng.choice(practitioner_names), company,
+                               f"Site {rng.randint(1, 50)}", total, cls_from_score(total),
+                               created.strftime("%Y-%m-%d %H:%M:%S")))
+                pillar_rows.extend((audit_id, company, p, s) for p, s in scores.items())
+                for position in range(respondents_per_audit):
+                    r_scores = random_scores(rng)
+                    answers = random_answers(rng)
+                    if legacy:
+                        stored = (json.dumps(answers), created.isoformat(), None)
+                    else:
+                        stored = (None, None, encode_payload({'answers': answers, 'timestamp': created}))
+                    respondent_rows.append((audit_id, position, f"Respondent {position}", rng.choice(ROLES),
+                                            *[r_scores[p] for p in PILLARS], *stored))
+            with conn:
+                conn.executemany('''
+                    INSERT INTO audits
+                    (id, audit_date, practitioner_name, company_name, location, total_score, classification,
+                     scores_json, respondents_json, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, '{}', '[]', ?)
+                ''', audits)
+                conn.executemany(
+                    "INSERT INTO audit_pillar_scores (audit_id, company_name, pillar, score) VALUES (?, ?, ?, ?)",
+                    pillar_rows
+                )
+                conn.executemany('''
+                    INSERT INTO audit_respondents
+                    (audit_id, position, name, role,
+                     trigger_clarity, decision_ownership, protected_intervention, override_transparency, drift_detection,
+                     answers_json, timestamp, payload)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', respondent_rows)
+        conn.execute("ANALYZE")
+    return practitioner_names
+
+
+def seeded_database(data_dir, n_audits, **kwargs):
+    """
+    Путь к базе с n_audits аудитами в data_dir; база создаётся один раз
+    и переиспользуется следующими прогонами.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    suffix = "_legacy" if kwargs.get('legacy') else ""
+    db_path = os.path.join(data_dir, f"audits_{n_audits}{suffix}_f{SEED_FORMAT}.db")
+    ready = db_path + ".ready"
+    if not os.path.exists(ready):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+        seed_database(db_path, n_audits, **kwargs)
+        open(ready, "w").close()
+    return db_path
@@ -0,0 +1,239 @@
+import math
+from bisect import bisect_left, insort
+
+
+PILLARS = (
+    'trigger_clarity',
+    'decision_ownership',
+    'protected_intervention',
+    'override_transparency',
+    'drift_detection'
+)
+
+ROLES = ("Operator", "Supervisor", "HSE", "Manager", "Other")
+
+PERCENTILES = (25, 75)
+
+
+def scores_matrix(respondents):
+    """Упаковывает оценки респондентов в матрицу (респонденты × pillars)"""
+    import numpy as np
+
+    matrix = np.zeros((len(respondents), len(PILLARS)), dtype=np.float64)
+    for i, r in enumerate(respondents):
+        values = getattr(r, 'score_values', None)  # компактная запись Respondent — оценки уже по порядку
+        if values is None:
+            scores = r.get('scores') or {}
+            values = [scores.get(p, 0) for p in PILLARS]
+        matrix[i] = values
+    return matrix
+
+
+def role_weights_vector(respondents, role_weights):
+    """Вектор весов по ролям; неизвестные роли получают вес 1.0"""
+    import numpy as np
+
+    return np.array([float(role_weights.get(r.get('role'), 1.0)) for r in respondents], dtype=np.float64)
+
+
+def _as_number(value):
+    """Приводит numpy-скаляр к int, если значение целое, иначе к float"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def aggregate_matrix(matrix, weights=None):
+    """
+    Считает все статистики по pillars за один проход по матрице.
+    Если заданы веса, 'avg' — взвешенное среднее; 'mean' всегда невзвешенное.
+    """
+    import numpy as np
+
+    if matrix.shape[0] == 0:
+        return None
+
+    mean = matrix.mean(axis=0)
+    if weights is not None and weights.sum() > 0:
+        avg = np.average(matrix, axis=0, weights=weights)
+    else:
+        avg = mean
+    mins = matrix.min(axis=0)
+    maxs = matrix.max(axis=0)
+    std = matrix.std(axis=0)
+    median = np.median(matrix, axis=0)
+    pct = np.percentile(matrix, PERCENTILES, axis=0)
+
+    aggregated = {}
+    for j, pillar in enumerate(PILLARS):
+        values = {
+            'avg': float(avg[j]),
+            'mean': float(mean[j]),
+            'min': _as_number(mins[j]),
+            'max': _as_number(maxs[j]),
+            'std': float(std[j]),
+            'median': float(median[j])
+        }
+        for k, q in enumerate(PERCENTILES):
+            values[f'p{q}'] = float(pct[k, j])
+        aggregated[pillar] = values
+    return aggregated
+
+
+def aggregate_respondents(respondents, role_weights=None):
+    """Агрегирует список респондентов; role_weights — словарь {роль: вес}"""
+    if not respondents:
+        return None
+    matrix = scores_matrix(respondents)
+    weights = role_weights_vector(respondents, role_weights) if role_weights else None
+    return aggregate_matrix(matrix, weights)
+
+
+class _CountedValues:
+    """
+    Мультимножество значений: отсортированные различные значения и счётчики.
+    Добавление, удаление и k-я порядковая статистика стоят O(d) по числу
+    различных значений d, а не по числу респондентов.
+
+    Рассчитано на ограниченную область значений: сюда попадают только оценки
+    респондентов по pillar — целые 0–5 от score_answers (d ≤ 6). Взвешенные
+    средние и другие произвольные дробные значения сюда не подаются (их считает
+    aggregate_matrix по матрице целиком); при d ≈ n структура вырождается в O(n).
+    """
+
+    __slots__ = ('keys', 'counts')
+
+    def __init__(self):
+        self.keys = []
+        self.counts = {}
+
+    def add(self, x):
+        count = self.counts.get(x)
+        if count:
+            self.counts[x] = count + 1
+        else:
+            self.counts[x] = 1
+            insort(self.keys, x)
+
+    def remove(self, x):
+        count = self.counts.get(x)
+        if not count:
+            return
+        if count == 1:
+            del self.counts[x]
+            del self.keys[bisect_left(self.keys, x)]
+        else:
+            self.counts[x] = count - 1
+
+    def value_at(self, k):
+        """k-е по порядку значение (с нуля)"""
+        for x in self.keys:
+            k -= self.counts[x]
+            if k < 0:
+                return x
+        raise IndexError(k)
+
+    def percentile(self, n, q):
+        """Перцентиль с линейной интерполяцией (как np.percentile по умолчанию)"""
+        pos = (n - 1) * q / 100
+        lo = math.floor(pos)
+        low = self.value_at(lo)
+        high = self.value_at(min(lo + 1, n - 1))
+        return low + (high - low) * (pos - lo)
+
+
+class RunningPillarStats:
+    """
+    Инкрементальные статистики по pillars.
+    Среднее и дисперсия — по Уэлфорду (с обратным шагом для удаления),
+    min/max/медиана/перцентили — по счётчикам значений (_CountedValues):
+    правка респондента и снимок не зависят от размера списка.
+    """
+
+    def __init__(self, respondents=()):
+        self._reset()
+        for r in respondents:
+            self.add(r.get('scores'))
+
+    def _reset(self):
+        self.n = 0
+        self._mean = [0.0] * len(PILLARS)
+        self._m2 = [0.0] * len(PILLARS)
+        self._values_by_pillar = [_CountedValues() for _ in PILLARS]
+
+    @staticmethod
+    def _values(scores):
+        scores = scores or {}
+        return [float(scores.get(p, 0)) for p in PILLARS]
+
+    def add(self, scores):
+        self.n += 1
+        for j, x in enumerate(self._values(scores)):
+            delta = x - self._mean[j]
+            self._mean[j] += delta / self.n
+            self._m2[j] += delta * (x - self._mean[j])
+            self._values_by_pillar[j].add(x)
+
+    def remove(self, scores):
+        if self.n == 0:
+            return
+        values = self._values(scores)
+        if self.n == 1:
+            self._reset()
+            return
+        self.n -= 1
+        for j, x in enumerate(values):
+            delta = x - self._mean[j]
+            self._mean[j] -= delta / self.n
+            self._m2[j] = max(self._m2[j] - delta * (x - self._mean[j]), 0.0)
+            self._values_by_pillar[j].remove(x)
+
+    def replace(self, old_scores, new_scores):
+        self.remove(old_scores)
+        self.add(new_scores)
+
+    def snapshot(self):
+        """Статистики в формате aggregate_matrix (невзвешенные)"""
+        if self.n == 0:
+            return None
+
+        aggregated = {}
+        for j, pillar in enumerate(PILLARS):
+            column = self._values_by_pillar[j]
+            values = {
+                'avg': self._mean[j],
+                'mean': self._mean[j],
+                'min': _as_number(column.keys[0]),
+                'max': _as_number(column.keys[-1]),
+                'std': math.sqrt(self._m2[j] / self.n),
+                'median': column.percentile(self.n, 50)
+            }
+            for q in PERCENTILES:
+                values[f'p{q}'] = column.percentile(self.n, q)
+            aggregated[pillar] = values
+        return aggregated
+
+
+def consensus_from_aggregated(aggregated):
+    """Общий скор — сумма средних по pillars"""
+    if not aggregated:
+        return 0
+    return sum(aggregated[p]['avg'] for p in PILLARS if p in aggregated)
+
+
+def disagreements_from_aggregated(aggregated, threshold=1.5):
+    """Области, где разброс (max - min) превышает порог"""
+    if not aggregated:
+        return []
+
+    disagreements = []
+    for pillar, values in aggregated.items():
+        spread = values['max'] - values['min']
+        if spread > threshold:
+            disagreements.append({
+                'pillar': pillar.replace('_', ' ').title(),
+                'spread': spread,
+                'min': values['min'],
+                'max': values['max']
+            })
+
+    return sorted(disagreements, key=lambda x: x['spread'], reverse=True)
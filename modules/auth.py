@@ -1,36 +1,117 @@
+import copy
+import hashlib
+import hmac
+import os
+import sys
+
 import streamlit as st
 import streamlit_authenticator as stauth
+from streamlit_authenticator.utilities.hasher import Hasher
+
+from modules.database import count_practitioners, get_practitioner_credentials, upsert_practitioner
+
+COOKIE_NAME = 'avcs_sim_auth'
+COOKIE_KEY = os.environ.get("AVCS_COOKIE_KEY", "avcs_sim_key")
+COOKIE_EXPIRY_DAYS = 30
+
+# Логины с доступом к служебным панелям (через запятую)
+ADMIN_USERS = frozenset(u.strip().lower() for u in os.environ.get("AVCS_ADMINS", "").split(",") if u.strip())
+
+# Демо-учётка для пустой базы. Хэш пароля 'abc123' посчитан заранее,
+# чтобы при первом запуске не платить за bcrypt.
+DEFAULT_PRACTITIONER = {
+    'username': "practitioner001",
+    'name': "Test Practitioner",
+    'email': "test@avcs.com",
+    'password_hash': "$2b$12$A0F0h3/bxtBFu0EKFwIAiOj6geR27HxxC2GhczJ5n9/6QGOQbBLv."
+}
+
+
+def hash_password(password):
+    """bcrypt-хэш пароля — считается один раз при создании учётки, а не при входе"""
+    return Hasher([password]).generate()[0]
+
+
+def add_practitioner(username, name, email, password):
+    """Заводит или обновляет учётную запись и сбрасывает кэш учётных данных процесса"""
+    saved = upsert_practitioner(username, name, email, hash_password(password))
+    _credentials.clear()
+    return saved
+
+
+def ensure_default_practitioner():
+    """Заводит демо-учётку, если в базе ещё нет ни одной"""
+    if count_practitioners() == 0:
+        upsert_practitioner(**DEFAULT_PRACTITIONER)
+
+
+@st.cache_resource(show_spinner=False)
+def _credentials():
+    """
+    Учётные данные из SQLite — загружаются один раз на процесс.
+    Пароли уже захэшированы, поэтому streamlit-authenticator их не перехэширует.
+    """
+    ensure_default_practitioner()
+    return {"usernames": get_practitioner_credentials()}
+
+
+def is_admin(username):
+    """Есть ли у практика доступ к служебным панелям"""
+    return bool(username) and username.lower() in ADMIN_USERS
+
+
+def _session_signature(username, password_hash):
+    """HMAC сессии: привязывает вход к текущему хэшу пароля учётки"""
+    message = f"{username}\0{password_hash}".encode("utf-8")
+    return hmac.new(COOKIE_KEY.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def _verified_session():
+    """
+    Проверка уже вошедшей сессии на повторных запусках скрипта:
+    один HMAC вместо bcrypt, без построения Authenticate и формы входа.
+    Смена пароля или отключение учётки делает подпись недействительной.
+    """
+    username = st.session_state.get('username')
+    signature = st.session_state.get('_auth_signature')
+    if not st.session_state.get('authentication_status') or not username or not signature:
+        return False
+
+    user = _credentials()['usernames'].get(username)
+    if user is not None and hmac.compare_digest(signature, _session_signature(username, user['password'])):
+        return True
+
+    # подпись устарела — сбрасываем вход и не даём cookie залогинить сессию повторно
+    st.session_state['authentication_status'] = None
+    st.session_state['username'] = None
+    st.session_state['name'] = None
+    st.session_state['logout'] = True
+    st.session_state.pop('_auth_signature', None)
+    return False
+
 
 def check_authentication():
     """
-    Упрощённая аутентификация для GitHub.
+    Аутентификация практика.
+    Учётные записи и bcrypt-хэши хранятся в SQLite; пароль проверяется только
+    при отправке формы входа, а повторные запуски скрипта проверяют подпись сессии.
     """
-    # Создаём тестового пользователя прямо в коде
-    credentials = {
-        "usernames": {
-            "practitioner001": {
-                "email": "test@avcs.com",
-                "name": "Test Practitioner",
-                "password": "abc123"  # В продакшене нужно хешировать!
-            }
-        }
-    }
-
-    cookie = {
-        'expiry_days': 30,
-        'key': 'avcs_sim_key',
-        'name': 'avcs_sim_auth'
-    }
-
-    authenticator = stauth.Authenticate(
-        credentials,
-        cookie['name'],
-        cookie['key'],
-        cookie['expiry_days']
-    )
+    if _verified_session():
+        return (st.session_state['name'], True, st.session_state['username'],
+                st.session_state.get('_authenticator'))
+
+    # Authenticate держит CookieManager конкретного браузера, поэтому на процесс
+    # кэшируются только учётные данные, а сам объект живёт в сессии. Authenticate
+    # пишет в словарь учёток logged_in и failed_login_attempts — каждой сессии своя копия
+    authenticator = stauth.Authenticate(copy.deepcopy(_credentials()), COOKIE_NAME, COOKIE_KEY, COOKIE_EXPIRY_DAYS)
 
     name, authentication_status, username = authenticator.login(fields={'Form name':'Login'}, location='main')
 
+    if authentication_status:
+        password_hash = _credentials()['usernames'][username]['password']
+        st.session_state['_auth_signature'] = _session_signature(username, password_hash)
+        st.session_state['_authenticator'] = authenticator
+
     if authentication_status == False:
         st.error("Username/password is incorrect")
 
@@ -38,3 +119,18 @@ def check_authentication():
         st.warning("Please enter your credentials")
 
     return name, authentication_status, username, authenticator
+
+
+if __name__ == "__main__":
+    # python -m modules.auth <username> <name> <email> — пароль запрашивается интерактивно
+    from getpass import getpass
+    from modules.database import init_db
+
+    if len(sys.argv) != 4:
+        print("Usage: python -m modules.auth <username> <name> <email>")
+        sys.exit(2)
+    init_db()
+    if add_practitioner(sys.argv[1], sys.argv[2], sys.argv[3], getpass("Password: ")):
+        print(f"Practitioner '{sys.argv[1].lower()}' saved")
+    else:
+        sys.exit(1)
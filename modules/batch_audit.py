@@ -0,0 +1,202 @@
+"""
+Пакетная обработка файлов опросов без Streamlit: оценка, агрегация, playbook,
+PDF-отчёт и сохранение аудита — по аудиту на файл.
+
+Файлы обрабатываются в пуле процессов (каждый процесс — файл целиком),
+а в базу результаты пишет только родительский процесс, поэтому SQLite
+не видит конкурирующих писателей.
+"""
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from modules.aggregation import aggregate_respondents, consensus_from_aggregated, disagreements_from_aggregated
+from modules.bulk_import import SUPPORTED_EXTENSIONS, import_respondents
+from modules.playbook_generator import format_playbook_for_display, generate_playbook, playbook_key, store_playbook
+from modules.scoring import cls_from_score
+
+# Сколько файлов держать в работе на один процесс (как в batch_export)
+IN_FLIGHT_PER_WORKER = 2
+
+
+def find_input_files(paths):
+    """Разворачивает пути: каталоги — в поддерживаемые файлы внутри них (без рекурсии), по алфавиту"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.splitext(name.lower())[1] in SUPPORTED_EXTENSIONS
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def score_file(path):
+    """Читает и оценивает файл опроса; возвращает (записи респондентов, отклонённые строки)"""
+    records, rejected = [], []
+    with open(path, "rb") as f:
+        for chunk in import_respondents(f, path):
+            records.extend(chunk['records'])
+            rejected.extend(chunk['rejected'])
+    return records, rejected
+
+
+def _file_stem(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def _error_message(error):
+    return str(error) or type(error).__name__
+
+
+def _new_result(path, company=None, location=None, practitioner="", error=None):
+    return {
+        'file': path, 'company': company or _file_stem(path), 'location': location or "",
+        'practitioner': practitioner, 'respondents': [], 'rejected': [], 'scores': None, 'aggregated': None,
+        'total_score': None, 'classification': None, 'disagreements': [], 'playbook': None, 'playbook_key': None,
+        'playbook_markdown': None, 'pdf_path': None, 'playbook_path': None, 'error': error
+    }
+
+
+def process_file(path, out_dir=None, company=None, location=None, practitioner="", role_weights=None,
+                 playbook=True, pdf=True):
+    """
+    Полный расчёт аудита по одному файлу. company по умолчанию — имя файла.
+    Если задан out_dir, туда пишутся <имя>.pdf и <имя>_playbook.md.
+    Возвращает словарь результата; ошибка чтения попадает в поле 'error'.
+    """
+    result = _new_result(path, company, location, practitioner)
+    company = result['company']
+    try:
+        records, rejected = score_file(path)
+    except Exception as e:
+        # повреждённый файл (битый XLSX, кривой CSV) — ошибка этого файла, а не всего пакета
+        result['error'] = _error_message(e)
+        return result
+    result['respondents'], result['rejected'] = records, rejected
+    if not records:
+        result['error'] = "no valid respondents"
+        return result
+
+    aggregated = aggregate_respondents(records, role_weights)
+    total = consensus_from_aggregated(aggregated)
+    disagreements = disagreements_from_aggregated(aggregated)
+    result.update(
+        aggregated=aggregated,
+        scores={p: v['avg'] for p, v in aggregated.items()},
+        total_score=total,
+        classification=cls_from_score(total),
+        disagreements=disagreements
+    )
+
+    if playbook:
+        generated = generate_playbook(aggregated, disagreements, company, location)
+        result['playbook'] = generated
+        result['playbook_key'] = playbook_key(aggregated, disagreements, company, location)
+        result['playbook_markdown'] = format_playbook_for_display(generated)
+
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        stem = os.path.join(out_dir, _file_stem(path))
+        if pdf:
+            from modules.report_generator import render_pdf
+
+            result['pdf_path'] = stem + ".pdf"
+            with open(result['pdf_path'], "wb") as f:
+                f.write(render_pdf(result['scores'], total, company, location, practitioner))
+        if result['playbook_markdown']:
+            result['playbook_path'] = stem + "_playbook.md"
+            with open(result['playbook_path'], "w", encoding="utf-8") as f:
+                f.write(result['playbook_markdown'])
+    return result
+
+
+def persist_result(result):
+    """Сохраняет рассчитанный аудит (и его playbook) в базу; возвращает ID аудита или None"""
+    from modules.database import save_audit
+
+    if result['error'] or not result['respondents']:
+        return None
+    if result['playbook'] is not None:
+        store_playbook(result['playbook_key'], result['playbook'])
+    return save_audit(
+        practitioner_name=result['practitioner'],
+        company_name=result['company'],
+        location=result['location'],
+        total_score=result['total_score'],
+        classification=result['classification'],
+        scores_dict=result['scores'],
+        respondents_list=result['respondents'],
+        playbook=result['playbook'],
+        playbook_key=result['playbook_key']
+    )
+
+
+def _process_safely(path, options):
+    """process_file, который не бросает: любая ошибка становится полем 'error' результата"""
+    try:
+        return process_file(path, **options)
+    except Exception as e:
+        return _failed_result(path, options, e)
+
+
+def _failed_result(path, options, error):
+    return _new_result(path, options.get('company'), options.get('location'), options.get('practitioner', ""),
+                       error=_error_message(error))
+
+
+def _iter_processed(files, workers, options):
+    """Обрабатывает файлы в пуле процессов с ограниченным окном задач; отдаёт результаты по мере готовности"""
+    if workers <= 1 or len(files) <= 1:
+        for path in files:
+            yield _process_safely(path, options)
+        return
+
+    # spawn: воркеры не наследуют соединения SQLite родителя
+    ctx = multiprocessing.get_context("spawn")
+    window = max(1, workers * IN_FLIGHT_PER_WORKER)
+    paths = iter(files)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        pending = {}
+        for path in paths:
+            pending[pool.submit(_process_safely, path, options)] = path
+            if len(pending) >= window:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # воркер упал целиком (например, BrokenProcessPool) — файл помечается ошибкой
+                    result = _failed_result(path, options, e)
+                yield result
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending[pool.submit(_process_safely, next_path, options)] = next_path
+
+
+def process_batch(paths, out_dir=None, save=False, workers=None, progress_callback=None, **options):
+    """
+    Обрабатывает все файлы опросов из paths (файлы и каталоги).
+    options передаются в process_file; save=True сохраняет каждый аудит в базу.
+    Отдаёт результаты по мере готовности (порядок не гарантирован);
+    у сохранённых в поле 'audit_id' — ID аудита.
+    """
+    files = find_input_files(paths)
+    workers = workers or min(os.cpu_count() or 1, len(files) or 1)
+    options = dict(options, out_dir=out_dir)
+
+    for done, result in enumerate(_iter_processed(files, workers, options), start=1):
+        try:
+            result['audit_id'] = persist_result(result) if save else None
+        except Exception as e:
+            result['audit_id'] = None
+            result['error'] = f"save failed: {_error_message(e)}"
+        if progress_callback:
+            progress_callback(done, len(files))
+        yield result
@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from modules import database
+from modules.database import get_audit_by_id, get_audit_chart, get_audit_ids
+
+# Сколько задач держать в работе на один процесс: ограничивает память,
+# занятую готовыми, но ещё не записанными в архив PDF
+IN_FLIGHT_PER_WORKER = 2
+
+# Небольшие выгрузки быстрее отрендерить в текущем процессе, чем поднимать пул
+SERIAL_THRESHOLD = 8
+
+# Файлы выгрузок: свой каталог во временной папке; брошенные (сессия закрыта
+# без новой выгрузки) удаляются при следующей выгрузке после EXPORT_TTL секунд
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "avcs_exports")
+EXPORT_TTL = 24 * 3600
+
+
+def new_export_file(suffix):
+    """Путь к новому пустому файлу выгрузки (mkstemp — имя не угадать, доступ только владельцу)"""
+    os.makedirs(EXPORT_DIR, mode=0o700, exist_ok=True)
+    _remove_stale_exports()
+    fd, path = tempfile.mkstemp(prefix="avcs_export_", suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    return path
+
+
+def discard_export(path):
+    """Удаляет файл выгрузки, если он ещё есть"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_stale_exports():
+    cutoff = time.time() - EXPORT_TTL
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.name.startswith("avcs_export_") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _init_worker(db_path):
+    database.DB_PATH = db_path
+
+
+def _audit_filename(audit):
+    company = "".join(c if c.isalnum() else "_" for c in (audit['company_name'] or "audit"))
+    return f"AVCS_Audit_{audit['id']}_{company}_{audit['audit_date']}.pdf"
+
+
+def _render_audit(audit_id):
+    """Выполняется в процессе-воркере: загружает аудит и рендерит его PDF"""
+    from modules.report_generator import render_pdf
+
+    audit = get_audit_by_id(audit_id)
+    if audit is None:
+        return audit_id, None, None
+    data = render_pdf(audit['scores'], audit['total_score'], audit['company_name'],
+                      audit['location'], audit['practitioner_name'], get_audit_chart(audit_id))
+    return audit_id, _audit_filename(audit), data
+
+
+def _iter_rendered(audit_ids, workers):
+    """
+    Рендерит аудиты в пуле процессов с ограниченным окном задач
+    и отдаёт результаты по мере готовности.
+    """
+    if workers <= 1 or len(audit_ids) <= SERIAL_THRESHOLD:
+        for audit_id in audit_ids:
+            yield _render_audit(audit_id)
+        return
+
+    # spawn: дочерние процессы не наследуют открытые соединения SQLite и потоки Streamlit
+    ctx = multiprocessing.get_context("spawn")
+    window = max(1, workers * IN_FLIGHT_PER_WORKER)
+    ids = iter(audit_ids)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                             initializer=_init_worker, initargs=(database.DB_PATH,)) as pool:
+        pending = set()
+        for audit_id in ids:
+            pending.add(pool.submit(_render_audit, audit_id))
+            if len(pending) >= window:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_id = next(ids, None)
+                if next_id is not None:
+                    pending.add(pool.submit(_render_audit, next_id))
+
+
+def export_audits_zip(out, practitioner=None, company=None, date_from=None, date_to=None, classification=None,
+                      workers=None, progress_callback=None):
+    """
+    Рендерит PDF всех аудитов под фильтром параллельно и пишет их в ZIP.
+    out — путь или бинарный файловый объект. Возвращает число файлов в архиве.
+    """
+    audit_ids = get_audit_ids(practitioner, company, date_from, date_to, classification)
+    if not audit_ids:
+        return 0
+    workers = workers or min(os.cpu_count() or 1, len(audit_ids))
+
+    written = 0
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for done, (audit_id, filename, data) in enumerate(_iter_rendered(audit_ids, workers), start=1):
+            if data is not None:
+                zf.writestr(filename, data)
+                written += 1
+            if progress_callback:
+                progress_callback(done, len(audit_ids))
+    return written
+
+
+def export_audits_merged_pdf(out, practitioner=None, company=None, date_from=None, date_to=None,
+                             classification=None, progress_callback=None):
+    """
+    Собирает один PDF, по странице на аудит. Документ один, поэтому
+    рендер последовательный; аудиты загружаются по одному.
+    Возвращает число страниц.
+    """
+    from fpdf import FPDF
+    from modules.report_generator import draw_report_page
+
+    audit_ids = get_audit_ids(practitioner, company, date_from, date_to, classification)
+    pdf = FPDF()
+    pages = 0
+    for done, audit_id in enumerate(audit_ids, start=1):
+        audit = get_audit_by_id(audit_id)
+        if audit is not None:
+            draw_report_page(pdf, audit['scores'], audit['total_score'], audit['company_name'],
+                             audit['location'], audit['practitioner_name'], get_audit_chart(audit_id))
+            pages += 1
+        if progress_callback:
+            progress_callback(done, len(audit_ids))
+
+    if pages == 0:
+        return 0
+    if isinstance(out, (str, os.PathLike)):
+        # документ пишется прямо в файл, без копии готового PDF в байтах у вызывающего
+        pdf.output(os.fspath(out))
+    else:
+        out.write(pdf.output())
+    return pages
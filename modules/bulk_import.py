@@ -0,0 +1,228 @@
+import codecs
+import csv
+import io
+import json
+import os
+import zipfile
+from itertools import islice
+
+from modules.aggregation import PILLARS, ROLES
+from modules.scoring import QUESTION_KEYS, QUESTION_OPTIONS, score_batch
+
+CHUNK_SIZE = 500
+READ_BLOCK = 64 * 1024
+
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx", ".json", ".jsonl")
+
+_ROLE_LOOKUP = {r.lower(): r for r in ROLES}
+
+
+# ------------------------------
+# Потоковое чтение файлов
+# ------------------------------
+def _iter_csv(fileobj):
+    """Строки CSV как словари; файл читается построчно"""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        text.detach()
+
+
+def _iter_xlsx(fileobj):
+    """Строки первого листа XLSX в режиме read_only (без загрузки всей книги)"""
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValueError("Excel import requires the 'openpyxl' package")
+
+    try:
+        wb = load_workbook(fileobj, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile, KeyError) as e:
+        # переименованный или повреждённый файл: не zip или в архиве нет частей книги
+        raise ValueError(f"Not a valid Excel workbook ({e})") from e
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(h) if h is not None else "" for h in header]
+        for values in rows:
+            if values is None or all(v is None for v in values):
+                continue
+            yield dict(zip(header, values))
+    finally:
+        wb.close()
+
+
+def _iter_json(fileobj):
+    """
+    JSON-массив объектов или JSON Lines.
+    Массив разбирается инкрементально через raw_decode по блокам,
+    поэтому в памяти держится только текущий блок.
+    """
+    decoder = json.JSONDecoder()
+    reader = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        block = fileobj.read(READ_BLOCK)
+        if not block:
+            eof = True
+            buf += reader.decode(b"", final=True)
+        else:
+            buf += reader.decode(block)
+
+    while not buf.strip() and not eof:
+        fill()
+    buf = buf.lstrip()
+    in_array = buf.startswith("[")
+    if in_array:
+        buf = buf[1:]
+
+    while True:
+        buf = buf.lstrip().lstrip(",").lstrip()
+        if in_array and buf.startswith("]"):
+            return
+        if not buf:
+            if eof:
+                if in_array:
+                    raise ValueError("Unterminated JSON array")
+                return
+            fill()
+            continue
+        try:
+            obj, end = decoder.raw_decode(buf)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Malformed JSON near: " + buf[:80])
+            fill()
+            continue
+        buf = buf[end:]
+        yield obj
+
+
+# Ошибки разбора, которые парсеры бросают на повреждённых файлах (ParseError XML листа — SyntaxError)
+_PARSE_ERRORS = (csv.Error, zipfile.BadZipFile, SyntaxError, EOFError)
+
+
+def iter_rows(fileobj, filename):
+    """
+    Выбирает потоковый парсер по расширению файла.
+    Любая ошибка чтения или разбора приходит как ValueError с понятным сообщением.
+    """
+    ext = os.path.splitext(filename.lower())[1]
+    if ext == ".csv":
+        rows = _iter_csv(fileobj)
+    elif ext == ".xlsx":
+        rows = _iter_xlsx(fileobj)
+    elif ext in (".json", ".jsonl"):
+        rows = _iter_json(fileobj)
+    else:
+        raise ValueError(f"Unsupported file type '{ext}'. Use one of: {', '.join(SUPPORTED_EXTENSIONS)}")
+    return _parse_errors_as_value_errors(rows, os.path.basename(filename))
+
+
+def _parse_errors_as_value_errors(rows, name):
+    try:
+        yield from rows
+    except UnicodeDecodeError as e:
+        raise ValueError(f"{name} is not UTF-8 text ({e.reason} at byte {e.start})") from e
+    except ValueError:
+        raise
+    except _PARSE_ERRORS as e:
+        raise ValueError(f"{name} could not be read: {e}") from e
+
+
+# ------------------------------
+# Валидация и оценка
+# ------------------------------
+def validate_row(row):
+    """
+    Проверяет строку опроса.
+    Возвращает (record, None) или (None, причина отказа).
+    """
+    if not isinstance(row, dict):
+        return None, "row is not an object"
+    row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+
+    name = str(row.get('name') or "").strip()
+    if not name:
+        return None, "missing name"
+
+    role = _ROLE_LOOKUP.get(str(row.get('role') or "").strip().lower())
+    if role is None:
+        return None, f"unknown role '{row.get('role')}'"
+
+    answers = {}
+    for key in QUESTION_KEYS:
+        value = row.get(key)
+        value = str(value).strip() if value is not None else ""
+        if value not in QUESTION_OPTIONS[key]:
+            return None, f"{key}: invalid answer '{value}'"
+        answers[key] = value
+
+    return {'name': name, 'role': role, 'answers': answers}, None
+
+
+def import_respondents(fileobj, filename, chunk_size=CHUNK_SIZE):
+    """
+    Читает файл опроса порциями, валидирует и оценивает каждую порцию пакетно.
+    Для каждой порции отдаёт словарь:
+    - records: записи, совместимые с add_respondent (name, role, answers, scores)
+    - rejected: список (номер строки, причина)
+    - rows_read: сколько строк прочитано всего
+    - progress: доля прочитанного файла (0..1), если размер известен
+    """
+    total_size = _file_size(fileobj)
+    rows = iter_rows(fileobj, filename)
+    rows_read = 0
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        records, rejected = [], []
+        for row in chunk:
+            rows_read += 1
+            record, reason = validate_row(row)
+            if record is None:
+                rejected.append((rows_read, reason))
+            else:
+                records.append(record)
+
+        if records:
+            scores = score_batch([r['answers'] for r in records])
+            for record, row_scores in zip(records, scores.tolist()):
+                record['scores'] = dict(zip(PILLARS, row_scores))
+
+        yield {
+            'records': records,
+            'rejected': rejected,
+            'rows_read': rows_read,
+            'progress': _progress(fileobj, total_size)
+        }
+
+
+def _file_size(fileobj):
+    try:
+        pos = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        size = fileobj.tell()
+        fileobj.seek(pos)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _progress(fileobj, total_size):
+    if not total_size:
+        return None
+    try:
+        return min(fileobj.tell() / total_size, 1.0)
+    except (AttributeError, OSError, ValueError):
+        return None
@@ -0,0 +1,137 @@
+import math
+from functools import lru_cache
+
+from modules.aggregation import PILLARS
+from modules.metrics import timed
+
+RADAR_CATEGORIES = ['Trigger Clarity', 'Decision Ownership', 'Protected Intervention',
+                    'Override Transparency', 'Drift Detection']
+RADAR_CACHE_SIZE = 256
+RADAR_PRECISION = 2  # до скольких знаков округляются оценки в ключе кэша
+
+
+def _radar_key(scores_dict):
+    return tuple(round(float(scores_dict[p]), RADAR_PRECISION) for p in PILLARS)
+
+
+@lru_cache(maxsize=RADAR_CACHE_SIZE)
+def _radar_figure(values):
+    import plotly.graph_objects as go
+
+    values = list(values)
+    fig = go.Figure(data=go.Scatterpolar(
+        r=values + [values[0]],
+        theta=RADAR_CATEGORIES + [RADAR_CATEGORIES[0]],
+        fill='toself', line_color='#1e3a8a',
+        fillcolor='rgba(30,58,138,0.3)'
+    ))
+    fig.update_layout(
+        polar=dict(radialaxis=dict(visible=True, range=[0,5])),
+        showlegend=False, height=400,
+        margin=dict(l=80, r=80, t=20, b=20)
+    )
+    return fig
+
+
+@timed
+def create_radar_chart(scores_dict):
+    """
+    Радар по пяти pillars. Фигуры кэшируются по округлённым оценкам,
+    поэтому возвращённый объект общий — его нельзя изменять на месте.
+    """
+    return _radar_figure(_radar_key(scores_dict))
+
+
+def radar_cache_info():
+    """Статистика кэша фигур (hits, misses, currsize)"""
+    return _radar_figure.cache_info()
+
+
+SVG_ASPECT = 1.6  # ширина/высота: по бокам остаётся место для подписей
+
+
+def _radar_geometry(size):
+    """Центр и радиус радара в координатах SVG высотой size"""
+    return size * SVG_ASPECT / 2, size / 2, size * 0.34
+
+
+def _radar_point(size, i, r):
+    cx, cy, _ = _radar_geometry(size)
+    angle = -math.pi / 2 + 2 * math.pi * i / len(PILLARS)
+    return cx + r * math.cos(angle), cy + r * math.sin(angle)
+
+
+def radar_label_positions(size=400):
+    """Координаты подписей осей: [(подпись, x, y, выравнивание)]"""
+    cx, _, radius = _radar_geometry(size)
+    positions = []
+    for i, label in enumerate(RADAR_CATEGORIES):
+        x, y = _radar_point(size, i, radius + size * 0.07)
+        anchor = "middle" if abs(x - cx) < 1 else ("start" if x > cx else "end")
+        positions.append((label, x, y, anchor))
+    return positions
+
+
+@lru_cache(maxsize=RADAR_CACHE_SIZE)
+def _radar_svg(values, size, labels):
+    cx, cy, radius = _radar_geometry(size)
+    width = size * SVG_ASPECT
+    n = len(values)
+
+    def polygon(points, **attrs):
+        pts = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+        extra = " ".join(f'{k.replace("_", "-")}="{v}"' for k, v in attrs.items())
+        return f'<polygon points="{pts}" {extra}/>'
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.0f}" height="{size}" viewBox="0 0 {width:.0f} {size}">']
+    for level in range(1, 6):
+        ring = [_radar_point(size, i, radius * level / 5) for i in range(n)]
+        parts.append(polygon(ring, fill="none", stroke="#d1d5db", stroke_width="1"))
+    for i in range(n):
+        x, y = _radar_point(size, i, radius)
+        parts.append(f'<line x1="{cx:.1f}" y1="{cy:.1f}" x2="{x:.1f}" y2="{y:.1f}" stroke="#d1d5db" stroke-width="1"/>')
+
+    shape = [_radar_point(size, i, radius * max(0.0, min(v, 5.0)) / 5) for i, v in enumerate(values)]
+    parts.append(polygon(shape, fill="#1e3a8a", fill_opacity="0.3", stroke="#1e3a8a", stroke_width="2"))
+
+    if labels:
+        for label, x, y, anchor in radar_label_positions(size):
+            parts.append(f'<text x="{x:.1f}" y="{y:.1f}" font-family="Helvetica" font-size="{size * 0.04:.1f}" '
+                         f'text-anchor="{anchor}" fill="#111827">{label}</text>')
+    parts.append('</svg>')
+    return "\n".join(parts)
+
+
+@timed
+def render_radar_svg(scores_dict, size=400, labels=True):
+    """
+    Статичный SVG радара без Plotly — для хранения при сохранении аудита и для PDF.
+    labels=False — без подписей (FPDF не рисует текст из SVG, подписи ставятся отдельно).
+    """
+    return _radar_svg(_radar_key(scores_dict), size, labels)
+
+
+@timed
+def create_trend_chart(trend, rolling=False):
+    """
+    Линии оценок по pillars от аудита к аудиту (trend — результат get_company_trends).
+    rolling=True — скользящие средние вместо оценок отдельных аудитов.
+    """
+    import plotly.graph_objects as go
+
+    dates = [a['created_at'] for a in trend['audits']]
+    fig = go.Figure()
+    for label, pillar in zip(RADAR_CATEGORIES, PILLARS):
+        series = trend['pillars'][pillar]
+        fig.add_trace(go.Scatter(
+            x=dates, y=series['rolling' if rolling else 'score'], name=label,
+            mode='lines+markers', customdata=[d if d is not None else 0 for d in series['delta']],
+            hovertemplate="%{y:.2f} (Δ %{customdata:+.2f})<extra>" + label + "</extra>"
+        ))
+    fig.update_layout(
+        yaxis=dict(range=[0, 5], title="Score"),
+        height=360, hovermode='x unified',
+        legend=dict(orientation='h', y=-0.2),
+        margin=dict(l=40, r=20, t=20, b=20)
+    )
+    return fig
@@ -0,0 +1,129 @@
+"""
+avcs-sim — обработка опросов из командной строки, без Streamlit.
+
+    python -m modules.cli score survey.csv > scored.jsonl
+    python -m modules.cli process drops/ --out reports/ --save --practitioner "Jane Doe"
+    python -m modules.cli process a.xlsx b.json --workers 4 --weight HSE=2 --json
+
+process считает по аудиту на файл: оценки, агрегаты, playbook, PDF-отчёт;
+с --save аудит и playbook сохраняются в базу (--db, по умолчанию как у приложения).
+"""
+import argparse
+import json
+import sys
+
+from modules.aggregation import ROLES
+
+
+def _parse_weight(text):
+    role, sep, weight = text.partition("=")
+    matches = [r for r in ROLES if r.lower() == role.strip().lower()]
+    if not sep or not matches:
+        raise argparse.ArgumentTypeError(f"expected ROLE=WEIGHT with ROLE one of {', '.join(ROLES)}")
+    try:
+        return matches[0], float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid weight '{weight}'")
+
+
+def _summary(result):
+    """Результат process_file без тяжёлых полей — для вывода"""
+    return {
+        'file': result['file'],
+        'company': result['company'],
+        'respondents': len(result['respondents']),
+        'rejected': len(result['rejected']),
+        'total_score': result['total_score'],
+        'classification': result['classification'],
+        'scores': result['scores'],
+        'pdf': result['pdf_path'],
+        'playbook': result['playbook_path'],
+        'audit_id': result.get('audit_id'),
+        'error': result['error']
+    }
+
+
+def cmd_score(args):
+    """Оценённые респонденты файла — по JSON-объекту на строку"""
+    from modules.batch_audit import score_file
+
+    try:
+        records, rejected = score_file(args.file)
+    except (OSError, ValueError) as e:
+        print(f"{args.file}: {e}", file=sys.stderr)
+        return 1
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False))
+    for row, reason in rejected:
+        print(f"{args.file}: row {row} rejected: {reason}", file=sys.stderr)
+    return 0
+
+
+def cmd_process(args):
+    """Аудит на каждый файл; итог по файлам — таблицей или JSON Lines"""
+    from modules import database
+    from modules.batch_audit import process_batch
+
+    if args.save:
+        if not args.practitioner:
+            print("--save requires --practitioner", file=sys.stderr)
+            return 2
+        if args.db:
+            database.DB_PATH = args.db
+        database.init_db()
+
+    results = process_batch(
+        args.paths, out_dir=args.out, save=args.save, workers=args.workers,
+        company=args.company, location=args.location, practitioner=args.practitioner or "",
+        role_weights=dict(args.weight) if args.weight else None,
+        playbook=not args.no_playbook, pdf=not args.no_pdf
+    )
+
+    failed = 0
+    for result in results:
+        summary = _summary(result)
+        failed += summary['error'] is not None
+        if args.json:
+            print(json.dumps(summary, ensure_ascii=False))
+        elif summary['error']:
+            print(f"{summary['file']}: ERROR {summary['error']}")
+        else:
+            saved = f", audit #{summary['audit_id']}" if summary['audit_id'] else ""
+            print(f"{summary['file']}: {summary['respondents']} respondents ({summary['rejected']} rejected), "
+                  f"{summary['total_score']:.1f}/25 {summary['classification']}{saved}")
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="avcs-sim", description="Headless AVCS SIM audit processing")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score = commands.add_parser("score", help="score every respondent in one survey file")
+    score.add_argument("file", help="CSV, XLSX, JSON or JSON Lines survey file")
+    score.set_defaults(func=cmd_score)
+
+    process = commands.add_parser("process", help="score, aggregate and report one audit per survey file")
+    process.add_argument("paths", nargs="+", help="survey files or directories containing them")
+    process.add_argument("--out", help="directory for PDF reports and playbook markdown")
+    process.add_argument("--save", action="store_true", help="save each audit and its playbook to the database")
+    process.add_argument("--db", help="SQLite database path (default: the app's database)")
+    process.add_argument("--practitioner", help="practitioner name recorded on reports and saved audits")
+    process.add_argument("--company", help="company name for every file (default: the file name)")
+    process.add_argument("--location", help="location for every file")
+    process.add_argument("--weight", type=_parse_weight, action="append", metavar="ROLE=WEIGHT",
+                         help="weight averages by respondent role (repeatable)")
+    process.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    process.add_argument("--no-playbook", action="store_true", help="skip playbook generation")
+    process.add_argument("--no-pdf", action="store_true", help="skip PDF reports")
+    process.add_argument("--json", action="store_true", help="print one JSON summary per file")
+    process.set_defaults(func=cmd_process)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
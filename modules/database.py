@@ -1,125 +1,1083 @@
 import sqlite3
-import pandas as pd
+from collections import OrderedDict
 from datetime import datetime
+from contextlib import contextmanager
 import json
 import os
+import queue
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from modules.aggregation import PILLARS
+from modules.charts import render_radar_svg
+from modules.metrics import timed
+from modules.respondents import decode_payload, encode_payload
 
 DB_PATH = "data/avcs_audits.db"
 
+# ------------------------------
+# Пул соединений
+# ------------------------------
+# Каждый поток получает одно долгоживущее соединение; свободные соединения
+# лежат в ограниченном пуле и переиспользуются следующими потоками Streamlit.
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 128
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",      # ~16 MB страничного кэша
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+_stats_lock = threading.Lock()
+_pool_stats = {'hits': 0, 'misses': 0, 'created': 0, 'closed': 0}
+
+HISTORY_PAGE_SIZE = 25
+
+# Кэш справочника компаний в процессе: сбрасывается при записи аудитов,
+# а TTL подхватывает изменения, сделанные другими процессами
+COMPANY_CACHE_TTL = 30.0
+COMPANY_SEARCH_LIMIT = 50
+_company_cache = None  # (время загрузки, строки, ключи для поиска по префиксу, имена по дате аудита)
+
+# Кэш трендов по компаниям: сбрасывается при записи аудитов компании, TTL — как у справочника
+TREND_WINDOW = 3  # скользящее среднее — по стольким последним аудитам
+TREND_CACHE_SIZE = 64
+_trend_cache = OrderedDict()  # (компания, окно) -> (время загрузки, тренд)
+_trend_lock = threading.Lock()
+
+# Полнотекстовый поиск: вес колонок в bm25 (company, location, practitioner, respondents, playbook)
+SEARCH_WEIGHTS = (5.0, 2.0, 1.0, 3.0, 1.0)
+SEARCH_LIMIT = 25
+
+COMPANY_TRIGGERS = '''
+    CREATE TRIGGER IF NOT EXISTS trg_companies_insert AFTER INSERT ON audits
+    WHEN NEW.company_name IS NOT NULL AND NEW.company_name <> ''
+    BEGIN
+        INSERT INTO companies (name, audit_count, last_audit_at)
+        VALUES (NEW.company_name, 1, NEW.created_at)
+        ON CONFLICT(name) DO UPDATE SET
+            audit_count = audit_count + 1,
+            last_audit_at = MAX(COALESCE(last_audit_at, ''), excluded.last_audit_at);
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_companies_delete AFTER DELETE ON audits
+    WHEN OLD.company_name IS NOT NULL AND OLD.company_name <> ''
+    BEGIN
+        UPDATE companies SET
+            audit_count = audit_count - 1,
+            last_audit_at = (SELECT MAX(created_at) FROM audits WHERE company_name = OLD.company_name)
+        WHERE name = OLD.company_name;
+        DELETE FROM companies WHERE name = OLD.company_name AND audit_count <= 0;
+    END;
+'''
+
+# Поля аудита в порядке SELECT get_audit_by_id
+AUDIT_COLUMNS = ('id', 'audit_date', 'practitioner_name', 'company_name', 'location', 'total_score',
+                 'classification', 'created_at')
+
+
+
+def _bump(counter):
+    with _stats_lock:
+        _pool_stats[counter] += 1
+
+
+def _open_connection():
+    """Открывает новое соединение с настроенными PRAGMA"""
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    _bump('created')
+    return conn
+
+
+@contextmanager
+def get_connection():
+    """
+    Выдаёт соединение текущего потока.
+    Вложенные вызовы в том же потоке получают то же соединение;
+    после выхода из внешнего вызова соединение возвращается в пул.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.depth += 1
+        _bump('hits')
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    try:
+        conn = _pool.get_nowait()
+        _bump('hits')
+    except queue.Empty:
+        conn = _open_connection()
+        _bump('misses')
+
+    _local.conn = conn
+    _local.depth = 1
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        _local.depth = 0
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            _pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+            _bump('closed')
+
+
+def get_pool_stats():
+    """Возвращает счётчики попаданий/промахов пула соединений"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    stats['idle'] = _pool.qsize()
+    stats['pool_size'] = POOL_SIZE
+    return stats
+
+
+def close_pool():
+    """Закрывает все простаивающие соединения (например, при смене DB_PATH)"""
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+        _bump('closed')
+
+
+@timed
 def init_db():
     """Создаёт таблицы, если их нет"""
-    os.makedirs("data", exist_ok=True)
-    
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS audits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            audit_date TEXT NOT NULL,
-            practitioner_name TEXT NOT NULL,
-            company_name TEXT,
-            location TEXT,
-            total_score REAL,
-            classification TEXT,
-            scores_json TEXT NOT NULL,
-            respondents_json TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+
+    with get_connection() as conn, conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                audit_date TEXT NOT NULL,
+                practitioner_name TEXT NOT NULL,
+                company_name TEXT,
+                location TEXT,
+                total_score REAL,
+                classification TEXT,
+                scores_json TEXT NOT NULL,
+                respondents_json TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        # Нормализованные оценки по pillar — для агрегатов внутри SQLite
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audit_pillar_scores (
+                audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+                company_name TEXT,
+                pillar TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (audit_id, pillar)
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_pillar_scores_company_pillar
+            ON audit_pillar_scores (company_name, pillar)
+        ''')
+
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audit_respondents (
+                audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                name TEXT,
+                role TEXT,
+                trigger_clarity REAL,
+                decision_ownership REAL,
+                protected_intervention REAL,
+                override_transparency REAL,
+                drift_detection REAL,
+                answers_json TEXT,
+                timestamp TEXT,
+                payload BLOB,
+                PRIMARY KEY (audit_id, position)
+            )
+        ''')
+        # Бинарный payload респондента (ответы и время) — вместо answers_json/timestamp;
+        # строки, записанные до его появления, читаются по-старому
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(audit_respondents)")}
+        if 'payload' not in columns:
+            conn.execute("ALTER TABLE audit_respondents ADD COLUMN payload BLOB")
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_respondents_audit
+            ON audit_respondents (audit_id)
+        ''')
+
+        # Статичные изображения радара, отрендеренные при сохранении
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audit_charts (
+                audit_id INTEGER NOT NULL REFERENCES audits(id) ON DELETE CASCADE,
+                format TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (audit_id, format)
+            )
+        ''')
+
+        # Индексы под keyset-пагинацию истории
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audits_practitioner_created
+            ON audits (practitioner_name, created_at DESC, id DESC)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_audits_company_created
+            ON audits (company_name, created_at DESC, id DESC)
+        ''')
+
+        # Учётные записи практиков: только bcrypt-хэши, поиск по первичному ключу
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS practitioners (
+                username TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT,
+                password_hash TEXT NOT NULL,
+                active INTEGER NOT NULL DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_practitioners_email
+            ON practitioners (email)
+        ''')
+
+        # Справочник компаний для фильтров: поддерживается триггерами на audits,
+        # поэтому список компаний не требует DISTINCT по всей таблице аудитов
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS companies (
+                name TEXT PRIMARY KEY,
+                audit_count INTEGER NOT NULL,
+                last_audit_at TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        conn.executescript(COMPANY_TRIGGERS)
+
+        # Полнотекстовый индекс аудитов (rowid = audits.id); ведётся в save_audit/delete_audit
+        conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS audit_search USING fts5(
+                company, location, practitioner, respondents, playbook,
+                tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+            )
+        ''')
+
+        # Сгенерированные playbook: ключ — хэш входных данных, markdown хранится готовым;
+        # audit_playbooks связывает сохранённый аудит с его playbook
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS playbooks (
+                input_hash TEXT PRIMARY KEY,
+                playbook_json TEXT NOT NULL,
+                markdown TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS audit_playbooks (
+                audit_id INTEGER PRIMARY KEY REFERENCES audits(id) ON DELETE CASCADE,
+                input_hash TEXT NOT NULL REFERENCES playbooks(input_hash)
+            )
+        ''')
+
+        # Черновики аудитов: журнал событий по респондентам (только добавление),
+        # текущий список респондентов получается проигрыванием журнала.
+        # Владелец — логин практика (username), а не отображаемое имя: имена не уникальны
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS drafts (
+                id TEXT PRIMARY KEY,
+                username TEXT,
+                status TEXT NOT NULL DEFAULT 'open',
+                audit_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+        ''')
+        # таблица из первой версии черновиков: владелец был по имени — такие черновики
+        # остаются без username и никому не выдаются
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(drafts)")}
+        if 'username' not in columns:
+            conn.execute("ALTER TABLE drafts ADD COLUMN username TEXT")
+        conn.execute("DROP INDEX IF EXISTS idx_drafts_practitioner_status")
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_drafts_username_status
+            ON drafts (username, status, updated_at DESC)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS draft_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                draft_id TEXT NOT NULL REFERENCES drafts(id) ON DELETE CASCADE,
+                kind TEXT NOT NULL,
+                position INTEGER,
+                payload TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_draft_events_draft
+            ON draft_events (draft_id, id)
+        ''')
+
+        _backfill_normalized_tables(conn)
+        _backfill_companies(conn)
+        _backfill_search_index(conn)
+
+def _backfill_companies(conn):
+    """Миграция: заполняет справочник компаний для баз, созданных до его появления"""
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM companies)").fetchone()[0]:
+        return
+    conn.execute('''
+        INSERT INTO companies (name, audit_count, last_audit_at)
+        SELECT company_name, COUNT(*), MAX(created_at)
+        FROM audits
+        WHERE company_name IS NOT NULL AND company_name <> ''
+        GROUP BY company_name
     ''')
-    
-    conn.commit()
-    conn.close()
-
-def save_audit(practitioner_name, company_name, location, total_score, classification, scores_dict, respondents_list):
-    """Сохраняет завершённый аудит в базу"""
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        audit_date = datetime.now().strftime("%Y-%m-%d")
-        scores_json = json.dumps(scores_dict)
-        respondents_json = json.dumps(respondents_list, default=str)
-        
-        c.execute('''
-            INSERT INTO audits 
-            (audit_date, practitioner_name, company_name, location, total_score, classification, scores_json, respondents_json)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (audit_date, practitioner_name, company_name, location, total_score, classification, scores_json, respondents_json))
-        
-        conn.commit()
-        audit_id = c.lastrowid
-        conn.close()
+
+def _backfill_search_index(conn):
+    """Миграция: индексирует для поиска аудиты баз, созданных до появления индекса"""
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM audit_search)").fetchone()[0]:
+        return
+    conn.execute('''
+        INSERT INTO audit_search (rowid, company, location, practitioner, respondents, playbook)
+        SELECT a.id, a.company_name, a.location, a.practitioner_name,
+               (SELECT group_concat(COALESCE(r.name, '') || ' ' || COALESCE(r.role, ''), ' ')
+                FROM audit_respondents r WHERE r.audit_id = a.id),
+               ''
+        FROM audits a
+    ''')
+
+def _playbook_search_text(playbook):
+    """Все строки playbook одной строкой — для полнотекстового индекса"""
+    if not playbook:
+        return ""
+    parts = []
+    stack = [playbook]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif isinstance(item, dict):
+            stack.extend(reversed(list(item.values())))
+        elif isinstance(item, (list, tuple)):
+            stack.extend(reversed(item))
+    return " ".join(parts)
+
+def _index_audit(conn, audit_id, practitioner_name, company_name, location, respondents_list, playbook=None):
+    """Записывает аудит в полнотекстовый индекс (в транзакции сохранения)"""
+    respondents = " ".join(f"{r.get('name') or ''} {r.get('role') or ''}" for r in respondents_list or [])
+    conn.execute(
+        "INSERT OR REPLACE INTO audit_search (rowid, company, location, practitioner, respondents, playbook) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (audit_id, company_name, location, practitioner_name, respondents, _playbook_search_text(playbook))
+    )
+
+def _backfill_normalized_tables(conn):
+    """
+    Миграция: переносит JSON-блобы старых аудитов в нормализованные таблицы.
+    Аудиты без оценок строк в audit_pillar_scores не получат — их запрос пропускает,
+    иначе они перебирались бы при каждом запуске (читаются из JSON-блобов).
+    """
+    rows = conn.execute('''
+        SELECT a.id, a.company_name, a.scores_json, a.respondents_json
+        FROM audits a
+        WHERE COALESCE(a.scores_json, '') NOT IN ('', '{}', 'null')
+          AND NOT EXISTS (SELECT 1 FROM audit_pillar_scores s WHERE s.audit_id = a.id)
+    ''').fetchall()
+
+    for audit_id, company_name, scores_json, respondents_json in rows:
+        try:
+            scores = json.loads(scores_json) if scores_json else {}
+            respondents = json.loads(respondents_json) if respondents_json else []
+            _insert_normalized_rows(conn, audit_id, company_name, scores, respondents)
+        except (TypeError, ValueError, AttributeError) as e:
+            # битый блоб (оценка null, не тот тип) не должен мешать запуску приложения
+            print(f"Skipping audit {audit_id} during migration: {e}")
+
+def _insert_normalized_rows(conn, audit_id, company_name, scores_dict, respondents_list):
+    """
+    Записывает оценки по pillar и респондентов аудита.
+    Строки собираются до первой записи: ошибка в данных не оставляет аудит записанным наполовину.
+    """
+    score_rows = [(audit_id, company_name, pillar, float(score)) for pillar, score in (scores_dict or {}).items()]
+    rows = []
+    for position, r in enumerate(respondents_list or []):
+        values = getattr(r, 'score_values', None)
+        if values is None:
+            scores = r.get('scores') or {}
+            values = [scores.get(p, 0) for p in PILLARS]
+        rows.append((audit_id, position, r.get('name'), r.get('role'), *values, encode_payload(r)))
+    conn.executemany(
+        "INSERT OR REPLACE INTO audit_pillar_scores (audit_id, company_name, pillar, score) VALUES (?, ?, ?, ?)",
+        score_rows
+    )
+    conn.executemany('''
+        INSERT OR REPLACE INTO audit_respondents
+        (audit_id, position, name, role,
+         trigger_clarity, decision_ownership, protected_intervention, override_transparency, drift_detection,
+         payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+@timed
+def save_audit(practitioner_name, company_name, location, total_score, classification, scores_dict, respondents_list,
+               prerender_chart=True, playbook=None, playbook_key=None):
+    """
+    Сохраняет завершённый аудит в базу; prerender_chart — сразу сохранить SVG радара,
+    playbook — сгенерированный план действий (его текст попадает в поиск),
+    playbook_key — ключ этого плана в таблице playbooks, к которому привязывается аудит
+    """
+    try:
+        with get_connection() as conn, conn:
+            audit_id = _write_audit(conn, None, practitioner_name, company_name, location, total_score,
+                                    classification, scores_dict, respondents_list, prerender_chart,
+                                    playbook, playbook_key)
+        invalidate_company_cache()
+        invalidate_trend_cache(company_name)
         return audit_id
     except Exception as e:
         print(f"Error saving audit: {e}")
         return None
 
+def _write_audit(conn, audit_id, practitioner_name, company_name, location, total_score, classification,
+                 scores_dict, respondents_list, prerender_chart=True, playbook=None, playbook_key=None,
+                 audit_date=None):
+    """
+    Записывает аудит и его строки в открытой транзакции; audit_id=None — ID выдаёт SQLite,
+    иначе используется заранее зарезервированный (reserve_audit_ids). Возвращает ID.
+    """
+    audit_date = audit_date or datetime.now().strftime("%Y-%m-%d")
+
+    # Данные живут в нормализованных таблицах; JSON-колонки остаются
+    # только ради совместимости со схемой (NOT NULL) и хранят пустышки.
+    c = conn.execute('''
+        INSERT INTO audits
+        (id, audit_date, practitioner_name, company_name, location, total_score, classification, scores_json, respondents_json)
+        VALUES (?, ?, ?, ?, ?, ?, ?, '{}', '[]')
+    ''', (audit_id, audit_date, practitioner_name, company_name, location, total_score, classification))
+    audit_id = c.lastrowid
+    _insert_normalized_rows(conn, audit_id, company_name, scores_dict, respondents_list)
+    _index_audit(conn, audit_id, practitioner_name, company_name, location, respondents_list, playbook)
+    if playbook_key:
+        conn.execute(
+            "INSERT INTO audit_playbooks (audit_id, input_hash) VALUES (?, ?)", (audit_id, playbook_key)
+        )
+    if prerender_chart:
+        conn.execute(
+            "INSERT OR REPLACE INTO audit_charts (audit_id, format, data) VALUES (?, 'svg', ?)",
+            (audit_id, render_radar_svg(scores_dict, labels=False).encode("utf-8"))
+        )
+    return audit_id
+
+def reserve_audit_ids(count):
+    """
+    Резервирует count ID аудитов: сдвигает счётчик AUTOINCREMENT таблицы audits,
+    так что эти ID не достанутся ни одной другой вставке (в том числе в других процессах).
+    Возвращает первый ID диапазона.
+    """
+    with get_connection() as conn, conn:
+        row = conn.execute(
+            "UPDATE sqlite_sequence SET seq = seq + ? WHERE name = 'audits' RETURNING seq", (count,)
+        ).fetchone()
+        if row is None:
+            # в таблицу ещё ни разу не вставляли — строки счётчика нет
+            last = conn.execute("SELECT COALESCE(MAX(id), 0) FROM audits").fetchone()[0]
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('audits', ?)", (last + count,))
+            return last + 1
+    return row[0] - count + 1
+
+@timed
 def get_audit_history(practitioner_name=None, limit=50):
     """Возвращает историю аудитов"""
+    import pandas as pd
+
     try:
-        conn = sqlite3.connect(DB_PATH)
-        
-        if practitioner_name:
-            query = "SELECT * FROM audits WHERE practitioner_name = ? ORDER BY created_at DESC LIMIT ?"
-            df = pd.read_sql_query(query, conn, params=(practitioner_name, limit))
-        else:
+        with get_connection() as conn:
+            if practitioner_name:
+                query = "SELECT * FROM audits WHERE practitioner_name = ? ORDER BY created_at DESC LIMIT ?"
+                return pd.read_sql_query(query, conn, params=(practitioner_name, limit))
             query = "SELECT * FROM audits ORDER BY created_at DESC LIMIT ?"
-            df = pd.read_sql_query(query, conn, params=(limit,))
-        
-        conn.close()
-        return df
+            return pd.read_sql_query(query, conn, params=(limit,))
     except Exception as e:
         print(f"Error getting history: {e}")
         return pd.DataFrame()
 
+def _audit_filters(practitioner=None, company=None, date_from=None, date_to=None, classification=None):
+    """Собирает условия WHERE для фильтров истории"""
+    conditions, params = [], []
+    if practitioner:
+        conditions.append("practitioner_name = ?")
+        params.append(practitioner)
+    if company:
+        conditions.append("company_name = ?")
+        params.append(company)
+    if classification:
+        conditions.append("classification = ?")
+        params.append(classification)
+    if date_from:
+        conditions.append("created_at >= ?")
+        params.append(str(date_from))
+    if date_to:
+        # Включительно по дате: всё, что раньше следующего дня
+        conditions.append("created_at < date(?, '+1 day')")
+        params.append(str(date_to))
+    return conditions, params
+
+@timed
+def get_audit_ids(practitioner=None, company=None, date_from=None, date_to=None, classification=None):
+    """ID аудитов, подходящих под фильтр, от новых к старым"""
+    conditions, params = _audit_filters(practitioner, company, date_from, date_to, classification)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM audits {where} ORDER BY created_at DESC, id DESC", params
+            ).fetchall()
+        return [r[0] for r in rows]
+    except Exception as e:
+        print(f"Error getting audit ids: {e}")
+        return []
+
+@timed
+def get_audit_history_page(practitioner, company=None, date_from=None, date_to=None,
+                           classification=None, after_cursor=None, page_size=HISTORY_PAGE_SIZE):
+    """
+    Возвращает одну страницу истории аудитов и курсор следующей страницы.
+    Пагинация по ключу (created_at, id): стоимость страницы не зависит
+    от её номера. Все фильтры применяются в SQL.
+    """
+    conditions, params = _audit_filters(practitioner, company, date_from, date_to, classification)
+    if after_cursor:
+        conditions.append("(created_at, id) < (?, ?)")
+        params.extend(after_cursor)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    query = f'''
+        SELECT id, audit_date, practitioner_name, company_name, location,
+               total_score, classification, created_at
+        FROM audits
+        {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT ?
+    '''
+    params.append(page_size + 1)
+
+    try:
+        with get_connection() as conn:
+            cursor = conn.execute(query, params)
+            columns = [d[0] for d in cursor.description]
+            rows = [dict(zip(columns, r)) for r in cursor.fetchall()]
+    except Exception as e:
+        print(f"Error getting history page: {e}")
+        return [], None
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = (last['created_at'], last['id'])
+    return rows, next_cursor
+
+def _match_expression(text):
+    """
+    Превращает ввод пользователя в запрос FTS5: каждое слово — префикс,
+    все слова обязательны. Синтаксис FTS5 из ввода не пропускается.
+    """
+    terms = re.findall(r"\w+", text or "")
+    return " ".join(f'"{t}"*' for t in terms)
+
+@timed
+def search_audits(text, practitioner=None, limit=SEARCH_LIMIT):
+    """
+    Полнотекстовый поиск по компании, площадке, практику, респондентам (имя, роль)
+    и тексту playbook. Результаты — по релевантности (bm25), с фрагментом совпадения.
+    """
+    match = _match_expression(text)
+    if not match:
+        return []
+
+    query = f'''
+        SELECT a.id, a.audit_date, a.practitioner_name, a.company_name, a.location,
+               a.total_score, a.classification, a.created_at,
+               snippet(audit_search, -1, '**', '**', '…', 10) AS snippet
+        FROM audit_search
+        JOIN audits a ON a.id = audit_search.rowid
+        WHERE audit_search MATCH ? {"AND a.practitioner_name = ?" if practitioner else ""}
+        ORDER BY bm25(audit_search, {", ".join(str(w) for w in SEARCH_WEIGHTS)})
+        LIMIT ?
+    '''
+    params = [match] + ([practitioner] if practitioner else []) + [limit]
+    try:
+        with get_connection() as conn:
+            cursor = conn.execute(query, params)
+            columns = [d[0] for d in cursor.description]
+            return [dict(zip(columns, r)) for r in cursor.fetchall()]
+    except Exception as e:
+        print(f"Error searching audits: {e}")
+        return []
+
+@timed
 def get_audit_by_id(audit_id):
     """Загружает конкретный аудит по ID"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT * FROM audits WHERE id = ?", conn, params=(audit_id,))
-        conn.close()
-        
-        if len(df) == 0:
-            return None
-        
-        row = df.iloc[0]
-        return {
-            'id': row['id'],
-            'audit_date': row['audit_date'],
-            'practitioner_name': row['practitioner_name'],
-            'company_name': row['company_name'],
-            'location': row['location'],
-            'total_score': row['total_score'],
-            'classification': row['classification'],
-            'scores': json.loads(row['scores_json']),
-            'respondents': json.loads(row['respondents_json']),
-            'created_at': row['created_at']
-        }
+        with get_connection() as conn:
+            row = conn.execute('''
+                SELECT id, audit_date, practitioner_name, company_name, location, total_score, classification,
+                       created_at, scores_json, respondents_json
+                FROM audits WHERE id = ?
+            ''', (audit_id,)).fetchone()
+            if row is None:
+                return None
+
+            scores = _load_pillar_scores(conn, audit_id)
+            respondents = _load_respondents(conn, audit_id)
+
+        if not scores:
+            # Аудит ещё не прошёл миграцию — читаем старые JSON-блобы
+            scores = json.loads(row[8])
+            respondents = json.loads(row[9])
+
+        audit = dict(zip(AUDIT_COLUMNS, row[:8]))
+        audit['scores'] = scores
+        audit['respondents'] = respondents
+        return audit
     except Exception as e:
         print(f"Error getting audit by id: {e}")
         return None
 
+def _load_pillar_scores(conn, audit_id):
+    """Читает оценки по pillar в каноническом порядке"""
+    rows = conn.execute(
+        "SELECT pillar, score FROM audit_pillar_scores WHERE audit_id = ?", (audit_id,)
+    ).fetchall()
+    scores = dict(rows)
+    ordered = {p: scores.pop(p) for p in PILLARS if p in scores}
+    ordered.update(scores)
+    return ordered
+
+def _load_respondents(conn, audit_id):
+    """Читает респондентов аудита в исходном порядке"""
+    rows = conn.execute('''
+        SELECT name, role,
+               trigger_clarity, decision_ownership, protected_intervention, override_transparency, drift_detection,
+               payload, answers_json, timestamp
+        FROM audit_respondents WHERE audit_id = ? ORDER BY position
+    ''', (audit_id,)).fetchall()
+
+    respondents = []
+    for row in rows:
+        if row[7] is not None:
+            answers, timestamp = decode_payload(row[7])
+            timestamp = str(timestamp) if timestamp is not None else None
+        else:
+            # строка записана до появления payload — ответы в JSON, время строкой
+            answers, timestamp = json.loads(row[8]) if row[8] else {}, row[9]
+        respondents.append({
+            'name': row[0],
+            'role': row[1],
+            'answers': answers,
+            'scores': dict(zip(PILLARS, row[2:7])),
+            'timestamp': timestamp
+        })
+    return respondents
+
+@timed
+def get_pillar_averages_by_company(company_name=None):
+    """Средние оценки по pillar для каждой компании (считается в SQLite)"""
+    import pandas as pd
+
+    try:
+        query = '''
+            SELECT company_name, pillar, AVG(score) AS avg_score, MIN(score) AS min_score,
+                   MAX(score) AS max_score, COUNT(*) AS audits
+            FROM audit_pillar_scores
+        '''
+        params = ()
+        if company_name:
+            query += " WHERE company_name = ?"
+            params = (company_name,)
+        query += " GROUP BY company_name, pillar ORDER BY company_name, pillar"
+
+        with get_connection() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+    except Exception as e:
+        print(f"Error getting pillar averages: {e}")
+        return pd.DataFrame()
+
+# Одна строка на аудит (pillars развёрнуты в колонки), затем одно окно по времени:
+# изменение к предыдущему аудиту (LAG) и скользящее среднее для итога и каждого pillar
+_TREND_SERIES = ('total_score',) + PILLARS
+TREND_QUERY = '''
+    WITH per_audit AS (
+        SELECT a.id, a.audit_date, a.created_at, a.total_score, {pivot}
+        FROM audits a JOIN audit_pillar_scores s ON s.audit_id = a.id
+        WHERE a.company_name = ?
+        GROUP BY a.id
+    )
+    SELECT id, audit_date, created_at, {values}, {windows}
+    FROM per_audit
+    WINDOW w AS (ORDER BY created_at, id)
+    ORDER BY created_at, id
+'''.format(
+    pivot=", ".join(f"MAX(CASE WHEN s.pillar = '{p}' THEN s.score END) AS {p}" for p in PILLARS),
+    values=", ".join(_TREND_SERIES),
+    windows=", ".join(f"{c} - LAG({c}) OVER w, AVG({c}) OVER (w ROWS BETWEEN ? PRECEDING AND CURRENT ROW)"
+                      for c in _TREND_SERIES)
+)
+
+@timed
+def get_company_trends(company_name, window=TREND_WINDOW):
+    """
+    Динамика оценок компании по её аудитам (от старых к новым), одним запросом
+    с оконными функциями SQLite:
+        {'audits': [{'id', 'audit_date', 'created_at', 'total_score', 'total_delta', 'total_rolling'}],
+         'pillars': {pillar: {'score': [...], 'delta': [...], 'rolling': [...]}}}
+    Списки pillars выровнены по 'audits'; delta — изменение к предыдущему аудиту
+    (у первого None), rolling — среднее по последним window аудитам.
+    Результат кэшируется по компании и общий для всех вызовов — изменять его нельзя.
+    """
+    key = (company_name, window)
+    with _trend_lock:
+        cached = _trend_cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < COMPANY_CACHE_TTL:
+            _trend_cache.move_to_end(key)
+            return cached[1]
+
+    try:
+        preceding = max(int(window), 1) - 1
+        with get_connection() as conn:
+            rows = conn.execute(TREND_QUERY, (company_name,) + (preceding,) * len(_TREND_SERIES)).fetchall()
+    except Exception as e:
+        print(f"Error getting company trends: {e}")
+        return {'audits': [], 'pillars': {}}
+
+    n = len(_TREND_SERIES)
+    audits = [{'id': r[0], 'audit_date': r[1], 'created_at': r[2], 'total_score': r[3],
+               'total_delta': r[3 + n], 'total_rolling': r[4 + n]} for r in rows]
+    pillars = {}
+    for i, p in enumerate(PILLARS, start=1):
+        pillars[p] = {
+            'score': [r[3 + i] for r in rows],
+            'delta': [r[3 + n + 2 * i] for r in rows],
+            'rolling': [r[4 + n + 2 * i] for r in rows]
+        }
+    trend = {'audits': audits, 'pillars': pillars}
+
+    with _trend_lock:
+        _trend_cache[key] = (time.monotonic(), trend)
+        _trend_cache.move_to_end(key)
+        while len(_trend_cache) > TREND_CACHE_SIZE:
+            _trend_cache.popitem(last=False)
+    return trend
+
+def invalidate_trend_cache(company_name=None):
+    """Сбрасывает кэш трендов компании (или весь кэш, если компания не указана)"""
+    with _trend_lock:
+        if company_name is None:
+            _trend_cache.clear()
+            return
+        for key in [k for k in _trend_cache if k[0] == company_name]:
+            del _trend_cache[key]
+
+@timed
+def get_audit_chart(audit_id, fmt='svg'):
+    """Возвращает заранее отрендеренный радар аудита (bytes) или None"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT data FROM audit_charts WHERE audit_id = ? AND format = ?", (audit_id, fmt)
+            ).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"Error getting audit chart: {e}")
+        return None
+
+@timed
+def get_playbook(input_hash):
+    """Сохранённый playbook по хэшу входных данных: (playbook, markdown) или None"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT playbook_json, markdown FROM playbooks WHERE input_hash = ?", (input_hash,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+    except Exception as e:
+        print(f"Error getting playbook: {e}")
+        return None
+
+@timed
+def save_playbook(input_hash, playbook, markdown):
+    """Сохраняет сгенерированный playbook; повторное сохранение того же ключа ничего не меняет"""
+    try:
+        with get_connection() as conn, conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO playbooks (input_hash, playbook_json, markdown) VALUES (?, ?, ?)",
+                (input_hash, json.dumps(playbook, ensure_ascii=False), markdown)
+            )
+        return True
+    except Exception as e:
+        print(f"Error saving playbook: {e}")
+        return False
+
+@timed
+def get_audit_playbook(audit_id):
+    """Playbook, сохранённый вместе с аудитом: (playbook, markdown) или None"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute('''
+                SELECT p.playbook_json, p.markdown
+                FROM audit_playbooks ap JOIN playbooks p ON p.input_hash = ap.input_hash
+                WHERE ap.audit_id = ?
+            ''', (audit_id,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+    except Exception as e:
+        print(f"Error getting audit playbook: {e}")
+        return None
+
+@timed
+def write_ops(ops):
+    """
+    Записывает пачку отложенных операций одной транзакцией, в порядке очереди:
+    ('save_audit', audit_id, аргументы _write_audit, draft_id или None), ('delete_audit', audit_id),
+    ('open', draft_id, username), ('event', draft_id, kind, position, payload),
+    ('close', draft_id, audit_id). Ошибки пробрасываются — повтор решает вызывающий.
+    """
+    companies, drafts_touched = set(), set()
+    with get_connection() as conn, conn:
+        for op in ops:
+            kind = op[0]
+            if kind == 'save_audit':
+                _write_audit(conn, op[1], **op[2])
+                companies.add(op[2]['company_name'])
+                if op[3] is not None:
+                    # черновик закрывается вместе с записью аудита, а не отдельной операцией
+                    conn.execute("UPDATE drafts SET status = 'saved', audit_id = ? WHERE id = ?", (op[1], op[3]))
+                    drafts_touched.add(op[3])
+            elif kind == 'delete_audit':
+                companies.update(_delete_audit_rows(conn, op[1]))
+            elif kind == 'open':
+                conn.execute("INSERT OR IGNORE INTO drafts (id, username) VALUES (?, ?)", op[1:])
+                drafts_touched.add(op[1])
+            elif kind == 'event':
+                conn.execute(
+                    "INSERT INTO draft_events (draft_id, kind, position, payload) VALUES (?, ?, ?, ?)", op[1:]
+                )
+                drafts_touched.add(op[1])
+            elif kind == 'close':
+                conn.execute("UPDATE drafts SET status = 'saved', audit_id = ? WHERE id = ?", (op[2], op[1]))
+                drafts_touched.add(op[1])
+            else:
+                raise ValueError(f"Unknown write operation '{kind}'")
+        conn.executemany(
+            "UPDATE drafts SET updated_at = CURRENT_TIMESTAMP WHERE id = ?", [(d,) for d in drafts_touched]
+        )
+
+    if companies:
+        invalidate_company_cache()
+        for company_name in companies:
+            invalidate_trend_cache(company_name)
+
+@timed
+def get_draft_events(draft_id, username):
+    """
+    События открытого черновика в порядке записи: [(kind, position, payload)].
+    None — черновика нет, он уже сохранён как аудит или принадлежит другому
+    практику (эти случаи не различаются).
+    """
+    try:
+        with get_connection() as conn:
+            owned = conn.execute(
+                "SELECT 1 FROM drafts WHERE id = ? AND username = ? AND status = 'open'", (draft_id, username)
+            ).fetchone()
+            if owned is None:
+                return None
+            return conn.execute(
+                "SELECT kind, position, payload FROM draft_events WHERE draft_id = ? ORDER BY id", (draft_id,)
+            ).fetchall()
+    except Exception as e:
+        print(f"Error getting draft events: {e}")
+        return None
+
+@timed
+def list_drafts(username, status='open', limit=20):
+    """Черновики практика (по логину), последние изменённые — первыми"""
+    try:
+        with get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT d.id, d.status, d.audit_id, d.created_at, d.updated_at,
+                       (SELECT COUNT(*) FROM draft_events e WHERE e.draft_id = d.id) AS events
+                FROM drafts d
+                WHERE d.username = ? AND d.status = ?
+                ORDER BY d.updated_at DESC
+                LIMIT ?
+            ''', (username, status, limit))
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"Error listing drafts: {e}")
+        return []
+
+@timed
 def delete_audit(audit_id):
     """Удаляет аудит"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("DELETE FROM audits WHERE id = ?", (audit_id,))
-        conn.commit()
-        conn.close()
+        with get_connection() as conn, conn:
+            companies = _delete_audit_rows(conn, audit_id)
+        invalidate_company_cache()
+        for company_name in companies:
+            invalidate_trend_cache(company_name)
         return True
     except Exception as e:
         print(f"Error deleting audit: {e}")
         return False
 
+def _delete_audit_rows(conn, audit_id):
+    """Удаляет аудит в открытой транзакции; возвращает компании удалённых строк"""
+    deleted = conn.execute("DELETE FROM audits WHERE id = ? RETURNING company_name", (audit_id,)).fetchall()
+    conn.execute("DELETE FROM audit_search WHERE rowid = ?", (audit_id,))
+    return [company_name for (company_name,) in deleted]
+
+def invalidate_company_cache():
+    """Сбрасывает кэш справочника компаний (после записи аудитов)"""
+    global _company_cache
+    _company_cache = None
+
+def _company_index():
+    """Справочник компаний из кэша процесса; перечитывается после записи или по TTL"""
+    global _company_cache
+    cache = _company_cache
+    if cache is not None and time.monotonic() - cache[0] < COMPANY_CACHE_TTL:
+        return cache
+    with get_connection() as conn:
+        rows = conn.execute("SELECT name, audit_count, last_audit_at FROM companies").fetchall()
+    # сортировка в Python: ключи поиска и порядок строк должны совпадать для bisect
+    rows.sort(key=lambda row: (row[0].casefold(), row[0]))
+    recent = [row[0] for row in sorted(rows, key=lambda row: row[2] or "", reverse=True)]
+    cache = (time.monotonic(), rows, [row[0].casefold() for row in rows], recent)
+    _company_cache = cache
+    return cache
+
+@timed
 def get_company_list():
     """Возвращает список уникальных компаний для фильтра"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        df = pd.read_sql_query("SELECT DISTINCT company_name FROM audits WHERE company_name IS NOT NULL ORDER BY company_name", conn)
-        conn.close()
-        return df['company_name'].tolist()
+        return [row[0] for row in _company_index()[1]]
     except Exception as e:
         print(f"Error getting company list: {e}")
         return []
+
+@timed
+def get_company_index():
+    """Компании с числом аудитов и датой последнего аудита"""
+    try:
+        return [{'name': name, 'audit_count': count, 'last_audit_at': last}
+                for name, count, last in _company_index()[1]]
+    except Exception as e:
+        print(f"Error getting company index: {e}")
+        return []
+
+@timed
+def search_companies(prefix="", limit=COMPANY_SEARCH_LIMIT):
+    """
+    Компании, название которых начинается с prefix (без учёта регистра), по алфавиту.
+    Поиск — бинарный по отсортированным ключам в кэше, без запроса к базе.
+    Пустой prefix — последние компании, с которыми работали.
+    """
+    try:
+        _, rows, keys, recent = _company_index()
+        if not prefix:
+            return recent[:limit]
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        names = []
+        for i in range(start, len(keys)):
+            if not keys[i].startswith(prefix) or len(names) >= limit:
+                break
+            names.append(rows[i][0])
+        return names
+    except Exception as e:
+        print(f"Error searching companies: {e}")
+        return []
+
+# ------------------------------
+# Учётные записи практиков
+# ------------------------------
+def upsert_practitioner(username, name, email, password_hash, active=True):
+    """
+    Создаёт или обновляет учётную запись. Принимает только готовый bcrypt-хэш —
+    открытые пароли в базу не пишутся.
+    """
+    if not str(password_hash).startswith("$2"):
+        raise ValueError("password_hash must be a bcrypt hash")
+    try:
+        with get_connection() as conn, conn:
+            conn.execute('''
+                INSERT INTO practitioners (username, name, email, password_hash, active)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET
+                    name = excluded.name,
+                    email = excluded.email,
+                    password_hash = excluded.password_hash,
+                    active = excluded.active
+            ''', (username.lower(), name, email, password_hash, 1 if active else 0))
+        return True
+    except Exception as e:
+        print(f"Error saving practitioner: {e}")
+        return False
+
+def get_practitioner(username):
+    """Одна учётная запись по логину (поиск по первичному ключу) или None"""
+    try:
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT username, name, email, password_hash, active FROM practitioners WHERE username = ?",
+                (username.lower(),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'username': row[0], 'name': row[1], 'email': row[2], 'password_hash': row[3], 'active': bool(row[4])}
+    except Exception as e:
+        print(f"Error getting practitioner: {e}")
+        return None
+
+@timed
+def get_practitioner_credentials():
+    """Активные учётные записи в формате credentials['usernames'] streamlit-authenticator"""
+    try:
+        with get_connection() as conn:
+            rows = conn.execute(
+                "SELECT username, name, email, password_hash FROM practitioners WHERE active = 1"
+            ).fetchall()
+        return {username: {'name': name, 'email': email, 'password': password_hash}
+                for username, name, email, password_hash in rows}
+    except Exception as e:
+        print(f"Error getting practitioner credentials: {e}")
+        return {}
+
+def count_practitioners():
+    """Число учётных записей (включая неактивные)"""
+    try:
+        with get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM practitioners").fetchone()[0]
+    except Exception as e:
+        print(f"Error counting practitioners: {e}")
+        return 0
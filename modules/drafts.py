@@ -0,0 +1,97 @@
+"""
+Черновики аудитов на сервере: каждое изменение списка респондентов —
+событие в журнале черновика (таблица draft_events), только добавление.
+
+События пишет фоновый поток write_behind: вызовы из UI лишь кладут операцию
+в очередь, а поток забирает всё накопившееся и записывает одной транзакцией.
+Черновик восстанавливается по ID проигрыванием журнала — после перезапуска
+сервера или обрыва websocket практик продолжает с того же места.
+
+Журнал — долговременная копия, а не замена памяти сессии: рабочий список
+респондентов целиком остаётся в st.session_state (компактные записи Respondent),
+агрегаты и правки по индексу работают с ним.
+"""
+import json
+import uuid
+
+from modules import database
+from modules.respondents import Respondent
+from modules.write_behind import flush, submit as _submit
+
+
+def new_draft_id():
+    return uuid.uuid4().hex
+
+
+def _encode(respondent):
+    """Респондент в JSON события: только ответы анкеты, оценки и время в наносекундах"""
+    return {
+        'name': respondent.name,
+        'role': respondent.role,
+        'answers': respondent.answers,
+        'scores': respondent.scores,
+        'timestamp_ns': respondent.timestamp_ns
+    }
+
+
+def _decode(payload):
+    return Respondent(payload['name'], payload['role'], payload['answers'], payload['scores'],
+                      payload['timestamp_ns'])
+
+
+# ------------------------------
+# События черновика
+# ------------------------------
+def open_draft(draft_id, username, respondents=()):
+    """Заводит черновик практика username; уже собранные респонденты попадают в него одним снимком"""
+    _submit(('open', draft_id, username))
+    if respondents:
+        record_snapshot(draft_id, respondents)
+
+
+def record_add(draft_id, respondents):
+    """Добавление одного или пачки респондентов (импорт) — одно событие"""
+    _submit(('event', draft_id, 'add', None, json.dumps([_encode(r) for r in respondents])))
+
+
+def record_update(draft_id, index, respondent):
+    _submit(('event', draft_id, 'update', index, json.dumps(_encode(respondent))))
+
+
+def record_delete(draft_id, index):
+    _submit(('event', draft_id, 'delete', index, None))
+
+
+def record_snapshot(draft_id, respondents):
+    """Полный список респондентов — заменяет всё, что было до него"""
+    _submit(('event', draft_id, 'snapshot', None, json.dumps([_encode(r) for r in respondents])))
+
+
+def close_draft(draft_id, audit_id):
+    """Черновик сохранён как аудит и больше не предлагается к продолжению"""
+    _submit(('close', draft_id, audit_id))
+
+
+def load_draft(draft_id, username):
+    """
+    Список респондентов черновика (проигрывание журнала) или None, если черновика
+    нет, он уже сохранён как аудит или он чужой — продолжить можно только открытый
+    черновик того же практика (по логину).
+    Перед чтением дожидается записи событий, ещё стоящих в очереди.
+    """
+    flush()
+    events = database.get_draft_events(draft_id, username)
+    if events is None:
+        return None
+
+    respondents = []
+    for kind, position, payload in events:
+        if kind == 'add':
+            respondents.extend(_decode(p) for p in json.loads(payload))
+        elif kind == 'snapshot':
+            respondents = [_decode(p) for p in json.loads(payload)]
+        elif kind == 'update' and 0 <= position < len(respondents):
+            respondents[position] = _decode(json.loads(payload))
+        elif kind == 'delete' and 0 <= position < len(respondents):
+            del respondents[position]
+    return respondents
@@ -1,136 +1,192 @@
-import pandas as pd
+import time
+
 import streamlit as st
 
-def init_interview_state():
-    """Инициализация состояния для множественных интервью"""
+from modules.aggregation import (
+    RunningPillarStats, aggregate_respondents, consensus_from_aggregated, disagreements_from_aggregated
+)
+from modules import drafts
+from modules.metrics import timed
+from modules.respondents import Respondent
+
+def init_interview_state(owner=None):
+    """
+    Инициализация состояния для множественных интервью.
+    owner — логин практика, владелец черновиков; если в адресе есть ?draft=<ID>,
+    а в сессии пусто (перезапуск, обрыв соединения), черновик восстанавливается.
+    """
     if 'respondents' not in st.session_state:
         st.session_state.respondents = []
+    elif any(isinstance(r, dict) for r in st.session_state.respondents):
+        # сессия, начатая до перехода на компактные записи
+        st.session_state.respondents = [Respondent.from_record(r) for r in st.session_state.respondents]
     if 'current_respondent' not in st.session_state:
         st.session_state.current_respondent = {}
     if 'edit_mode' not in st.session_state:
         st.session_state.edit_mode = False
     if 'edit_index' not in st.session_state:
         st.session_state.edit_index = None
+    if 'respondents_version' not in st.session_state:
+        st.session_state.respondents_version = 0
+    if 'role_weights' not in st.session_state:
+        st.session_state.role_weights = None
+    if 'running_stats' not in st.session_state:
+        st.session_state.running_stats = RunningPillarStats(st.session_state.respondents)
+    if owner is not None:
+        st.session_state.draft_owner = owner
+    if 'draft_id' not in st.session_state:
+        st.session_state.draft_id = None
+        draft_id = st.query_params.get('draft')
+        if draft_id and not st.session_state.respondents:
+            resume_draft(draft_id)
+
+def _draft_id():
+    """
+    ID черновика сессии; заводится при первом изменении списка респондентов.
+    None — черновики не ведутся (владелец не указан, например в бенчмарках).
+    """
+    draft_id = st.session_state.get('draft_id')
+    if draft_id is None and st.session_state.get('draft_owner') is not None:
+        draft_id = drafts.new_draft_id()
+        drafts.open_draft(draft_id, st.session_state.get('draft_owner'), st.session_state.respondents)
+        st.session_state.draft_id = draft_id
+        st.query_params['draft'] = draft_id
+    return draft_id
+
+def resume_draft(draft_id):
+    """
+    Загружает респондентов черновика в сессию; False — черновик не найден,
+    уже сохранён как аудит или принадлежит другому практику
+    """
+    owner = st.session_state.get('draft_owner')
+    if owner is None:
+        return False
+    respondents = drafts.load_draft(draft_id, owner)
+    if respondents is None:
+        return False
+    st.session_state.respondents = respondents
+    st.session_state.running_stats = RunningPillarStats(respondents)
+    st.session_state.draft_id = draft_id
+    st.query_params['draft'] = draft_id
+    _mark_respondents_changed()
+    return True
+
+def finish_draft():
+    """
+    Аудит сохранён (черновик закрыт той же операцией записи, см. enqueue_save_audit):
+    черновик отвязывается от сессии, следующие правки начнут новый
+    """
+    if st.session_state.get('draft_id') is not None:
+        st.session_state.draft_id = None
+        st.query_params.pop('draft', None)
+
+def _running_stats():
+    """Инкрементальные статистики; пересобираются, если рассинхронизированы со списком"""
+    stats = st.session_state.get('running_stats')
+    if stats is None or stats.n != len(st.session_state.respondents):
+        stats = RunningPillarStats(st.session_state.respondents)
+        st.session_state.running_stats = stats
+    return stats
+
+def _mark_respondents_changed():
+    """Инвалидирует кэш агрегатов после изменения списка респондентов"""
+    st.session_state.respondents_version = st.session_state.get('respondents_version', 0) + 1
 
 def add_respondent(name, role, answers, scores):
     """Добавить нового респондента с защитой от ошибок"""
-    # Проверяем, что scores — это словарь
-    if scores is None or not isinstance(scores, dict):
-        scores = {
-            'trigger_clarity': 0,
-            'decision_ownership': 0,
-            'protected_intervention': 0,
-            'override_transparency': 0,
-            'drift_detection': 0
-        }
-    
-    # Проверяем, что answers — это словарь
-    if answers is None or not isinstance(answers, dict):
-        answers = {}
-    
-    respondent = {
-        'name': name,
-        'role': role,
-        'answers': answers.copy(),
-        'scores': scores.copy(),
-        'timestamp': pd.Timestamp.now()
-    }
+    # Проверяем, что scores и answers — словари (Respondent подставит нули и пустые ответы)
+    if not isinstance(scores, dict):
+        scores = None
+    if not isinstance(answers, dict):
+        answers = None
+
+    respondent = Respondent(name, role, answers, scores)
+    draft_id = _draft_id()
+    stats = _running_stats()
     st.session_state.respondents.append(respondent)
+    stats.add(respondent.scores)
+    if draft_id:
+        drafts.record_add(draft_id, [respondent])
+    _mark_respondents_changed()
+
+@timed
+def add_respondents(records):
+    """Пакетно добавить респондентов (например, из импорта опроса)"""
+    if not records:
+        return
+    draft_id = _draft_id()
+    stats = _running_stats()
+    timestamp = time.time_ns()
+    added = [Respondent.from_record(record, timestamp) for record in records]
+    st.session_state.respondents.extend(added)
+    for respondent in added:
+        stats.add(respondent.scores)
+    if draft_id:
+        drafts.record_add(draft_id, added)
+    _mark_respondents_changed()
 
 def update_respondent(index, name, role, answers, scores):
     """Обновить существующего респондента с защитой"""
     if 0 <= index < len(st.session_state.respondents):
-        # Проверяем, что scores — это словарь
-        if scores is None or not isinstance(scores, dict):
-            scores = {
-                'trigger_clarity': 0,
-                'decision_ownership': 0,
-                'protected_intervention': 0,
-                'override_transparency': 0,
-                'drift_detection': 0
-            }
-        
-        # Проверяем, что answers — это словарь
-        if answers is None or not isinstance(answers, dict):
-            answers = {}
-        
-        st.session_state.respondents[index] = {
-            'name': name,
-            'role': role,
-            'answers': answers.copy(),
-            'scores': scores.copy(),
-            'timestamp': pd.Timestamp.now()
-        }
+        if not isinstance(scores, dict):
+            scores = None
+        if not isinstance(answers, dict):
+            answers = None
+
+        draft_id = _draft_id()
+        stats = _running_stats()
+        old_scores = st.session_state.respondents[index].get('scores')
+        respondent = Respondent(name, role, answers, scores)
+        st.session_state.respondents[index] = respondent
+        stats.replace(old_scores, respondent.scores)
+        if draft_id:
+            drafts.record_update(draft_id, index, respondent)
+        _mark_respondents_changed()
 
 def delete_respondent(index):
     """Удалить респондента"""
     if 0 <= index < len(st.session_state.respondents):
-        del st.session_state.respondents[index]
+        draft_id = _draft_id()
+        stats = _running_stats()
+        removed = st.session_state.respondents.pop(index)
+        stats.remove(removed.get('scores'))
+        if draft_id:
+            drafts.record_delete(draft_id, index)
+        _mark_respondents_changed()
 
-def get_aggregated_scores():
-    """Получить агрегированные scores по всем респондентам"""
+@timed
+def get_aggregated_scores(role_weights=None):
+    """
+    Получить агрегированные scores по всем респондентам.
+    Без весов берётся снимок инкрементальных статистик; результат
+    кэшируется на версию списка респондентов и набор весов.
+    """
     if not st.session_state.respondents:
         return None
-    
-    scores_list = [r['scores'] for r in st.session_state.respondents]
-    
-    aggregated = {
-        'trigger_clarity': {
-            'avg': sum(s['trigger_clarity'] for s in scores_list) / len(scores_list),
-            'min': min(s['trigger_clarity'] for s in scores_list),
-            'max': max(s['trigger_clarity'] for s in scores_list)
-        },
-        'decision_ownership': {
-            'avg': sum(s['decision_ownership'] for s in scores_list) / len(scores_list),
-            'min': min(s['decision_ownership'] for s in scores_list),
-            'max': max(s['decision_ownership'] for s in scores_list)
-        },
-        'protected_intervention': {
-            'avg': sum(s['protected_intervention'] for s in scores_list) / len(scores_list),
-            'min': min(s['protected_intervention'] for s in scores_list),
-            'max': max(s['protected_intervention'] for s in scores_list)
-        },
-        'override_transparency': {
-            'avg': sum(s['override_transparency'] for s in scores_list) / len(scores_list),
-            'min': min(s['override_transparency'] for s in scores_list),
-            'max': max(s['override_transparency'] for s in scores_list)
-        },
-        'drift_detection': {
-            'avg': sum(s['drift_detection'] for s in scores_list) / len(scores_list),
-            'min': min(s['drift_detection'] for s in scores_list),
-            'max': max(s['drift_detection'] for s in scores_list)
-        }
-    }
-    
+
+    if role_weights is None:
+        role_weights = st.session_state.get('role_weights')
+    weights_key = tuple(sorted(role_weights.items())) if role_weights else None
+    key = (st.session_state.get('respondents_version', 0), len(st.session_state.respondents), weights_key)
+
+    cached = st.session_state.get('_aggregation_cache')
+    if cached and cached[0] == key:
+        return cached[1]
+
+    if role_weights:
+        # Взвешенные средние считаются по матрице целиком
+        aggregated = aggregate_respondents(st.session_state.respondents, role_weights)
+    else:
+        aggregated = _running_stats().snapshot()
+    st.session_state._aggregation_cache = (key, aggregated)
     return aggregated
 
+@timed
 def get_consensus_score():
     """Получить общий скор (среднее от агрегированных)"""
-    agg = get_aggregated_scores()
-    if not agg:
-        return 0
-    total = (agg['trigger_clarity']['avg'] +
-             agg['decision_ownership']['avg'] +
-             agg['protected_intervention']['avg'] +
-             agg['override_transparency']['avg'] +
-             agg['drift_detection']['avg'])
-    return total
+    return consensus_from_aggregated(get_aggregated_scores())
 
+@timed
 def get_disagreement_areas(threshold=1.5):
     """Найти области наибольшего расхождения (max - min > threshold)"""
-    agg = get_aggregated_scores()
-    if not agg:
-        return []
-    
-    disagreements = []
-    for pillar, values in agg.items():
-        spread = values['max'] - values['min']
-        if spread > threshold:
-            disagreements.append({
-                'pillar': pillar.replace('_', ' ').title(),
-                'spread': spread,
-                'min': values['min'],
-                'max': values['max']
-            })
-    
-    return sorted(disagreements, key=lambda x: x['spread'], reverse=True)
+    return disagreements_from_aggregated(get_aggregated_scores(), threshold)
@@ -0,0 +1,233 @@
+"""
+Лёгкая инструментация горячих путей: счётчики вызовов и гистограммы задержек.
+
+    @timed
+    def save_audit(...): ...
+
+    with timed_block("page.history"):
+        ...
+
+Пока сбор выключен, обёртка стоит одну проверку флага. Включается переменной
+окружения AVCS_METRICS=1 или из админ-панели (enable/disable).
+Время инклюзивное: вложенные инструментированные вызовы входят во время внешнего.
+"""
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Границы корзин гистограммы, секунды (как у клиентов Prometheus по умолчанию)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_NAME = "avcs_call_duration_seconds"
+
+_enabled = os.environ.get("AVCS_METRICS", "0") == "1"
+_lock = threading.Lock()
+_histograms = {}  # имя -> [счётчики по корзинам..., +Inf, сумма секунд]
+_local = threading.local()
+_server = None
+_gauges = {}  # имя метрики -> (описание, функция без аргументов)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Обнуляет накопленные гистограммы процесса"""
+    with _lock:
+        _histograms.clear()
+
+
+def _record(name, seconds):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+                break
+        else:
+            hist[len(BUCKETS)] += 1
+        hist[-1] += seconds
+
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is not None:
+        entry = rerun.get(name)
+        if entry is None:
+            rerun[name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def timed(func=None, *, name=None):
+    """
+    Декоратор: считает вызовы и время функции под именем '<модуль>.<функция>'.
+    Применяется как @timed или @timed(name="...").
+    """
+    if func is None:
+        return functools.partial(timed, name=name)
+
+    metric = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(metric, time.perf_counter() - started)
+
+    return wrapper
+
+
+def observe(name, seconds):
+    """Записывает уже измеренную длительность (например, между потоками)"""
+    if _enabled:
+        _record(name, seconds)
+
+
+@contextmanager
+def timed_block(name):
+    """Контекстный менеджер для участков кода, которые не являются отдельной функцией"""
+    if not _enabled:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - started)
+
+
+# ------------------------------
+# Разбивка по перезапускам скрипта
+# ------------------------------
+def begin_rerun(state):
+    """
+    Начинает сбор для нового перезапуска скрипта.
+    state — st.session_state сессии: незавершённый прошлый сбор (st.stop, st.rerun)
+    переносится в state['_metrics_last_rerun'] и остаётся доступен панели.
+    """
+    current = state.get('_metrics_rerun')
+    if current is not None:
+        current['total'] = time.perf_counter() - current['started']
+        state['_metrics_last_rerun'] = current
+
+    if not _enabled:
+        state['_metrics_rerun'] = None
+        _local.rerun = None
+        return
+    current = {'started': time.perf_counter(), 'calls': {}}
+    state['_metrics_rerun'] = current
+    _local.rerun = current['calls']
+
+
+def last_rerun(state):
+    """Разбивка прошлого перезапуска: (общее время, [(имя, вызовов, секунд)] по убыванию времени)"""
+    last = state.get('_metrics_last_rerun')
+    if not last:
+        return None, []
+    rows = sorted(((n, c, s) for n, (c, s) in last['calls'].items()), key=lambda row: row[2], reverse=True)
+    return last.get('total'), rows
+
+
+# ------------------------------
+# Снимок и экспорт
+# ------------------------------
+def snapshot():
+    """{имя: {'count', 'sum', 'buckets': [(граница, накопленный счётчик)]}}"""
+    with _lock:
+        items = [(n, list(h)) for n, h in _histograms.items()]
+    result = {}
+    for metric, hist in sorted(items):
+        cumulative, buckets = 0, []
+        for bound, count in zip(BUCKETS + (float("inf"),), hist[:-1]):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        result[metric] = {'count': cumulative, 'sum': hist[-1], 'buckets': buckets}
+    return result
+
+
+def register_gauge(metric, help_text, func):
+    """Gauge для экспорта: func() вызывается при каждом снятии метрик"""
+    with _lock:
+        _gauges[metric] = (help_text, func)
+
+
+def gauges():
+    """{имя: текущее значение} зарегистрированных gauge"""
+    with _lock:
+        items = sorted(_gauges.items())
+    return {metric: func() for metric, (_, func) in items}
+
+
+def render_prometheus():
+    """Текстовый формат экспозиции Prometheus"""
+    lines = []
+    with _lock:
+        gauge_items = sorted(_gauges.items())
+    for metric, (help_text, func) in gauge_items:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {func()}"]
+    lines += [
+        f"# HELP {METRIC_NAME} Latency of instrumented AVCS calls.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    for metric, data in snapshot().items():
+        label = metric.replace("\\", "\\\\").replace('"', '\\"')
+        for bound, count in data['buckets']:
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{METRIC_NAME}_bucket{{fn="{label}",le="{le}"}} {count}')
+        lines.append(f'{METRIC_NAME}_sum{{fn="{label}"}} {data["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{fn="{label}"}} {data["count"]}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Отдаёт /metrics для Prometheus из фонового потока (один сервер на процесс).
+    Streamlit не даёт добавлять свои HTTP-маршруты, поэтому порт отдельный.
+    """
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"Error starting metrics server: {e}")
+            return None
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    return _server
@@ -1,5 +1,98 @@
+import hashlib
+import json
 from datetime import datetime
+from types import MappingProxyType
 
+from modules.database import get_audit_playbook, get_playbook, save_playbook
+from modules.metrics import timed
+
+# ------------------------------
+# Каталог действий и шаблоны — собираются один раз при импорте
+# ------------------------------
+PILLAR_ACTIONS = MappingProxyType({
+    'trigger_clarity': (
+        "Review and document all critical deviation thresholds",
+        "Ensure thresholds are quantitative, not qualitative",
+        "Implement automatic escalation for thresholds exceeded",
+        "Train all operators on mandatory vs interpretive triggers",
+        "Audit last 3 months of logs for unreported deviations"
+    ),
+    'decision_ownership': (
+        "Define single accountable owner for each critical decision type",
+        "Update job descriptions to include decision authority",
+        "Ensure owners are operationally present 24/7",
+        "Create escalation matrix with clear ownership levels",
+        "Review last 3 incidents for ownership diffusion"
+    ),
+    'protected_intervention': (
+        "Formally codify stop-work authority in policy",
+        "Remove stop-work events from KPI calculations",
+        "Train supervisors to respond positively to stops",
+        "Create 'positive stop' recognition program",
+        "Review last 6 months of stop events for retaliation"
+    ),
+    'override_transparency': (
+        "Implement mandatory override logging system",
+        "Require named approver for all overrides",
+        "Create weekly override review meetings",
+        "Analyze override patterns for systemic issues",
+        "Audit undocumented workarounds in key processes"
+    ),
+    'drift_detection': (
+        "Implement trend analysis for all minor deviations",
+        "Create monthly drift report for management",
+        "Set up alerts for repeated small deviations",
+        "Review last 12 months of deviation logs for patterns",
+        "Assign ownership for drift monitoring"
+    ),
+})
+
+# Наборы действий по уровню оценки: (все, первые 3, первые 2)
+_ACTION_SETS = MappingProxyType({
+    pillar: (actions, actions[:3], actions[:2]) for pillar, actions in PILLAR_ACTIONS.items()
+})
+_NO_ACTIONS = ((), (), ())
+
+# Структурные рекомендации для pillars со средним ниже порога
+STRUCTURAL_THRESHOLD = 3
+STRUCTURAL_RECOMMENDATIONS = (
+    ('trigger_clarity', "Establish a formal 'Deviation Review Board' to analyze all threshold exceedances"),
+    ('decision_ownership', "Create a Decision Rights Matrix (RAPID or similar) for all critical operations"),
+    ('protected_intervention', "Implement a 'Safety Pause' program with guaranteed protection for those who stop work"),
+    ('override_transparency', "Deploy a digital override tracking system with automated alerts to management"),
+    ('drift_detection', "Establish a 'Drift Dashboard' showing trends in minor deviations over time"),
+)
+GENERAL_RECOMMENDATIONS = (
+    "Schedule a follow-up SIM assessment in 6 months to measure progress",
+    "Share aggregated results with all respondents to close the feedback loop",
+)
+
+MD_HEADER = """
+## 📋 AVCS Structural Integrity Playbook
+
+**Company:** {company}  
+**Location:** {location}  
+**Date:** {date}  
+**Total Score:** {total_score:.1f}/25
+
+---
+"""
+MD_PRIORITY_HEADING = "\n### 🔴 Priority Areas (Lowest Scores)\n"
+MD_PRIORITY_AREA = "\n#### {pillar} — {score}\n"
+MD_ACTION = "- [ ] {}\n"
+MD_DISAGREEMENT_HEADING = (
+    "\n### ⚠️ Alignment Opportunities\n"
+    "*Areas where respondents disagree — conduct focused workshops*\n\n"
+)
+MD_DISAGREEMENT = "- **{pillar}** (spread {spread}): {action}\n"
+MD_STRUCTURAL_HEADING = "\n### 🏗️ Structural Recommendations\n"
+MD_RECOMMENDATION = "- {}\n"
+
+# Поля конкретного аудита: в ключ и сохранённое тело playbook не входят, подставляются при каждой выдаче
+PER_AUDIT_FIELDS = ('date',)
+
+
+@timed
 def generate_playbook(aggregated_scores, disagreements, company_name, location):
     """
     Генерирует персонализированный план действий на основе результатов аудита.
@@ -59,52 +152,13 @@ def generate_playbook(aggregated_scores, disagreements, company_name, location):
 
 def _get_actions_for_pillar(pillar, score):
     """Возвращает конкретные действия для каждого Pillar"""
-    
-    actions = {
-        'trigger_clarity': [
-            "Review and document all critical deviation thresholds",
-            "Ensure thresholds are quantitative, not qualitative",
-            "Implement automatic escalation for thresholds exceeded",
-            "Train all operators on mandatory vs interpretive triggers",
-            "Audit last 3 months of logs for unreported deviations"
-        ],
-        'decision_ownership': [
-            "Define single accountable owner for each critical decision type",
-            "Update job descriptions to include decision authority",
-            "Ensure owners are operationally present 24/7",
-            "Create escalation matrix with clear ownership levels",
-            "Review last 3 incidents for ownership diffusion"
-        ],
-        'protected_intervention': [
-            "Formally codify stop-work authority in policy",
-            "Remove stop-work events from KPI calculations",
-            "Train supervisors to respond positively to stops",
-            "Create 'positive stop' recognition program",
-            "Review last 6 months of stop events for retaliation"
-        ],
-        'override_transparency': [
-            "Implement mandatory override logging system",
-            "Require named approver for all overrides",
-            "Create weekly override review meetings",
-            "Analyze override patterns for systemic issues",
-            "Audit undocumented workarounds in key processes"
-        ],
-        'drift_detection': [
-            "Implement trend analysis for all minor deviations",
-            "Create monthly drift report for management",
-            "Set up alerts for repeated small deviations",
-            "Review last 12 months of deviation logs for patterns",
-            "Assign ownership for drift monitoring"
-        ]
-    }
-    
-    pillar_actions = actions.get(pillar, [])
+    all_actions, top3, top2 = _ACTION_SETS.get(pillar, _NO_ACTIONS)
     if score <= 1.5:
-        return pillar_actions
+        return list(all_actions)
     elif score <= 2.5:
-        return pillar_actions[:3]
+        return list(top3)
     else:
-        return pillar_actions[:2]
+        return list(top2)
 
 def _get_disagreement_action(disagreement):
     """Формирует рекомендацию для области расхождения"""
@@ -115,64 +169,86 @@ def _get_disagreement_action(disagreement):
 
 def _get_structural_recommendations(aggregated_scores):
     """Возвращает общие структурные рекомендации"""
-    
     recommendations = []
-    
     if aggregated_scores:
-        if aggregated_scores.get('trigger_clarity', {}).get('avg', 5) < 3:
-            recommendations.append("Establish a formal 'Deviation Review Board' to analyze all threshold exceedances")
-        
-        if aggregated_scores.get('decision_ownership', {}).get('avg', 5) < 3:
-            recommendations.append("Create a Decision Rights Matrix (RAPID or similar) for all critical operations")
-        
-        if aggregated_scores.get('protected_intervention', {}).get('avg', 5) < 3:
-            recommendations.append("Implement a 'Safety Pause' program with guaranteed protection for those who stop work")
-        
-        if aggregated_scores.get('override_transparency', {}).get('avg', 5) < 3:
-            recommendations.append("Deploy a digital override tracking system with automated alerts to management")
-        
-        if aggregated_scores.get('drift_detection', {}).get('avg', 5) < 3:
-            recommendations.append("Establish a 'Drift Dashboard' showing trends in minor deviations over time")
-    
-    recommendations.append("Schedule a follow-up SIM assessment in 6 months to measure progress")
-    recommendations.append("Share aggregated results with all respondents to close the feedback loop")
-    
+        for pillar, text in STRUCTURAL_RECOMMENDATIONS:
+            if aggregated_scores.get(pillar, {}).get('avg', 5) < STRUCTURAL_THRESHOLD:
+                recommendations.append(text)
+    recommendations.extend(GENERAL_RECOMMENDATIONS)
     return recommendations
 
 def format_playbook_for_display(playbook):
     """Форматирует playbook для отображения в Streamlit"""
-    
-    md = f"""
-## 📋 AVCS Structural Integrity Playbook
+    return MD_HEADER.format(**playbook) + format_playbook_body(playbook)
 
-**Company:** {playbook['company']}  
-**Location:** {playbook['location']}  
-**Date:** {playbook['date']}  
-**Total Score:** {playbook['total_score']:.1f}/25
+def format_playbook_body(playbook):
+    """Markdown playbook без заголовка — он зависит от даты аудита"""
+    parts = []
 
----
-"""
-    
     if playbook['priority_areas']:
-        md += "\n### 🔴 Priority Areas (Lowest Scores)\n"
+        parts.append(MD_PRIORITY_HEADING)
         for area in playbook['priority_areas']:
-            md += f"\n#### {area['pillar']} — {area['score']}\n"
-            for action in area['actions']:
-                md += f"- [ ] {action}\n"
-    
+            parts.append(MD_PRIORITY_AREA.format(**area))
+            parts.extend(MD_ACTION.format(action) for action in area['actions'])
+
     if playbook['disagreement_actions']:
-        md += "\n### ⚠️ Alignment Opportunities\n"
-        md += "*Areas where respondents disagree — conduct focused workshops*\n\n"
-        for item in playbook['disagreement_actions']:
-            md += f"- **{item['pillar']}** (spread {item['spread']}): {item['action']}\n"
-    
+        parts.append(MD_DISAGREEMENT_HEADING)
+        parts.extend(MD_DISAGREEMENT.format(**item) for item in playbook['disagreement_actions'])
+
     if playbook['structural_recommendations']:
-        md += "\n### 🏗️ Structural Recommendations\n"
-        for rec in playbook['structural_recommendations']:
-            md += f"- {rec}\n"
-    
-    return md
+        parts.append(MD_STRUCTURAL_HEADING)
+        parts.extend(MD_RECOMMENDATION.format(rec) for rec in playbook['structural_recommendations'])
+
+    return "".join(parts)
 
 def export_playbook_to_markdown(playbook):
     """Экспортирует playbook в Markdown для скачивания"""
     return format_playbook_for_display(playbook)
+
+def playbook_key(aggregated_scores, disagreements, company_name, location):
+    """Ключ сохранённого playbook — хэш всего, от чего зависит его содержимое"""
+    averages = {
+        pillar: round(float(vals['avg']), 4)
+        for pillar, vals in (aggregated_scores or {}).items()
+        if isinstance(vals, dict) and 'avg' in vals
+    }
+    spreads = [
+        [d.get('pillar', 'Unknown'), round(float(d.get('spread', 0)), 4), d.get('min', 0), d.get('max', 0)]
+        for d in disagreements or [] if isinstance(d, dict)
+    ]
+    payload = json.dumps([averages, spreads, company_name or "", location or ""], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def store_playbook(key, playbook):
+    """Сохраняет playbook по ключу без полей конкретного аудита (даты)"""
+    body = {k: v for k, v in playbook.items() if k not in PER_AUDIT_FIELDS}
+    return save_playbook(key, body, format_playbook_body(playbook))
+
+def _render_stored(stored, date):
+    """(playbook, markdown) из сохранённого тела: дата и заголовок — на эту выдачу"""
+    body, markdown = stored
+    playbook = dict(body, date=date or datetime.now().strftime("%Y-%m-%d"))
+    return playbook, MD_HEADER.format(**playbook) + markdown
+
+@timed
+def get_or_generate_playbook(aggregated_scores, disagreements, company_name, location, date=None):
+    """
+    Возвращает (ключ, playbook, markdown). Playbook с теми же входными данными
+    берётся из таблицы playbooks; новый генерируется и сохраняется туда.
+    date — дата аудита в заголовке (по умолчанию сегодняшняя).
+    """
+    key = playbook_key(aggregated_scores, disagreements, company_name, location)
+    stored = get_playbook(key)
+    if stored is not None:
+        return (key, *_render_stored(stored, date))
+
+    playbook = generate_playbook(aggregated_scores, disagreements, company_name, location)
+    if date:
+        playbook['date'] = date
+    store_playbook(key, playbook)
+    return key, playbook, format_playbook_for_display(playbook)
+
+def get_saved_audit_playbook(audit_id, date):
+    """Playbook, сохранённый с аудитом, с датой этого аудита: (playbook, markdown) или None"""
+    stored = get_audit_playbook(audit_id)
+    return _render_stored(stored, date) if stored is not None else None
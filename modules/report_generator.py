@@ -0,0 +1,253 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+
+from modules.charts import SVG_ASPECT, radar_label_positions, render_radar_svg
+from modules.metrics import timed
+from modules.scoring import cls_from_score
+
+LOGO_PATH = "logo.png"
+
+# ------------------------------
+# Кэш PDF: LRU в памяти + необязательный каталог на диске
+# ------------------------------
+PDF_CACHE_SIZE = 32
+PDF_CACHE_DIR = os.environ.get("AVCS_PDF_CACHE_DIR")  # None — дисковый кэш выключен
+RENDER_WORKERS = 2
+
+_cache = OrderedDict()
+_pending = {}
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="pdf-render")
+_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'renders': 0, 'render_seconds': 0.0, 'last_render_ms': 0.0}
+
+
+@lru_cache(maxsize=1)
+def _logo_bytes():
+    """Логотип читается с диска один раз на процесс"""
+    try:
+        with open(LOGO_PATH, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+RADAR_WIDTH_MM = 120
+RADAR_SVG_SIZE = 400
+
+
+@timed
+def render_pdf(scores, total_score, company="", location="", practitioner="", chart_svg=None):
+    """Строит PDF-отчёт и возвращает его байты (без кэша)"""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    draw_report_page(pdf, scores, total_score, company, location, practitioner, chart_svg)
+    return bytes(pdf.output())
+
+
+def _draw_radar(pdf, scores, chart_svg=None):
+    """
+    Вставляет радар из SVG (сохранённого при записи аудита или построенного на лету).
+    FPDF не рисует текст из SVG, поэтому подписи осей выводятся отдельно.
+    """
+    if chart_svg is None:
+        chart_svg = render_radar_svg(scores, size=RADAR_SVG_SIZE, labels=False)
+    if isinstance(chart_svg, str):
+        chart_svg = chart_svg.encode("utf-8")
+
+    x0 = (pdf.w - RADAR_WIDTH_MM) / 2
+    y0 = pdf.get_y()
+    scale = RADAR_WIDTH_MM / (RADAR_SVG_SIZE * SVG_ASPECT)
+    pdf.image(io.BytesIO(chart_svg), x=x0, y=y0, w=RADAR_WIDTH_MM)
+
+    pdf.set_font('Arial','',8)
+    for label, x, y, anchor in radar_label_positions(RADAR_SVG_SIZE):
+        width = pdf.get_string_width(label)
+        x = x0 + x * scale
+        if anchor == "end":
+            x -= width
+        elif anchor == "middle":
+            x -= width / 2
+        pdf.text(x, y0 + y * scale, label)
+
+
+def draw_report_page(pdf, scores, total_score, company="", location="", practitioner="", chart_svg=None):
+    """Рисует страницу отчёта в переданном документе (общая вёрстка для одиночных и сводных PDF)"""
+    pdf.add_page()
+
+    logo = _logo_bytes()
+    if logo:
+        pdf.image(io.BytesIO(logo), x=10, y=8, w=30)
+        pdf.ln(15)
+    else:
+        pdf.ln(10)
+
+    pdf.set_font('Arial','B',16)
+    pdf.cell(0,10,'AVCS Structural Integrity Module Report',0,1,'C')
+    pdf.ln(10)
+
+    pdf.set_font('Arial','',10)
+    pdf.cell(0,10,f'Generated: {datetime.now().strftime("%Y-%m-%d %H:%M")}',0,1,'R')
+    pdf.ln(5)
+
+    pdf.set_font('Arial','I',10)
+    pdf.cell(0,10,f'Certified AVCS Practitioner: {practitioner} (ID: #001)',0,1,'L')
+    if company:
+        pdf.cell(0,10,f'Company: {company}',0,1,'L')
+    if location:
+        pdf.cell(0,10,f'Location: {location}',0,1,'L')
+    pdf.ln(5)
+
+    pdf.set_font('Arial','B',12)
+    pdf.cell(0,10,f'Total Structural Integrity Score: {total_score:.1f} / 25',0,1)
+
+    pdf.set_font('Arial','B',12)
+    pdf.cell(0,10,f'Classification: {cls_from_score(total_score)}',0,1)
+    pdf.ln(10)
+
+    pdf.set_font('Arial','B',12)
+    pdf.cell(0,10,'Pillar Scores:',0,1)
+    pdf.set_font('Arial','',12)
+
+    pillars = [
+        ('Trigger Clarity', scores['trigger_clarity']),
+        ('Decision Ownership', scores['decision_ownership']),
+        ('Protected Intervention', scores['protected_intervention']),
+        ('Override Transparency', scores['override_transparency']),
+        ('Drift Detection', scores['drift_detection'])
+    ]
+
+    for p,s in pillars:
+        pdf.cell(0,10,f'{p}: {s:.1f}/5',0,1)
+
+    pdf.ln(5)
+    _draw_radar(pdf, scores, chart_svg)
+
+    pdf.set_y(-30)
+    pdf.set_font('Arial','I',8)
+    pdf.cell(0,10,'AVCS Structural Integrity Module',0,1,'C')
+    pdf.cell(0,10,'© 2026 Yeruslan Chihachyov, Operational Excellence Delivered Consulting',0,1,'C')
+
+
+def pdf_cache_key(scores, total_score, company="", location="", practitioner=""):
+    """Ключ кэша — хэш содержимого отчёта"""
+    payload = json.dumps(
+        [
+            {k: round(float(v), 4) for k, v in sorted(scores.items())},
+            round(float(total_score), 4),
+            company or "",
+            location or "",
+            practitioner or ""
+        ],
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _disk_path(key):
+    return os.path.join(PDF_CACHE_DIR, f"{key}.pdf")
+
+
+def _cache_get(key):
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            _stats['hits'] += 1
+            return data
+
+    if PDF_CACHE_DIR:
+        try:
+            with open(_disk_path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is not None:
+            _cache_put(key, data, write_disk=False)
+            with _lock:
+                _stats['disk_hits'] += 1
+            return data
+    return None
+
+
+def _cache_put(key, data, write_disk=True):
+    with _lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > PDF_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    if write_disk and PDF_CACHE_DIR:
+        try:
+            os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+            tmp = _disk_path(key) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, _disk_path(key))
+        except OSError as e:
+            print(f"Error writing PDF cache: {e}")
+
+
+def _render_and_store(key, args):
+    started = time.perf_counter()
+    try:
+        data = render_pdf(*args)
+        elapsed = time.perf_counter() - started
+        _cache_put(key, data)
+        with _lock:
+            _stats['renders'] += 1
+            _stats['render_seconds'] += elapsed
+            _stats['last_render_ms'] = elapsed * 1000
+        return data
+    finally:
+        with _lock:
+            _pending.pop(key, None)
+
+
+def request_pdf(scores, total_score, company="", location="", practitioner="", chart_svg=None):
+    """
+    Возвращает Future с байтами PDF.
+    Из кэша — сразу завершённый Future; иначе отчёт рендерится в фоновом
+    потоке, а одинаковые одновременные запросы получают один и тот же Future.
+    chart_svg (заранее отрендеренный радар) не входит в ключ — он выводится из scores.
+    """
+    key = pdf_cache_key(scores, total_score, company, location, practitioner)
+    data = _cache_get(key)
+    if data is not None:
+        future = Future()
+        future.set_result(data)
+        return future
+
+    with _lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        _stats['misses'] += 1
+        args = (dict(scores), total_score, company, location, practitioner, chart_svg)
+        future = _executor.submit(_render_and_store, key, args)
+        _pending[key] = future
+        return future
+
+
+@timed
+def get_pdf(scores, total_score, company="", location="", practitioner="", chart_svg=None):
+    """Синхронный вариант request_pdf"""
+    return request_pdf(scores, total_score, company, location, practitioner, chart_svg).result()
+
+
+def get_pdf_cache_stats():
+    """Метрики кэша PDF: попадания, промахи, время рендера"""
+    with _lock:
+        stats = dict(_stats)
+        stats['cached'] = len(_cache)
+        stats['pending'] = len(_pending)
+    stats['avg_render_ms'] = stats['render_seconds'] * 1000 / stats['renders'] if stats['renders'] else 0.0
+    return stats
@@ -0,0 +1,191 @@
+"""
+Компактное представление респондента для st.session_state.
+
+Вместо словаря словарей (с копией ответов и pd.Timestamp) респондент —
+объект с __slots__: роль — код в таблице ролей, ответы — по байту на вопрос
+анкеты (код варианта), оценки — по байту на pillar, время — int64 наносекунд.
+Доступ по ключам ('name', 'role', 'answers', 'scores', 'timestamp') сохранён,
+поэтому код, работавший со словарями, работает и с этими записями.
+
+Те же байты ответов и время идут в бинарный payload респондента в базе
+(encode_payload / decode_payload): версия, int64 наносекунд, коды ответов.
+"""
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+from modules.aggregation import PILLARS, ROLES
+from modules.scoring import MISSING, QUESTION_KEYS, QUESTION_OPTIONS, encode_answers
+
+# Таблица интернированных ролей: известные роли — заранее, прочие добавляются по мере появления
+_ROLE_NAMES = list(ROLES)
+_ROLE_CODES = {role: code for code, role in enumerate(_ROLE_NAMES)}
+# Новые роли добавляются из сессий Streamlit и потока записи одновременно
+_ROLE_LOCK = threading.Lock()
+
+FIELDS = ('name', 'role', 'answers', 'scores', 'timestamp')
+
+# Payload респондента в базе: версия, время в нс (NO_TIMESTAMP — нет), число ответов, коды ответов + 1
+PAYLOAD_VERSION = 1
+_PAYLOAD_HEADER = struct.Struct("<BqB")
+NO_TIMESTAMP = -(1 << 63)
+# Варианты ответов по коду из payload (код + 1, 0 — нет ответа)
+_OPTION_TABLES = tuple((key, (None, *QUESTION_OPTIONS[key])) for key in QUESTION_KEYS)
+
+
+def role_code(role):
+    """Код роли в таблице интернированных ролей"""
+    code = _ROLE_CODES.get(role)
+    if code is None:
+        role = sys.intern(str(role))
+        with _ROLE_LOCK:
+            code = _ROLE_CODES.get(role)
+            if code is None:
+                # имя — в таблицу раньше кода, чтобы читатель без блокировки не увидел код без имени
+                _ROLE_NAMES.append(role)
+                code = _ROLE_CODES[role] = len(_ROLE_NAMES) - 1
+    return code
+
+
+def _pack_answers(answers):
+    # код + 1, чтобы MISSING (-1) поместился в байт как 0
+    return bytes(code + 1 for code in encode_answers(answers or {}))
+
+
+def _pack_scores(scores):
+    """Оценки по pillar — bytes, если все целые 0..255, иначе кортеж float"""
+    values = [(scores or {}).get(p, 0) for p in PILLARS]
+    if all(float(v).is_integer() and 0 <= v <= 255 for v in values):
+        return bytes(int(v) for v in values)
+    return tuple(float(v) for v in values)
+
+
+def _timestamp_ns(timestamp):
+    if timestamp is None:
+        return time.time_ns()
+    if isinstance(timestamp, int):
+        return timestamp
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return round(timestamp.timestamp() * 1_000_000) * 1000
+
+
+def _datetime_from_ns(timestamp_ns):
+    seconds, ns = divmod(timestamp_ns, 1_000_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=ns // 1000)
+
+
+def encode_payload(respondent):
+    """Ответы и время респондента (Respondent или словарь) в компактный бинарный payload"""
+    if isinstance(respondent, Respondent):
+        codes, timestamp_ns = respondent.answer_codes, respondent.timestamp_ns
+    else:
+        codes = _pack_answers(respondent.get('answers'))
+        try:
+            timestamp = respondent.get('timestamp')
+            timestamp_ns = NO_TIMESTAMP if timestamp is None else _timestamp_ns(timestamp)
+        except ValueError:
+            # нераспознанная строка времени из старых JSON-блобов — ответы важнее
+            timestamp_ns = NO_TIMESTAMP
+    return _PAYLOAD_HEADER.pack(PAYLOAD_VERSION, timestamp_ns, len(codes)) + codes
+
+
+def decode_payload(payload):
+    """(ответы {ключ: вариант}, время datetime или None) из payload"""
+    version, timestamp_ns, count = _PAYLOAD_HEADER.unpack_from(payload)
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported respondent payload version {version}")
+    codes = payload[_PAYLOAD_HEADER.size:_PAYLOAD_HEADER.size + count]
+    answers = {key: options[code] for (key, options), code in zip(_OPTION_TABLES, codes) if 0 < code < len(options)}
+    timestamp = None if timestamp_ns == NO_TIMESTAMP else _datetime_from_ns(timestamp_ns)
+    return answers, timestamp
+
+
+class Respondent:
+    """Один респондент аудита; неизменяемый — правка заменяет запись целиком"""
+
+    __slots__ = ('name', 'role_code', '_answers', '_scores', 'timestamp_ns')
+
+    def __init__(self, name, role, answers=None, scores=None, timestamp=None):
+        self.name = name
+        self.role_code = role_code(role)
+        self._answers = _pack_answers(answers)
+        self._scores = _pack_scores(scores)
+        self.timestamp_ns = _timestamp_ns(timestamp)
+
+    @classmethod
+    def from_record(cls, record, timestamp=None):
+        """Из словаря (записи импорта, старого формата сессии)"""
+        if isinstance(record, cls):
+            return record
+        return cls(record.get('name'), record.get('role'), record.get('answers'), record.get('scores'),
+                   record.get('timestamp', timestamp))
+
+    @property
+    def role(self):
+        return _ROLE_NAMES[self.role_code]
+
+    @property
+    def answers(self):
+        return {
+            key: QUESTION_OPTIONS[key][code - 1]
+            for key, code in zip(QUESTION_KEYS, self._answers) if code != MISSING + 1
+        }
+
+    @property
+    def answer_codes(self):
+        """Коды ответов по QUESTION_KEYS, по байту на вопрос (код варианта + 1, 0 — нет ответа)"""
+        return self._answers
+
+    @property
+    def score_values(self):
+        """Оценки в порядке PILLARS — без промежуточного словаря"""
+        return tuple(self._scores)
+
+    @property
+    def scores(self):
+        return dict(zip(PILLARS, self._scores))
+
+    @property
+    def timestamp(self):
+        return _datetime_from_ns(self.timestamp_ns)
+
+    # Словарный интерфейс для кода, который работает с респондентами-словарями
+    def __getitem__(self, key):
+        if key not in FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in FIELDS else default
+
+    def keys(self):
+        return FIELDS
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in FIELDS}
+
+    def __eq__(self, other):
+        if not isinstance(other, Respondent):
+            return NotImplemented
+        return (self.name, self.role, self._answers, self._scores, self.timestamp_ns) == \
+            (other.name, other.role, other._answers, other._scores, other.timestamp_ns)
+
+    def __repr__(self):
+        return f"Respondent({self.name!r}, {self.role!r}, scores={self.scores})"
+
+    def __reduce__(self):
+        # коды ролей локальны для процесса, поэтому в pickle идёт имя роли
+        return _unpickle, (self.name, self.role, self._answers, self._scores, self.timestamp_ns)
+
+
+def _unpickle(name, role, answers, scores, timestamp_ns):
+    r = Respondent.__new__(Respondent)
+    r.name = name
+    r.role_code = role_code(role)
+    r._answers = answers
+    r._scores = scores
+    r.timestamp_ns = timestamp_ns
+    return r
@@ -0,0 +1,132 @@
+import json
+import os
+from functools import lru_cache
+
+from modules.aggregation import PILLARS
+from modules.metrics import timed
+
+DEFINITION_PATH = os.path.join(os.path.dirname(__file__), "questionnaire.json")
+
+MISSING = -1  # код отсутствующего или неизвестного ответа
+
+CLASSIFICATIONS = [
+    "HIGH STRUCTURAL VULNERABILITY",
+    "CONDITIONAL STABILITY",
+    "STRUCTURALLY CONTROLLED",
+    "ARCHITECTURALLY RESILIENT"
+]
+
+
+def load_definition(path=DEFINITION_PATH):
+    """Читает декларативное описание анкеты (вопросы, варианты, баллы)"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compile_definition(definition):
+    """
+    Компилирует анкету в таблицы поиска:
+    - options: {ключ вопроса: кортеж вариантов}, для форм
+    - codes: {ключ вопроса: {вариант: код}}, для кодирования ответов
+    - points: матрица баллов (вопросы × варианты + столбец «нет ответа»)
+    - membership: матрица принадлежности (вопросы × pillars)
+    """
+    compiled = _compile_lookup(definition)
+    compiled.update(_compile_tables(definition))
+    return compiled
+
+
+def _compile_lookup(definition):
+    """Чисто питоновская часть компиляции — нужна формам уже на первом шаге"""
+    pillar_ids = [p['id'] for p in definition['pillars']]
+    if tuple(pillar_ids) != PILLARS:
+        raise ValueError(f"Questionnaire pillars {pillar_ids} do not match {PILLARS}")
+
+    options, codes = {}, {}
+    for p in definition['pillars']:
+        for q in p['questions']:
+            labels = tuple(o['label'] for o in q['options'])
+            options[q['key']] = labels
+            codes[q['key']] = {label: code for code, label in enumerate(labels)}
+
+    return {
+        'pillars': tuple(definition['pillars']),
+        'question_keys': tuple(q['key'] for p in definition['pillars'] for q in p['questions']),
+        'options': options,
+        'codes': codes,
+        'max_score': definition.get('max_pillar_score', 5)
+    }
+
+
+def _compile_tables(definition):
+    """Матрицы NumPy для пакетной оценки"""
+    import numpy as np
+
+    questions = [(j, q) for j, p in enumerate(definition['pillars']) for q in p['questions']]
+    width = max(len(q['options']) for _, q in questions) + 1
+
+    points = np.zeros((len(questions), width), dtype=np.int16)
+    membership = np.zeros((len(questions), len(PILLARS)), dtype=np.int16)
+    for i, (j, q) in enumerate(questions):
+        for code, o in enumerate(q['options']):
+            points[i, code] = o['points']
+        membership[i, j] = 1
+
+    return {'points': points, 'membership': membership}
+
+
+_DEFINITION = load_definition()
+_COMPILED = _compile_lookup(_DEFINITION)
+
+PILLAR_DEFINITIONS = _COMPILED['pillars']
+QUESTION_KEYS = _COMPILED['question_keys']
+QUESTION_OPTIONS = _COMPILED['options']
+
+
+@lru_cache(maxsize=1)
+def _tables():
+    """Таблицы баллов строятся при первой оценке, а не при импорте модуля"""
+    return _compile_tables(_DEFINITION)
+
+
+def encode_answers(answers):
+    """Переводит ответы в коды вариантов (MISSING — нет или неизвестный ответ)"""
+    codes = _COMPILED['codes']
+    return [codes[k].get(answers.get(k), MISSING) for k in QUESTION_KEYS]
+
+
+def _score_codes(code_matrix):
+    """Баллы по pillars для матрицы кодов (анкеты × вопросы)"""
+    import numpy as np
+
+    tables = _tables()
+    # MISSING (-1) указывает на последний столбец таблицы, где 0 баллов
+    per_question = tables['points'][np.arange(len(QUESTION_KEYS)), code_matrix]
+    return np.minimum(per_question @ tables['membership'], _COMPILED['max_score'])
+
+
+@timed
+def score_batch(list_of_answers):
+    """Оценивает пакет анкет; возвращает массив (анкеты × pillars)"""
+    import numpy as np
+
+    code_matrix = np.array([encode_answers(a) for a in list_of_answers], dtype=np.int16)
+    return _score_codes(code_matrix.reshape(-1, len(QUESTION_KEYS)))
+
+
+def score_answers(answers):
+    """Оценивает одну анкету; возвращает {pillar: балл}"""
+    row = score_batch([answers])[0]
+    return {p: int(s) for p, s in zip(PILLARS, row)}
+
+
+def score_pillar(pillar, answers):
+    """Балл одного pillar — для пошагового мастера"""
+    return score_answers(answers)[pillar]
+
+
+def cls_from_score(score):
+    if score <= 10: return "HIGH STRUCTURAL VULNERABILITY"
+    elif score <= 17: return "CONDITIONAL STABILITY"
+    elif score <= 22: return "STRUCTURALLY CONTROLLED"
+    else: return "ARCHITECTURALLY RESILIENT"
@@ -0,0 +1,141 @@
+"""
+Отчёт о времени импортов по этапам запуска приложения.
+
+    python -m modules.startup_profile [--top 15] [--json] [--budget-ms 1500]
+    streamlit run app.py -- --profile-startup
+
+Этапы импортируются по очереди в отдельном холодном интерпретаторе
+с `python -X importtime`: каждому этапу достаются только модули,
+не загруженные предыдущими, поэтому видно, на каком шаге приходит зависимость.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Этапы — что импортирует приложение к моменту открытия соответствующей страницы
+STAGES = (
+    ("streamlit", ["streamlit"]),
+    ("login", ["modules.auth", "modules.database"]),
+    ("new_audit", ["modules.interview_manager", "modules.scoring", "modules.bulk_import",
+                   "modules.playbook_generator", "modules.batch_export"]),
+    ("scoring", ["numpy"]),
+    ("radar_chart", ["plotly.graph_objects"]),
+    ("pdf_export", ["fpdf"]),
+    ("history", ["pandas"]),
+)
+
+# Тяжёлые зависимости, которые не должны попадать на экран логина
+HEAVY_MODULES = ("pandas", "numpy", "plotly", "fpdf")
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_reported = False
+
+
+def _parse_importtime(stderr):
+    """
+    Разбирает вывод -X importtime: [(модуль, глубина, self_us, cumulative_us)].
+    Глубина — уровень вложенности импорта (0 — импортирован напрямую этапом).
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            name = name[1:]
+            depth = (len(name) - len(name.lstrip())) // 2
+            rows.append((name.strip(), depth, int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def _top_level(name):
+    return name.split(".", 1)[0]
+
+
+def profile_stages(stages=STAGES):
+    """
+    Импортирует этапы по очереди в одном холодном интерпретаторе.
+    Возвращает список {stage, ms, modules: [(модуль, cumulative_ms)], heavy}.
+    """
+    marker = "@@stage "
+    script = "\n".join(
+        f"import sys\nprint({marker + name!r}, file=sys.stderr, flush=True)\n"
+        + "\n".join(f"import {m}" for m in modules)
+        for name, modules in stages
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        cwd=PROJECT_ROOT, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed")
+
+    results = []
+    chunks = proc.stderr.split(marker)[1:]
+    for (name, _), chunk in zip(stages, chunks):
+        rows = _parse_importtime(chunk)
+        # пакет засчитывается этапу, на котором загружен его корневой модуль
+        loaded = {n for n, _, _, _ in rows if n == _top_level(n)}
+        results.append({
+            'stage': name,
+            'ms': sum(c for _, depth, _, c in rows if depth == 0) / 1000,
+            'modules': sorted(((n, c / 1000) for n, _, _, c in rows),
+                              key=lambda item: item[1], reverse=True),
+            'heavy': sorted(m for m in HEAVY_MODULES if m in loaded)
+        })
+    return results
+
+
+def format_report(results, top=10):
+    """Текстовый отчёт: время этапа, тяжёлые модули и самые дорогие импорты"""
+    lines = ["AVCS startup import profile (cumulative, cold interpreter)"]
+    for r in results:
+        heavy = f"  heavy: {', '.join(r['heavy'])}" if r['heavy'] else ""
+        lines.append(f"\n[{r['stage']}] {r['ms']:.1f} ms{heavy}")
+        for name, ms in r['modules'][:top]:
+            lines.append(f"  {ms:9.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+def print_report_once(top=10):
+    """Печатает отчёт один раз на процесс (для флага --profile-startup в app.py)"""
+    global _reported
+    if _reported:
+        return
+    _reported = True
+    try:
+        print(format_report(profile_stages(), top=top), flush=True)
+    except Exception as e:
+        print(f"Error profiling startup: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import-time report for the AVCS app startup path")
+    parser.add_argument("--top", type=int, default=10, help="modules to list per stage")
+    parser.add_argument("--json", action="store_true", help="print machine-readable JSON")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="exit with code 1 if the login stage exceeds this budget")
+    args = parser.parse_args(argv)
+
+    results = profile_stages()
+    if args.json:
+        print(json.dumps([dict(r, modules=r['modules'][:args.top]) for r in results], indent=2))
+    else:
+        print(format_report(results, top=args.top))
+
+    login = next(r for r in results if r['stage'] == "login")
+    if login['heavy']:
+        print(f"\nWARNING: login path imports {', '.join(login['heavy'])}", file=sys.stderr)
+    if args.budget_ms is not None and login['ms'] > args.budget_ms:
+        print(f"\nLogin stage {login['ms']:.1f} ms exceeds budget {args.budget_ms:.1f} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
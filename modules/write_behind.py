@@ -0,0 +1,191 @@
+"""
+Отложенная запись в SQLite: сохранение и удаление аудитов, события черновиков.
+
+Вызовы из UI только кладут операцию в очередь и сразу возвращаются (ID нового
+аудита берётся из зарезервированного диапазона). Единственный поток-писатель
+забирает накопившиеся операции и записывает их одной транзакцией; занятую
+базу (database is locked) переживает повторами с паузой.
+
+Каждая операция получает Future: он завершается после коммита или с ошибкой,
+если операцию записать не удалось, — UI может дождаться подтверждения.
+
+Метрики: avcs_write_queue_depth (gauge), write_behind.flush — время записи
+пачки, write_behind.lag — от постановки операции в очередь до коммита.
+"""
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, wait
+from datetime import datetime
+
+from modules import database, metrics
+
+WRITE_BATCH_SIZE = 500      # операций в одной транзакции
+WRITE_DELAY = 0.05          # сколько подождать после первой операции, чтобы собрать пачку
+WRITE_RETRIES = 5           # повторы пачки при занятой базе
+RETRY_BACKOFF = 0.1         # пауза перед первым повтором, дальше удваивается
+AUDIT_ID_BLOCK = 16         # сколько ID аудитов резервировать за одно обращение к базе
+EXIT_FLUSH_TIMEOUT = 10.0
+
+_queue = queue.Queue()
+_writer = None
+_writer_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'batches': 0, 'ops': 0, 'retries': 0, 'dropped': 0, 'flush_seconds': 0.0, 'last_flush_ms': 0.0}
+
+_id_lock = threading.Lock()
+_id_block = [None, 0, 0]  # [база, следующий свободный ID, конец диапазона (не включая)]
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name="write-behind", daemon=True)
+            _writer.start()
+
+
+def submit(op):
+    """Ставит операцию database.write_ops в очередь; Future завершается после её записи"""
+    _ensure_writer()
+    future = Future()
+    _queue.put((time.perf_counter(), op, future))
+    return future
+
+
+def _write_loop():
+    while True:
+        batch = [_queue.get()]
+        time.sleep(WRITE_DELAY)
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        writes = [(op, future) for _, op, future in batch if op[0] != 'flush']
+        errors = _write_batch([op for op, _ in writes], enqueued_at=batch[0][0]) if writes else []
+        for (_, future), error in zip(writes, errors):
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+        for _, op, future in batch:
+            if op[0] == 'flush':
+                future.set_result(None)
+            _queue.task_done()
+
+
+def _write_with_retry(ops):
+    """Пишет операции одной транзакцией; при занятой базе повторяет. Возвращает исключение или None"""
+    for attempt in range(WRITE_RETRIES + 1):
+        try:
+            database.write_ops(ops)
+            return None
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e) or attempt == WRITE_RETRIES:
+                return e
+            with _stats_lock:
+                _stats['retries'] += 1
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+        except Exception as e:
+            return e
+
+
+def _write_batch(ops, enqueued_at):
+    """Пишет пачку; возвращает ошибки по операциям (None — записана)"""
+    started = time.perf_counter()
+    with metrics.timed_block("write_behind.flush"):
+        error = _write_with_retry(ops)
+        if error is None:
+            errors = [None] * len(ops)
+        elif len(ops) > 1:
+            # одна неудачная операция не должна терять всю пачку — пишем по одной
+            errors = [_write_with_retry([op]) for op in ops]
+        else:
+            errors = [error]
+        for op, op_error in zip(ops, errors):
+            if op_error is not None:
+                print(f"Error writing {op[0]} ({op[1]}): {op_error}")
+        dropped = sum(op_error is not None for op_error in errors)
+    finished = time.perf_counter()
+    metrics.observe("write_behind.lag", finished - enqueued_at)
+
+    with _stats_lock:
+        _stats['batches'] += 1
+        _stats['ops'] += len(ops) - dropped
+        _stats['dropped'] += dropped
+        _stats['flush_seconds'] += finished - started
+        _stats['last_flush_ms'] = (finished - started) * 1000
+    return errors
+
+
+def flush(timeout=5.0):
+    """Ждёт, пока всё поставленное в очередь будет записано; False — не успели"""
+    done = submit(('flush',))
+    return wait([done], timeout).not_done == set()
+
+
+def get_write_stats():
+    """Счётчики писателя и текущая глубина очереди"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['queue_depth'] = _queue.qsize()
+    stats['avg_flush_ms'] = stats['flush_seconds'] * 1000 / stats['batches'] if stats['batches'] else 0.0
+    return stats
+
+
+metrics.register_gauge("avcs_write_queue_depth", "Operations waiting for the write-behind thread.", _queue.qsize)
+
+
+@atexit.register
+def _flush_at_exit():
+    if _writer is not None and _writer.is_alive():
+        flush(EXIT_FLUSH_TIMEOUT)
+
+
+# ------------------------------
+# Аудиты
+# ------------------------------
+def _next_audit_id():
+    """Следующий ID из зарезервированного диапазона; новый диапазон берётся раз в AUDIT_ID_BLOCK аудитов"""
+    with _id_lock:
+        if _id_block[0] != database.DB_PATH or _id_block[1] >= _id_block[2]:
+            first = database.reserve_audit_ids(AUDIT_ID_BLOCK)
+            _id_block[:] = [database.DB_PATH, first, first + AUDIT_ID_BLOCK]
+        audit_id = _id_block[1]
+        _id_block[1] += 1
+        return audit_id
+
+
+def enqueue_save_audit(practitioner_name, company_name, location, total_score, classification, scores_dict,
+                       respondents_list, prerender_chart=True, playbook=None, playbook_key=None, draft_id=None):
+    """
+    Как database.save_audit, но запись идёт в фоне: возвращает (ID, Future) сразу,
+    аудит появляется в базе после ближайшего сброса очереди. Черновик draft_id
+    закрывается той же операцией — только если аудит записан.
+    """
+    audit_id = _next_audit_id()
+    future = submit(('save_audit', audit_id, dict(
+        practitioner_name=practitioner_name,
+        company_name=company_name,
+        location=location,
+        total_score=total_score,
+        classification=classification,
+        scores_dict=dict(scores_dict),
+        respondents_list=list(respondents_list or []),
+        prerender_chart=prerender_chart,
+        playbook=playbook,
+        playbook_key=playbook_key,
+        audit_date=datetime.now().strftime("%Y-%m-%d")
+    ), draft_id))
+    return audit_id, future
+
+
+def enqueue_delete_audit(audit_id):
+    """Как database.delete_audit, но в фоне; Future завершается после удаления"""
+    return submit(('delete_audit', audit_id))